@@ -1,5 +1,18 @@
 from .models import create_model
-from .core import *
+from .core import metrics, Postprocess, SparsePostprocess
 from .util import *
 from .config import *
-from .api import *
\ No newline at end of file
+from .api import *
+
+
+def __getattr__(name):
+    # resolved on first use, see efold.config and efold.core
+    if name == "device":
+        from . import config
+
+        return config.device
+    if name in ["DataModule", "Dataset"]:
+        from . import core
+
+        return getattr(core, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
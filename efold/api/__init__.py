@@ -1 +1,3 @@
-from .run import run as inference
\ No newline at end of file
+from .run import run as inference
+from .stream import predict_iter, apredict_iter
+from .client import Client
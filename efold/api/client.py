@@ -0,0 +1,62 @@
+import http.client
+import json
+import socket
+from typing import List
+from urllib.parse import urlparse
+
+from .server import DEFAULT_PORT
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class Client:
+    """Client of a local `efold serve` server.
+
+    Args:
+        url (str): http://host:port, or unix:///path/to/socket.
+
+    Example:
+    >>> client = Client("unix:///tmp/efold.sock")
+    >>> client.socket_path
+    '/tmp/efold.sock'
+    """
+
+    def __init__(self, url: str = f"http://127.0.0.1:{DEFAULT_PORT}", timeout: float = None):
+        parsed = urlparse(url)
+        self.timeout = timeout
+        self.socket_path = parsed.path if parsed.scheme == "unix" else None
+        self.host = parsed.hostname
+        self.port = parsed.port or DEFAULT_PORT
+
+    def _request(self, method, path, body=None):
+        if self.socket_path is not None:
+            conn = _UnixHTTPConnection(self.socket_path, timeout=self.timeout)
+        else:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            data = None if body is None else json.dumps(body)
+            conn.request(method, path, body=data, headers={"Content-Type": "application/json"})
+            response = conn.getresponse()
+            out = json.loads(response.read())
+        finally:
+            conn.close()
+        if response.status != 200:
+            raise RuntimeError("efold server error: {}".format(out.get("error")))
+        return out
+
+    def fold(self, sequences: List[str], fmt: str = "dotbracket"):
+        """Returns the structures of the sequences, in order, in the same format as run()."""
+        structures = self._request("POST", "/fold", {"sequences": sequences, "fmt": fmt})["structures"]
+        return [s if isinstance(s, str) else [tuple(bp) for bp in s] for s in structures]
+
+    def stats(self):
+        return self._request("GET", "/stats")
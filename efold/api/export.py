@@ -0,0 +1,150 @@
+import json
+import os
+from os.path import join, dirname
+from typing import List
+import torch
+from torch import nn, Tensor
+from ..core.embeddings import sequence_to_int
+from ..core.postprocess import Postprocess
+
+EXPORT_FORMATS = ["torchscript", "onnx"]
+TEST_DATA_DIR = join(dirname(dirname(dirname(__file__))), "tests", "data")
+
+
+class SequenceToStructure(nn.Module):
+    """Tensor-only view of eFold: (N, L) integer encoded sequence to (N, L, L) structure logits."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, sequence: Tensor) -> Tensor:
+        return self.model.forward_sequence(sequence)
+
+
+def _export_format(path: str, fmt: str = None):
+    if fmt is None:
+        fmt = "onnx" if path.endswith(".onnx") else "torchscript"
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Invalid export format {fmt}. Must be one of {EXPORT_FORMATS}")
+    return fmt
+
+
+def export(path: str, fmt: str = None, model=None, example_length: int = 64):
+    """Exports eFold, seq2map included, to a self-contained TorchScript or ONNX graph.
+
+    Args:
+        path (str): Output file. The format is inferred from the extension if fmt is None (.onnx for ONNX, TorchScript otherwise).
+        fmt (str): 'torchscript' or 'onnx'.
+        model: eFold model to export. Defaults to the packaged weights.
+        example_length (int): Length of the sequence used for tracing. Batch size and length stay dynamic.
+
+    Returns:
+        str: path to the exported graph.
+    """
+    fmt = _export_format(path, fmt)
+    if model is None:
+        from .run import load_model
+
+        model = load_model("cpu")
+    wrapper = SequenceToStructure(model).eval()
+    # a batch of 2, as tracers specialize dimensions of size 1
+    example = torch.randint(1, 5, (2, example_length), dtype=torch.int64)
+
+    with torch.no_grad():
+        if fmt == "torchscript":
+            torch.jit.trace(wrapper, example, check_trace=False).save(path)
+        else:
+            torch.onnx.export(
+                wrapper,
+                (example,),
+                path,
+                input_names=["sequence"],
+                output_names=["structure"],
+                dynamic_axes={
+                    "sequence": {0: "batch", 1: "length"},
+                    "structure": {0: "batch", 1: "length", 2: "length"},
+                },
+                opset_version=18,
+            )
+    return path
+
+
+def load_exported(path: str, fmt: str = None, device="cpu"):
+    """Loads an exported graph as a callable mapping (N, L) integer sequences to (N, L, L) structure logits."""
+    if not os.path.exists(path):
+        raise ValueError("File not found")
+
+    if _export_format(path, fmt) == "torchscript":
+        return torch.jit.load(path, map_location=device).eval()
+
+    try:
+        import onnxruntime
+    except ImportError:
+        raise ImportError(
+            "The onnx backend requires onnxruntime. Install it with `pip install onnxruntime`."
+        )
+    session = onnxruntime.InferenceSession(path, providers=["CPUExecutionProvider"])
+
+    def predict(sequence: Tensor) -> Tensor:
+        (structure,) = session.run(None, {"sequence": sequence.cpu().numpy()})
+        return torch.from_numpy(structure)
+
+    return predict
+
+
+def load_test_sequences(name: str, max_len: int = None, data_dir: str = TEST_DATA_DIR):
+    """Returns the {reference: sequence} of a test set bundled in tests/data."""
+    with open(join(data_dir, name, "data.json"), "r") as f:
+        data = json.load(f)
+    return {
+        ref: values["sequence"]
+        for ref, values in data.items()
+        if max_len is None or len(values["sequence"]) <= max_len
+    }
+
+
+def validate(
+    path: str,
+    fmt: str = None,
+    names: List[str] = None,
+    max_len: int = 500,
+    data_dir: str = TEST_DATA_DIR,
+    model=None,
+):
+    """Compares an exported graph against the eager model on the bundled test sets, on CPU.
+
+    Args:
+        model: eager eFold model the graph was exported from. Defaults to the packaged weights.
+
+    Returns:
+        dict: for each test set, the number of sequences, the max absolute difference of the logits and the fraction of sequences with the same post-processed structure.
+    """
+    if model is None:
+        from .run import load_model
+
+        model = load_model("cpu")
+    exported = load_exported(path, fmt=fmt, device="cpu")
+    postprocesser = Postprocess()
+    if names is None:
+        names = sorted(os.listdir(data_dir))
+
+    report = {}
+    for name in names:
+        max_diff, same_structure = 0.0, 0
+        sequences = load_test_sequences(name, max_len=max_len, data_dir=data_dir)
+        for sequence in sequences.values():
+            seq = sequence_to_int(sequence).unsqueeze(0)
+            with torch.inference_mode():
+                eager = model.forward_sequence(seq)
+                graph = exported(seq).to(eager.dtype)
+            max_diff = max(max_diff, (eager - graph).abs().max().item())
+            same_structure += bool(
+                (postprocesser.run(eager, seq) == postprocesser.run(graph, seq)).all()
+            )
+        report[name] = {
+            "n": len(sequences),
+            "max_abs_diff": max_diff,
+            "same_structure": same_structure / max(len(sequences), 1),
+        }
+    return report
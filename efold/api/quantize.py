@@ -0,0 +1,107 @@
+import copy
+import json
+import os
+from os.path import join
+from typing import List
+import numpy as np
+import torch
+from torch import nn
+from torch.ao import quantization
+from ..core.embeddings import sequence_to_int, base_pairs_to_pairing_matrix
+from ..core.metrics import f1
+from ..core.postprocess import Postprocess
+from ..models.evofold import ResLayer
+from .export import load_test_sequences, TEST_DATA_DIR
+
+QUANTIZATION_MODES = ["dynamic", "static"]
+
+
+def calibration_sequences(n_per_set: int = 8, max_len: int = 200, data_dir: str = TEST_DATA_DIR):
+    """Sequences used to calibrate the activation observers: the first ones of each bundled test set, or random sequences if tests/data is not available."""
+    if os.path.isdir(data_dir):
+        return [
+            seq
+            for name in sorted(os.listdir(data_dir))
+            for seq in list(load_test_sequences(name, max_len=max_len, data_dir=data_dir).values())[:n_per_set]
+        ]
+    rng = np.random.default_rng(0)
+    return ["".join(rng.choice(list("ACGU"), length)) for length in rng.integers(20, max_len, 4 * n_per_set)]
+
+
+def _wrap_res_layer_convs(model: nn.Module):
+    """Surrounds every conv of the ResLayer stacks with quant/dequant stubs, so that only these are statically quantized."""
+    qconfig = quantization.get_default_qconfig(torch.backends.quantized.engine)
+    for res_layer in [m for m in model.modules() if isinstance(m, ResLayer)]:
+        for parent in list(res_layer.modules()):
+            for name, child in parent.named_children():
+                if isinstance(child, nn.Conv2d):
+                    wrapped = nn.Sequential(quantization.QuantStub(), child, quantization.DeQuantStub())
+                    wrapped.qconfig = qconfig
+                    setattr(parent, name, wrapped)
+    return model
+
+
+def quantize(model: nn.Module, mode: str = "dynamic", sequences: List[str] = None):
+    """Returns an int8 copy of eFold for CPU inference.
+
+    Args:
+        model: eFold model, on CPU and in eval mode.
+        mode (str): 'dynamic' quantizes the nn.Linear layers with dynamic int8. 'static' also quantizes the ResLayer convolutions with static int8, after a calibration pass over `sequences`.
+        sequences (list): calibration sequences for the 'static' mode. Defaults to calibration_sequences().
+    """
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Invalid quantization mode {mode}. Must be one of {QUANTIZATION_MODES}")
+    if mode == "static":
+        model = quantization.prepare(_wrap_res_layer_convs(copy.deepcopy(model)))
+        with torch.no_grad():
+            for sequence in sequences or calibration_sequences():
+                model.forward_sequence(sequence_to_int(sequence).unsqueeze(0))
+        model = quantization.convert(model)
+
+    model = quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    return model.eval()
+
+
+def compare(
+    quantized: nn.Module,
+    model: nn.Module,
+    names: List[str] = None,
+    max_len: int = 500,
+    data_dir: str = TEST_DATA_DIR,
+):
+    """F1 of the fp32 and quantized models on the bundled test sets, on CPU.
+
+    Returns:
+        dict: for each test set, the number of sequences, the mean F1 in fp32 and int8, and their difference (None without sequences).
+    """
+    postprocesser = Postprocess()
+    if names is None:
+        names = sorted(os.listdir(data_dir))
+
+    report = {}
+    for name in names:
+        with open(join(data_dir, name, "data.json"), "r") as f:
+            data = json.load(f)
+        scores = {"fp32": [], "int8": []}
+        for values in data.values():
+            if len(values["sequence"]) > max_len:
+                continue
+            seq = sequence_to_int(values["sequence"]).unsqueeze(0)
+            true = base_pairs_to_pairing_matrix(
+                torch.tensor(values["structure"]), seq.shape[1], padding=seq.shape[1]
+            )
+            for key, m in [("fp32", model), ("int8", quantized)]:
+                with torch.inference_mode():
+                    pred = postprocesser.run(m.forward_sequence(seq), seq)[0]
+                scores[key].append(f1(pred, true))
+        if not scores["fp32"]:
+            # no sequence under max_len, the scores are None rather than a NaN mean, which JSON does not allow
+            report[name] = {"n": 0, "f1_fp32": None, "f1_int8": None, "f1_delta": None}
+            continue
+        report[name] = {
+            "n": len(scores["fp32"]),
+            "f1_fp32": float(np.mean(scores["fp32"])),
+            "f1_int8": float(np.mean(scores["int8"])),
+            "f1_delta": float(np.mean(scores["int8"]) - np.mean(scores["fp32"])),
+        }
+    return report
@@ -0,0 +1,113 @@
+import gc
+import torch
+from ..core.embeddings import sequence_to_int
+from .window import fold_windowed, sparse_postprocesser
+
+# smallest window the out-of-memory fallback folds a sequence in
+MIN_WINDOW = 64
+
+# logits under this are left out of the sparse post-processing fallback, as exact zeros (probability < 1%)
+SPARSE_LOGIT_CUTOFF = -4.6
+
+
+def is_oom(e: BaseException):
+    """Whether an exception is an allocation failure, on CPU, CUDA or MPS.
+
+    Example:
+    >>> is_oom(RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB")), is_oom(ValueError("out of memory"))
+    (True, False)
+    """
+    if isinstance(e, MemoryError):
+        return True
+    return isinstance(e, RuntimeError) and any(m in str(e) for m in ["out of memory", "can't allocate memory", "Failed to allocate"])
+
+
+def _free_memory():
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def _postprocess(logits, index, sequence, fmt, degraded):
+    """Dense post-processing, or SparsePostprocess on the pairs above SPARSE_LOGIT_CUTOFF if it runs out of memory."""
+    from .run import _postprocess as postprocess, _format
+
+    try:
+        return postprocess(logits, sequence, fmt)
+    except Exception as e:
+        if not is_oom(e):
+            raise
+    _free_memory()
+    rows, cols = torch.nonzero(logits > SPARSE_LOGIT_CUTOFF, as_tuple=True)
+    rows, cols = rows[rows < cols], cols[rows < cols]
+    pairs = sparse_postprocesser.run(rows, cols, logits[rows, cols], sequence_to_int(sequence))
+    degraded.append({"index": index, "sequence": sequence, "path": "sparse_postprocess"})
+    return _format([(i + 1, j + 1) for i, j in pairs], sequence, fmt)
+
+
+def fold_windowed_resilient(predictor, index, sequence, fmt, device, degraded, window, stride=None, max_span=None, dense=False):
+    """fold_windowed, which falls back to one window at a time, then to windows halved down to MIN_WINDOW, as long as it runs out of memory.
+
+    A sequence that does not fit in the smallest window is recorded as failed and its structure is None.
+    With `dense`, the sequence was first folded whole, so that it is recorded as windowed even at the first window.
+    """
+    requested, batch_size = None if dense else window, 8
+    while True:
+        error = None
+        try:
+            structure = fold_windowed(predictor, sequence, fmt, device=device, window=window, stride=stride, max_span=max_span, batch_size=batch_size)
+        except Exception as e:
+            if not is_oom(e):
+                raise
+            error = repr(e)
+        if error is None:
+            break
+        # retried out of the except block, whose traceback holds the frames and tensors of the failed fold
+        _free_memory()
+        if batch_size > 1:
+            batch_size = 1
+        elif window // 2 < MIN_WINDOW:
+            degraded.append({"index": index, "sequence": sequence, "path": "failed", "error": error})
+            return None
+        else:
+            window, stride, max_span = window // 2, None, None
+    if window != requested:
+        degraded.append({"index": index, "sequence": sequence, "path": "windowed", "window": window})
+    return structure
+
+
+def fold_resilient(predictor, records, fmt="dotbracket", device="cpu", degraded=None):
+    """Folds (index, sequence) records of the same length as one batch, and recovers from out-of-memory errors.
+
+    A batch that runs out of memory is split in half and each half retried, which gives the
+    same structures. A sequence that does not fit on its own is folded in windows of half its
+    length, or smaller (see fold_windowed_resilient), unless it is no longer than MIN_WINDOW,
+    which fails. A post-processing that runs out of memory falls back to SparsePostprocess.
+    The sequences that took one of these last paths, whose structures may differ from a dense
+    fold, are appended to `degraded` as {'index', 'sequence', 'path'}.
+
+    Returns:
+        list: the structure of each record, in order.
+    """
+    from .run import _predict_logits
+
+    degraded = [] if degraded is None else degraded
+    error = None
+    try:
+        logits = _predict_logits(predictor, [seq for _, seq in records], device)
+    except Exception as e:
+        if not is_oom(e):
+            raise
+        error = repr(e)
+    if error is not None:
+        _free_memory()
+        if len(records) > 1:
+            half = len(records) // 2
+            return fold_resilient(predictor, records[:half], fmt, device, degraded) + fold_resilient(predictor, records[half:], fmt, device, degraded)
+        index, sequence = records[0]
+        window = max(len(sequence) // 2, MIN_WINDOW)
+        if window >= len(sequence):
+            degraded.append({"index": index, "sequence": sequence, "path": "failed", "error": error})
+            return [None]
+        return [fold_windowed_resilient(predictor, index, sequence, fmt, device, degraded, window=window, dense=True)]
+    return [_postprocess(logit, index, seq, fmt, degraded) for (index, seq), logit in zip(records, logits)]
@@ -1,55 +1,166 @@
 import os
+import warnings
 from typing import List, Union
-from ..models import create_model
 import torch
 from os.path import join, dirname
-from ..core import batch
 from ..core.embeddings import sequence_to_int
+from ..config import int2seq, PADDING_TOKEN
+from ..core.batch import _pad
 from ..core.postprocess import Postprocess
 import numpy as np
 from ..util.format_conversion import convert_bp_list_to_dotbracket
+from .export import load_exported
+from .quantize import quantize
+from .workers import predict_sharded
+from .client import Client
+from .window import fold_banded
+from .resilient import fold_resilient, fold_windowed_resilient
+from .weights import load_efold
+from ..models.cost import load_cost_model
+from ..util.timing import span
 
 torch.set_default_dtype(torch.float32)
 
 postprocesser = Postprocess()
 
-def _load_sequences_from_fasta(fasta:str):
+BACKENDS = ["torch", "torchscript", "onnx"]
+
+# structure formats of run(): dot-bracket strings, or lists of 1-indexed base pairs ('basepair' and 'bp')
+FORMATS = ["dotbracket", "basepair", "bp"]
+
+# what run() does with a sequence that does not fit in the memory budget
+OVERFLOW = ["window", "refuse"]
+
+def _load_records_from_fasta(fasta:str):
+    """Yields the (id, sequence) records of a fasta file, one at a time."""
+    name, sequence = None, None
     with open(fasta, "r") as f:
-        lines = f.readlines()
-    sequences = []
-    for line in lines:
-        if line.startswith(">"):
-            sequences.append("")
-        else:
-            sequences[-1] += line.strip()
-    return sequences
-
-def _predict_structure(model, sequence:str, device='cpu'):
-
-    seq = sequence_to_int(sequence).unsqueeze(0) 
-    b = batch.Batch(
-        sequence=seq,
-        reference=[""],
-        length=[len(seq)],
-        L = len(seq),
-        use_error=False,
-        batch_size=1,
-        data_types=["sequence"],
-        dt_count={"sequence": 1}).to(device)
-    
-    # predict the structure
-    with torch.inference_mode():
-        pred = model(b)
-        structure = postprocesser.run(pred['structure'].to('cpu'), b.get('sequence').to('cpu')).numpy().round()[0]
+        for line in f:
+            if line.startswith(">"):
+                if sequence is not None:
+                    yield name, sequence
+                name, sequence = line[1:].strip(), ""
+            else:
+                sequence += line.strip()
+    if sequence is not None:
+        yield name, sequence
+
+def _load_sequences_from_fasta(fasta:str):
+    return [sequence for _, sequence in _load_records_from_fasta(fasta)]
+
+def _get_device(device=None, quantization=None):
+    if quantization is not None:
+        if device is not None and torch.device(device).type != "cpu":
+            raise ValueError("Quantized inference only runs on CPU")
+        return torch.device("cpu")
+    if not device:
+        if torch.cuda.is_available():
+            return torch.device("cuda")
+        return torch.device("cpu")
+    return device
+
+def load_model(device="cpu", path=None):
+    """Loads eFold with the packaged weights, or the weights at `path`, in eval mode. See efold.api.weights."""
+    return load_efold(path, device)
+
+def _load_predictor(backend, device, model_path=None, quantization=None, model=None):
+    """Returns a callable mapping (N, L) integer sequences to (N, L, L) structure logits."""
+    if backend == "torch":
+        if model is None:
+            model = load_model(device)
+        if quantization is not None:
+            model = quantize(model, mode=quantization)
+        return model.forward_sequence
+    if quantization is not None:
+        raise ValueError("Quantization is only available with the torch backend")
+    if model_path is None:
+        raise ValueError("model_path must be provided for the {} backend, see efold.api.export".format(backend))
+    return load_exported(model_path, fmt=backend, device=device)
+
+def _encode(sequences:List[str], device='cpu'):
+    """Integer encodes the sequences into one (N, L) batch, padded with X."""
+    L = max(len(seq) for seq in sequences)
+    return torch.stack([_pad(sequence_to_int(seq), L, "sequence") for seq in sequences]).to(device)
+
+def _predict_logits(predictor, sequences:List[str], device='cpu'):
+    """Structure logits of each sequence, folded as one padded batch and cropped to its own length."""
+    with span("run.encode"):
+        src = _encode(sequences, device)
+    with torch.inference_mode(), span("run.predict"):
+        pred = predictor(src).to('cpu')
+    return [p[:len(seq), :len(seq)] for p, seq in zip(pred, sequences)]
+
+def _postprocess(logits, sequence:str, fmt="dotbracket"):
+    with torch.inference_mode(), span("run.postprocess"):
+        structure = postprocesser.run(logits, sequence_to_int(sequence)).numpy().round()[0]
 
     # turn into 1-indexed base pairs
-    return [(b,c) for b, c in (np.stack(np.where(np.triu(structure) == 1)) + 1).T]
+    return _format([(int(b), int(c)) for b, c in (np.stack(np.where(np.triu(structure) == 1)) + 1).T], sequence, fmt)
+
+def _format(structure, sequence:str, fmt="dotbracket"):
+    """Formats 1-indexed base pairs as requested."""
+    if fmt == "dotbracket":
+        with span("run.dotbracket"):
+            db_structure = convert_bp_list_to_dotbracket(structure, len(sequence))
+        if db_structure != None:
+            structure = db_structure
+    return structure
 
-def run(arg:Union[str, List[str]]=None, fmt="dotbracket", device=None):
+def _fold(predictor, sequence:str, fmt="dotbracket", device='cpu'):
+    return _postprocess(_predict_logits(predictor, [sequence], device)[0], sequence, fmt)
+
+def _recycling_predictor(forward_sequence, recycle_tol=None, max_recycles=None, recycles=None):
+    """forward_sequence of eFold with these recycling options, which appends a {'sequence', 'recycles'} record to `recycles` for each sequence it folds."""
+    trunk = forward_sequence.__self__.eFold
+
+    def predictor(src, *args, **kwargs):
+        logits = forward_sequence(src, *args, recycle_tol=recycle_tol, max_recycles=max_recycles, **kwargs)
+        for row, n in zip(src.tolist(), trunk.recycles.tolist()):
+            recycles.append({"sequence": "".join(int2seq[i] for i in row).rstrip(int2seq[PADDING_TOKEN]), "recycles": n})
+        return logits
+
+    return predictor
+
+def _fold_records(predictor, records, fmt="dotbracket", device="cpu", window=None, stride=None, max_span=None, band=None, cost=None, memory_budget=None, batch_size=16, degraded=None):
+    """Folds (index, sequence) records in this process, see run(), and returns their (index, structure)."""
+    degraded = [] if degraded is None else degraded
+    results, by_length = [], {}
+    for idx, seq in records:
+        if window is not None and len(seq) > window:
+            results.append((idx, fold_windowed_resilient(predictor, idx, seq, fmt, device, degraded, window, stride, max_span)))
+        elif band is not None:
+            results.append((idx, fold_banded(predictor, seq, band, fmt, device=device)))
+        else:
+            by_length.setdefault(len(seq), []).append((idx, seq))
+
+    for L, group in by_length.items():
+        n = batch_size if cost is None else max(1, cost.max_batch_size(L, memory_budget, limit=batch_size))
+        for i in range(0, len(group), n):
+            structures = fold_resilient(predictor, group[i : i + n], fmt, device, degraded)
+            results += [(idx, structure) for (idx, _), structure in zip(group[i : i + n], structures)]
+    return results
+
+def run(arg:Union[str, List[str]]=None, fmt="dotbracket", device=None, backend="torch", model_path=None, quantization=None, workers=None, server=None, window=None, stride=None, max_span=None, band=None, memory_budget=None, overflow="window", batch_size=16, degraded=None, recycle_tol=None, max_recycles=None, recycles=None):
     """Runs the Efold API on the provided sequence or fasta file.
     
     Args:
         arg (str): The sequence or the list of sequences to run Efold on, or the path to a fasta file containing the sequences.  
+        backend (str): 'torch' (eager model), or 'torchscript' / 'onnx' to run a graph exported with efold.api.export.
+        model_path (str): Path to the exported graph, for the 'torchscript' and 'onnx' backends.
+        quantization (str): None (fp32), 'dynamic' (int8 Linear layers) or 'static' (int8 Linear layers and convolutions). CPU only, see efold.api.quantize.
+        workers (int or str): Number of CPU worker processes, each with its own share of the threads, or 'auto' to choose it from the core count and the sequence lengths. None runs in this process. See efold.api.workers.
+        window (int): Sequences longer than this are folded in overlapping windows of this size, see efold.api.window.
+        stride (int): Step between windows. Defaults to half the window.
+        max_span (int): Longest base pair predicted in windowed mode, at most window - stride. Defaults to window - stride.
+        band (int): Only keep the pair features of eFold for |i - j| <= band, so that memory grows as L * band instead of L^2. Torch backend only.
+        memory_budget (int): Bytes of activation memory a sequence may take, according to eFold's cost model (see efold.models.cost). Sequences too long for it are folded in the largest windows that fit, or refused. Applies to the dense and windowed folding, in this process or in the workers.
+        overflow (str): 'window' or 'refuse' (raise a ValueError) for the sequences that do not fit in memory_budget.
+        batch_size (int): Largest batch of sequences of the same length folded together, which gives the same structures as one at a time. Smaller with a memory_budget if needed.
+        degraded (list): If given, a {'index', 'sequence', 'path'} record is appended to it for each sequence whose fold ran out of memory and took a degraded path ('windowed', 'sparse_postprocess', or 'failed' with a None structure), see efold.api.resilient. Batches that run out of memory are split, which does not change the structures.
+        recycle_tol (float): Stop recycling a sequence through eFold's trunk once its pair features change by less than this, relative to their norm, between two passes. None runs every recycle. Torch backend only.
+        max_recycles (int): Number of recycles, or most recycles with recycle_tol. Defaults to the no_recycles of the model, which is 0 for the packaged weights, so that recycle_tol needs it. Torch backend only.
+        recycles (list): If given, a {'sequence', 'recycles'} record is appended to it for each sequence, or each window in windowed mode, with the number of recycles it ran. Torch backend only.
+        server (str): URL of a running `efold serve` server (http://host:port or unix:///path), which then does the folding instead of a local model.
         
     Returns:
         dict: A dictionary containing the sequences as keys and the predicted secondary structures as values.
@@ -68,7 +179,18 @@ def run(arg:Union[str, List[str]]=None, fmt="dotbracket", device=None):
     >>> assert structure == {'GGGAAAUCC': [(1, 9), (2, 8)]}, "Test failed: {}".format(structure)
     
     """
-    assert fmt in ["dotbracket", "basepair", 'bp'], "Invalid format. Must be either 'dotbracket' or 'basepair'"
+    assert fmt in FORMATS, "Invalid format. Must be either 'dotbracket' or 'basepair'"
+    assert backend in BACKENDS, "Invalid backend. Must be one of {}".format(BACKENDS)
+    assert overflow in OVERFLOW, "Invalid overflow. Must be one of {}".format(OVERFLOW)
+    if workers is not None and workers != "auto" and not (isinstance(workers, int) and workers >= 1):
+        raise ValueError("workers must be a positive integer or 'auto', got {}".format(workers))
+    if band is not None and (backend != "torch" or workers not in [None, 1] or server is not None):
+        raise ValueError("Banded mode only runs with the torch backend, in this process")
+    if max_recycles is not None and not (isinstance(max_recycles, int) and max_recycles >= 0):
+        raise ValueError("max_recycles must be a non-negative integer, got {}".format(max_recycles))
+    recycling = recycle_tol is not None or max_recycles is not None or recycles is not None
+    if recycling and (backend != "torch" or workers not in [None, 1] or server is not None):
+        raise ValueError("Adaptive recycling only runs with the torch backend, in this process")
 
     # Check if the input is valid
     if not arg:
@@ -76,7 +198,8 @@ def run(arg:Union[str, List[str]]=None, fmt="dotbracket", device=None):
     if any([key in arg for key in [".", "/", "\\"]]):
         if not os.path.exists(arg):
             raise ValueError("File not found")
-        sequences = _load_sequences_from_fasta(arg)
+        with span("run.fasta_parsing"):
+            sequences = _load_sequences_from_fasta(arg)
     elif type(arg) == str:
         sequences = [arg]
     elif hasattr(arg, "__iter__") and all([isinstance(s, str) for s in arg]):
@@ -84,38 +207,40 @@ def run(arg:Union[str, List[str]]=None, fmt="dotbracket", device=None):
     else:
         raise ValueError("Either sequence or fasta must be provided")
     
+    if server is not None:
+        structures = Client(server).fold(list(sequences), fmt)
+        return {seq: structure for seq, structure in zip(sequences, structures)}
+
+    if workers is not None and workers != 1 and device is not None and torch.device(device).type != "cpu":
+        raise ValueError("Multi-process inference only runs on CPU")
+
     # Get device
-    if not device:
-        if torch.cuda.is_available():
-            device = torch.device("cuda")
-        else:
-            device = torch.device("cpu")
-
-    # Load best model
-    model = create_model(
-        model="efold",
-        ntoken=5,
-        d_model=64,
-        c_z=32,
-        d_cnn=64,
-        num_blocks=4,
-        no_recycles=0,
-        dropout=0,
-        lr=3e-4,
-        weight_decay=0,
-        gamma=0.995,
-    )
-    model.load_state_dict(torch.load(join(dirname(dirname(__file__)), "resources/efold_weights.pt")), strict=False)
-    model.eval()
-    model = model.to(device)
-
-    structures = []
-    for seq in sequences:  
-        structure = _predict_structure(model, seq, device=device)
-        if fmt == "dotbracket":
-            db_structure = convert_bp_list_to_dotbracket(structure, len(seq))
-            if db_structure != None:
-                structure = db_structure
-        structures.append(structure)
+    device = _get_device(device, quantization) if workers in [None, 1] else torch.device("cpu")
+
+    cost = None
+    if memory_budget is not None and band is None:
+        cost = load_cost_model(device=device)
+        longest = cost.max_length(memory_budget)
+        too_long = [seq for seq in sequences if len(seq) > longest]
+        if too_long and overflow == "refuse":
+            raise ValueError("{} sequence(s) longer than {} nucleotides do not fit in the memory budget".format(len(too_long), longest))
+        window = longest if window is None else min(window, longest)
+
+    degraded = [] if degraded is None else degraded
+    options = dict(window=window, stride=stride, max_span=max_span, cost=cost, memory_budget=memory_budget, batch_size=batch_size)
+    if workers is not None and workers != 1:
+        structures = predict_sharded(sequences, fmt, workers, backend, model_path, quantization, degraded=degraded, **options)
+    else:
+        # Load best model
+        with span("run.load_model"):
+            predictor = _load_predictor(backend, device, model_path, quantization)
+        if recycling:
+            predictor = _recycling_predictor(predictor, recycle_tol, max_recycles, [] if recycles is None else recycles)
+
+        structures = [None] * len(sequences)
+        for idx, structure in _fold_records(predictor, list(enumerate(sequences)), fmt, device, band=band, degraded=degraded, **options):
+            structures[idx] = structure
 
+    if degraded:
+        warnings.warn("{} sequence(s) ran out of memory and were folded in a degraded mode".format(len(degraded)))
     return {seq: structure for seq, structure in zip(sequences, structures)}
\ No newline at end of file
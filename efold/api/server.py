@@ -0,0 +1,245 @@
+import json
+import os
+import socketserver
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+import numpy as np
+
+DEFAULT_PORT = 8765
+
+
+class MicroBatcher:
+    """Collects concurrent fold requests into length-bucketed micro-batches.
+
+    Sequences whose lengths fall in the same bucket of `bucket_width` nucleotides are folded as one padded batch. A bucket is flushed when it holds `max_batch_size` sequences, or when its oldest sequence has waited `max_latency` seconds. The model runs on the batcher thread and the post-processing on a pool of `postprocess_workers` threads.
+
+    With a `memory_budget` in bytes, a bucket is also flushed once it holds the largest batch that fits the budget according to eFold's cost model (see efold.models.cost).
+
+    The model sees the padding of the batch, so only `bucket_width=1` (equal lengths) gives exactly the structures of run().
+    """
+
+    def __init__(
+        self,
+        predictor,
+        device="cpu",
+        max_batch_size: int = 16,
+        max_latency: float = 0.01,
+        bucket_width: int = 1,
+        postprocess_workers: int = None,
+        memory_budget: int = None,
+    ):
+        self.predictor = predictor
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.memory_budget = memory_budget
+        self.cost = None
+        if memory_budget is not None:
+            from ..models.cost import load_cost_model
+
+            self.cost = load_cost_model(device=device)
+        self.max_latency = max_latency
+        self.bucket_width = bucket_width
+        self.pool = ThreadPoolExecutor(max_workers=postprocess_workers or os.cpu_count())
+
+        self._buckets = {}
+        self._cond = threading.Condition()
+        self._stopped = False
+
+        self._start = time.time()
+        self._counters = dict(requests=0, sequences=0, completed=0, batches=0, errors=0)
+        # the last latencies and batch sizes only, for the percentiles
+        self._latencies = deque(maxlen=10000)
+        self._batch_sizes = deque(maxlen=10000)
+
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def submit(self, sequence: str, fmt: str = "dotbracket") -> Future:
+        """Queues a sequence and returns a future of its structure."""
+        future = Future()
+        with self._cond:
+            key = len(sequence) // self.bucket_width
+            self._buckets.setdefault(key, []).append((time.time(), sequence, fmt, future))
+            self._counters["sequences"] += 1
+            self._cond.notify()
+        return future
+
+    def fold(self, sequences: List[str], fmt: str = "dotbracket"):
+        """Folds a request of sequences and returns their structures in order."""
+        with self._cond:
+            self._counters["requests"] += 1
+        futures = [self.submit(seq, fmt) for seq in sequences]
+        return [future.result() for future in futures]
+
+    def _next_batch(self):
+        """Waits for a full or expired bucket and pops it."""
+        with self._cond:
+            while not self._stopped:
+                now = time.time()
+                for key, items in self._buckets.items():
+                    n = self._batch_size(items)
+                    if len(items) >= n or now - items[0][0] >= self.max_latency:
+                        batch = items[:n]
+                        del items[:n]
+                        if not items:
+                            del self._buckets[key]
+                        return batch
+                oldest = min([items[0][0] for items in self._buckets.values()], default=None)
+                self._cond.wait(None if oldest is None else max(oldest + self.max_latency - now, 0))
+        return None
+
+    def _batch_size(self, items):
+        """Largest batch of the bucket, at least one sequence."""
+        if self.cost is None:
+            return self.max_batch_size
+        L = max(len(seq) for _, seq, _, _ in items)
+        return max(1, self.cost.max_batch_size(L, self.memory_budget, limit=self.max_batch_size))
+
+    def _loop(self):
+        from .run import _predict_logits
+
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                logits = _predict_logits(self.predictor, [seq for _, seq, _, _ in batch], self.device)
+            except Exception as e:
+                for _, _, _, future in batch:
+                    self._fail(future, e)
+                continue
+            with self._cond:
+                self._counters["batches"] += 1
+                self._batch_sizes.append(len(batch))
+            for (arrival, seq, fmt, future), logit in zip(batch, logits):
+                self.pool.submit(self._postprocess, logit, seq, fmt, future, arrival)
+
+    def _postprocess(self, logits, sequence, fmt, future, arrival):
+        from .run import _postprocess
+
+        try:
+            future.set_result(_postprocess(logits, sequence, fmt))
+        except Exception as e:
+            self._fail(future, e)
+            return
+        with self._cond:
+            self._counters["completed"] += 1
+            self._latencies.append(time.time() - arrival)
+
+    def _fail(self, future, e):
+        with self._cond:
+            self._counters["errors"] += 1
+        future.set_exception(e)
+
+    def stats(self):
+        """Throughput and latency counters since the batcher started."""
+        with self._cond:
+            latencies = np.array(self._latencies)
+            batch_sizes = np.array(self._batch_sizes)
+            uptime = time.time() - self._start
+            done = len(latencies)
+            return {
+                **self._counters,
+                "queued": sum(len(items) for items in self._buckets.values()),
+                "uptime_s": uptime,
+                "throughput_seq_per_s": self._counters["completed"] / uptime if uptime else 0.0,
+                "mean_batch_size": float(batch_sizes.mean()) if len(batch_sizes) else 0.0,
+                "latency_ms": {
+                    q: float(np.percentile(latencies, int(q[1:])) * 1000) if done else 0.0
+                    for q in ["p50", "p90", "p99"]
+                },
+            }
+
+    def close(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join()
+        self.pool.shutdown()
+
+
+class Handler(BaseHTTPRequestHandler):
+    """POST /fold {"sequences": [...], "fmt": "dotbracket"} -> {"structures": [...]}, GET /stats, GET /health."""
+
+    batcher: MicroBatcher = None
+
+    def _send(self, code, body):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            return self._send(200, self.batcher.stats())
+        if self.path == "/health":
+            return self._send(200, {"status": "ok"})
+        self._send(404, {"error": "Unknown path {}".format(self.path)})
+
+    def do_POST(self):
+        from .run import FORMATS
+
+        if self.path != "/fold":
+            return self._send(404, {"error": "Unknown path {}".format(self.path)})
+        try:
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            fmt = request.get("fmt", "dotbracket")
+            if fmt not in FORMATS:
+                return self._send(400, {"error": "Invalid format {}. Must be one of {}".format(fmt, FORMATS)})
+            structures = self.batcher.fold(request["sequences"], fmt)
+        except Exception as e:
+            return self._send(400, {"error": repr(e)})
+        self._send(200, {"structures": structures})
+
+    def address_string(self):
+        # unix sockets have no client address
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        pass
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(
+    host: str = "127.0.0.1",
+    port: int = DEFAULT_PORT,
+    socket_path: str = None,
+    device=None,
+    backend: str = "torch",
+    model_path: str = None,
+    quantization: str = None,
+    **batcher_kwargs,
+):
+    """Serves eFold over HTTP, on host:port or on a unix socket, until interrupted.
+
+    The model is loaded once and kept warm. See MicroBatcher for the batching arguments.
+    """
+    from .run import _get_device, _load_predictor
+
+    device = _get_device(device, quantization)
+    predictor = _load_predictor(backend, device, model_path, quantization)
+    batcher = MicroBatcher(predictor, device=device, **batcher_kwargs)
+    handler = type("BoundHandler", (Handler,), {"batcher": batcher})
+
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixHTTPServer(socket_path, handler)
+    else:
+        server = ThreadingHTTPServer((host, port), handler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
@@ -0,0 +1,226 @@
+import asyncio
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Tuple, Union
+
+
+def _records(records):
+    """(id, sequence) pairs from a fasta path, a sequence, a {id: sequence} dict, or an iterable of sequences (id = index) or of (id, sequence) pairs.
+
+    Example:
+    >>> list(_records(["GGGAAAUCC", ("ref", "GCAUAGC")]))
+    [(0, 'GGGAAAUCC'), ('ref', 'GCAUAGC')]
+    """
+    from .run import _load_records_from_fasta
+
+    if isinstance(records, str):
+        if any(key in records for key in [".", "/", "\\"]):
+            if not os.path.exists(records):
+                raise ValueError("File not found")
+            yield from _load_records_from_fasta(records)
+        else:
+            yield 0, records
+        return
+    if isinstance(records, dict):
+        records = records.items()
+    for idx, record in enumerate(records):
+        yield (idx, record) if isinstance(record, str) else tuple(record)
+
+
+class _LengthBatcher:
+    """Groups a stream of (id, sequence) records into batches of at most `batch_size` sequences whose lengths fall in the same bucket of `bucket_width` nucleotides, looking at most `window` records ahead.
+
+    The records are also flushed when the oldest one has waited `max_wait` seconds for the window to fill, checked as each record arrives, so that a slow source still streams.
+
+    With a `cost` model (see efold.models.cost) and a `memory_budget` in bytes, the batches of a bucket are also cut to the largest batch that fits the budget, and a sequence that does not fit on its own is a batch of one.
+
+    The model sees the padding of a batch, so only `bucket_width=1` gives exactly the structures of run().
+
+    Example:
+    >>> batcher = _LengthBatcher(batch_size=2, window=4)
+    >>> [b for r in enumerate(["AA", "CCC", "GG", "UU"]) for b in batcher.add(r)]
+    [[(0, 'AA'), (2, 'GG')], [(3, 'UU')], [(1, 'CCC')]]
+    """
+
+    def __init__(self, batch_size: int = 16, bucket_width: int = 1, window: int = 256, cost=None, memory_budget: int = None, max_wait: float = None):
+        self.batch_size = batch_size
+        self.bucket_width = bucket_width
+        self.window = max(window, batch_size)
+        self.cost = cost
+        self.memory_budget = memory_budget
+        self.max_wait = max_wait
+        self.buffer = []
+        self._oldest = None
+
+    def _batch_size(self, bucket):
+        if self.cost is None or self.memory_budget is None:
+            return self.batch_size
+        L = max(len(seq) for _, seq in bucket)
+        return max(1, self.cost.max_batch_size(L, self.memory_budget, limit=self.batch_size))
+
+    def add(self, record):
+        if not self.buffer:
+            self._oldest = time.monotonic()
+        self.buffer.append(record)
+        waited = self.max_wait is not None and time.monotonic() - self._oldest >= self.max_wait
+        return self.flush() if len(self.buffer) >= self.window or waited else []
+
+    def flush(self):
+        buckets = {}
+        for record in self.buffer:
+            buckets.setdefault(len(record[1]) // self.bucket_width, []).append(record)
+        self.buffer = []
+        return [
+            bucket[i : i + n]
+            for bucket in buckets.values()
+            for n in [self._batch_size(bucket)]
+            for i in range(0, len(bucket), n)
+        ]
+
+
+def _setup(device, backend, model_path, quantization):
+    from .run import _get_device, _load_predictor
+
+    device = _get_device(device, quantization)
+    return _load_predictor(backend, device, model_path, quantization), device
+
+
+def _cost(memory_budget, device):
+    """eFold's cost model on this device, if batches are sized by memory."""
+    if memory_budget is None:
+        return None
+    from ..models.cost import load_cost_model
+
+    return load_cost_model(device=device)
+
+
+def predict_iter(
+    records: Union[str, Iterable],
+    fmt: str = "dotbracket",
+    batch_size: int = 16,
+    bucket_width: int = 1,
+    window: int = 256,
+    device=None,
+    backend: str = "torch",
+    model_path: str = None,
+    quantization: str = None,
+    postprocess_workers: int = None,
+    memory_budget: int = None,
+    max_wait: float = 0.1,
+) -> Iterable[Tuple[object, str, Union[str, list]]]:
+    """Folds a stream of records and yields (id, sequence, structure) as batches finish.
+
+    Duplicated sequences are all folded and yielded. Records are read lazily, batched by length (see _LengthBatcher) and the post-processing of a batch runs on a thread pool while the model folds the next one. Results come in completion order, not input order.
+
+    Args:
+        records: fasta path, sequence, {id: sequence} dict, or iterable of sequences or (id, sequence) pairs.
+        memory_budget (int): bytes of activation memory a batch may take, see efold.models.cost. None only limits the batches to batch_size.
+        max_wait (float): seconds a record may wait for `window` records to batch it with, checked as records arrive. None waits for the window.
+        Other arguments are the ones of run().
+    """
+    from .run import _predict_logits, _postprocess
+
+    predictor, device = _setup(device, backend, model_path, quantization)
+    batcher = _LengthBatcher(batch_size, bucket_width, window, _cost(memory_budget, device), memory_budget, max_wait)
+    pending = deque()
+
+    def fold(batch):
+        logits = _predict_logits(predictor, [seq for _, seq in batch], device)
+        for (rid, seq), logit in zip(batch, logits):
+            pending.append((rid, seq, pool.submit(_postprocess, logit, seq, fmt)))
+
+    with ThreadPoolExecutor(postprocess_workers) as pool:
+        try:
+            for record in _records(records):
+                for batch in batcher.add(record):
+                    fold(batch)
+                while pending and pending[0][2].done():
+                    rid, seq, future = pending.popleft()
+                    yield rid, seq, future.result()
+            for batch in batcher.flush():
+                fold(batch)
+            while pending:
+                rid, seq, future = pending.popleft()
+                yield rid, seq, future.result()
+        finally:
+            for _, _, future in pending:
+                future.cancel()
+
+
+async def apredict_iter(
+    records,
+    fmt: str = "dotbracket",
+    batch_size: int = 16,
+    bucket_width: int = 1,
+    window: int = 256,
+    max_pending: int = 64,
+    device=None,
+    backend: str = "torch",
+    model_path: str = None,
+    quantization: str = None,
+    postprocess_workers: int = None,
+    memory_budget: int = None,
+    max_wait: float = 0.1,
+):
+    """Asynchronous predict_iter: an async generator of (id, sequence, structure).
+
+    The model runs on a dedicated thread and the post-processing on a thread pool, so the event loop stays free for the caller's own I/O. At most `max_pending` structures are in flight: before submitting another one, the generator waits for the oldest and yields it, and stops pulling records until the consumer catches up. Cancelling the consumer, or closing the generator, cancels the queued work.
+
+    Args:
+        records: as in predict_iter, or an async iterable of sequences or (id, sequence) pairs.
+    """
+    from .run import _predict_logits, _postprocess
+
+    loop = asyncio.get_running_loop()
+    model_pool = ThreadPoolExecutor(1)
+    postprocess_pool = ThreadPoolExecutor(postprocess_workers)
+    batcher = _LengthBatcher(batch_size, bucket_width, window, max_wait=max_wait)
+    pending = deque()
+
+    async def aiter_records():
+        if hasattr(records, "__aiter__"):
+            idx = 0
+            async for record in records:
+                yield (idx, record) if isinstance(record, str) else tuple(record)
+                idx += 1
+        else:
+            for record in _records(records):
+                yield record
+
+    async def fold(batch):
+        logits = await loop.run_in_executor(
+            model_pool, _predict_logits, predictor, [seq for _, seq in batch], device
+        )
+        for (rid, seq), logit in zip(batch, logits):
+            while len(pending) >= max_pending:
+                oldest_rid, oldest_seq, future = pending.popleft()
+                yield oldest_rid, oldest_seq, await future
+            pending.append(
+                (rid, seq, loop.run_in_executor(postprocess_pool, _postprocess, logit, seq, fmt))
+            )
+
+    try:
+        predictor, device = await loop.run_in_executor(
+            model_pool, _setup, device, backend, model_path, quantization
+        )
+        batcher.cost, batcher.memory_budget = _cost(memory_budget, device), memory_budget
+        async for record in aiter_records():
+            for batch in batcher.add(record):
+                async for result in fold(batch):
+                    yield result
+            while pending and pending[0][2].done():
+                rid, seq, future = pending.popleft()
+                yield rid, seq, await future
+        for batch in batcher.flush():
+            async for result in fold(batch):
+                yield result
+        while pending:
+            rid, seq, future = pending.popleft()
+            yield rid, seq, await future
+    finally:
+        for _, _, future in pending:
+            future.cancel()
+        model_pool.shutdown(wait=False, cancel_futures=True)
+        postprocess_pool.shutdown(wait=False, cancel_futures=True)
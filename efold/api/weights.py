@@ -0,0 +1,139 @@
+import json
+import mmap
+import os
+import struct
+from os.path import join, dirname, exists, splitext
+import torch
+from ..models.evofold import eFoldNet
+
+RESOURCES_DIR = join(dirname(dirname(__file__)), "resources")
+WEIGHTS_PATH = join(RESOURCES_DIR, "efold_weights.safetensors")
+LEGACY_WEIGHTS_PATH = join(RESOURCES_DIR, "efold_weights.pt")
+
+# dtype names of the safetensors format
+DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+# building on the meta device and assigning the loaded tensors needs torch >= 2.1
+META_INIT = tuple(int(v) for v in torch.__version__.split("+")[0].split(".")[:2]) >= (2, 1)
+
+
+def save_weights(state_dict: dict, path: str, manifest: dict):
+    """Writes a state dict in the safetensors format, with the manifest in its metadata.
+
+    The file is an 8 bytes little-endian header size, a JSON header giving the dtype,
+    shape and byte range of each tensor, then the raw tensor data.
+
+    Example:
+    >>> import tempfile
+    >>> path = join(tempfile.mkdtemp(), "weights.safetensors")
+    >>> save_weights({"w": torch.arange(6.0).view(2, 3)}, path, {"model": "efold"})
+    >>> state_dict, manifest = load_weights(path)
+    >>> state_dict["w"].tolist(), manifest
+    ([[0.0, 1.0, 2.0], [3.0, 4.0, 5.0]], {'model': 'efold'})
+    """
+    names = {v: k for k, v in DTYPES.items()}
+    header, tensors, offset = {"__metadata__": {"manifest": json.dumps(manifest)}}, [], 0
+    for name, tensor in state_dict.items():
+        tensor = tensor.detach().to("cpu").contiguous()
+        size = tensor.numel() * tensor.element_size()
+        header[name] = {"dtype": names[tensor.dtype], "shape": list(tensor.shape), "data_offsets": [offset, offset + size]}
+        tensors.append(tensor)
+        offset += size
+
+    header = json.dumps(header).encode()
+    header += b" " * (-len(header) % 8)  # align the data on 8 bytes
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for tensor in tensors:
+            # reshape(-1) as the byte view of a 0-dim tensor, e.g. num_batches_tracked, is not allowed
+            f.write(tensor.reshape(-1).view(torch.uint8).numpy().tobytes() if tensor.numel() else b"")
+    os.replace(tmp, path)
+
+
+def load_weights(path: str):
+    """Memory-maps a safetensors file and returns its state dict and manifest.
+
+    The tensors are views of a copy-on-write map of the file, so nothing is read
+    until used and the file is never modified.
+    """
+    with open(path, "rb") as f:
+        (size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(size))
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    manifest = json.loads(header.pop("__metadata__", {}).get("manifest", "{}"))
+    state_dict = {}
+    for name, info in header.items():
+        dtype, (start, end) = DTYPES[info["dtype"]], info["data_offsets"]
+        if start == end:
+            state_dict[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        state_dict[name] = torch.frombuffer(
+            buffer, dtype=dtype, count=(end - start) // torch.empty(0, dtype=dtype).element_size(), offset=8 + size + start
+        ).view(info["shape"])
+    return state_dict, manifest
+
+
+def read_manifest(path: str):
+    """Manifest of a weights file: its metadata for safetensors, else the JSON file next to it."""
+    if path.endswith(".safetensors"):
+        with open(path, "rb") as f:
+            (size,) = struct.unpack("<Q", f.read(8))
+            return json.loads(json.loads(f.read(size)).get("__metadata__", {}).get("manifest", "{}"))
+    with open(splitext(path)[0] + ".json") as f:
+        return json.load(f)
+
+
+def convert_weights(src: str = LEGACY_WEIGHTS_PATH, dst: str = WEIGHTS_PATH):
+    """Converts a pickled state dict and its JSON manifest to a safetensors file."""
+    save_weights(torch.load(src, map_location="cpu"), dst, read_manifest(src))
+
+
+def load_efold(path: str = None, device="cpu"):
+    """Builds eFoldNet from the manifest of a weights file and loads the weights, in eval mode.
+
+    With a safetensors file, the model is built on the meta device, without any
+    random init, and its parameters are the memory-mapped tensors of the file (on
+    CPU) or copied from them (on other devices). Pickled state dicts are loaded
+    as before, with strict=False.
+
+    Args:
+        path (str): weights file. Defaults to the packaged weights, converted ones first.
+    """
+    if path is None:
+        path = WEIGHTS_PATH if exists(WEIGHTS_PATH) else LEGACY_WEIGHTS_PATH
+    manifest = read_manifest(path)
+    if manifest.get("model", "efold") != "efold":
+        raise ValueError("{} holds weights of a {} model".format(path, manifest["model"]))
+
+    if not (path.endswith(".safetensors") and META_INIT):
+        model = eFoldNet(**manifest["hparams"])
+        state_dict = load_weights(path)[0] if path.endswith(".safetensors") else torch.load(path, map_location="cpu")
+        model.load_state_dict(state_dict, strict=False)
+        return model.eval().to(device)
+
+    state_dict, _ = load_weights(path)
+    with torch.device("meta"):
+        model = eFoldNet(**manifest["hparams"])
+    if torch.device(device).type == "cpu":
+        missing, _ = model.load_state_dict(state_dict, strict=False, assign=True)
+    else:
+        model = model.to_empty(device=device)
+        missing, _ = model.load_state_dict(state_dict, strict=False)
+    if missing:
+        raise RuntimeError("{} is missing the weights {}".format(path, missing))
+    model._reset_buffers()
+    return model.eval()
@@ -0,0 +1,107 @@
+import torch
+from ..core.embeddings import sequence_to_int
+from ..core.postprocess import SparsePostprocess
+
+CONSENSUS_RULES = ["weighted", "mean"]
+
+sparse_postprocesser = SparsePostprocess()
+
+
+def _windows(length: int, window: int, stride: int):
+    """Start of each window, the last one aligned on the end of the sequence.
+
+    Example:
+    >>> _windows(1000, 400, 200)
+    [0, 200, 400, 600]
+    >>> _windows(1100, 400, 200)
+    [0, 200, 400, 600, 700]
+    """
+    starts = list(range(0, max(length - window, 0) + 1, stride))
+    if starts[-1] + window < length:
+        starts.append(length - window)
+    return starts
+
+
+def predict_windowed(
+    predictor,
+    sequence: str,
+    window: int = 600,
+    stride: int = None,
+    max_span: int = None,
+    batch_size: int = 8,
+    device="cpu",
+    consensus: str = "weighted",
+):
+    """Base pair probabilities of a long sequence, folded in overlapping windows.
+
+    Every pair with j - i <= max_span lies whole in at least one window. The probabilities of a pair are merged across the windows that contain it with the consensus rule: 'mean', or 'weighted' where each window counts 1 + the distance of the pair to the closest window edge, as predictions lose context near the edges. Probabilities are kept in a (L, max_span + 1) band, so memory grows linearly with L.
+
+    Args:
+        predictor: callable mapping (N, L) integer sequences to (N, L, L) structure logits.
+        window (int): window size.
+        stride (int): step between windows. Defaults to window // 2.
+        max_span (int): longest pair kept, at most window - stride. Defaults to window - stride.
+        batch_size (int): number of windows folded together.
+
+    Returns:
+        rows, cols, probabilities: entries (i, j), i < j, in global coordinates.
+    """
+    from .run import _predict_logits
+
+    stride = stride or window // 2
+    max_span = max_span or window - stride
+    if max_span > window - stride:
+        raise ValueError("max_span must be at most window - stride, so that each pair is seen whole by a window")
+    if consensus not in CONSENSUS_RULES:
+        raise ValueError(f"Invalid consensus rule {consensus}. Must be one of {CONSENSUS_RULES}")
+
+    # band of a window: local pairs (i, i + d), 0 < d <= max_span
+    ii, dd = torch.meshgrid(torch.arange(window), torch.arange(1, max_span + 1), indexing="ij")
+    inside = ii + dd < window
+    ii, dd = ii[inside], dd[inside]
+    if consensus == "weighted":
+        weight = 1.0 + torch.minimum(ii, window - 1 - (ii + dd))
+    else:
+        weight = torch.ones(len(ii))
+
+    L = len(sequence)
+    total = torch.zeros(L, max_span + 1)
+    norm = torch.zeros(L, max_span + 1)
+    starts = _windows(L, window, stride)
+    for k in range(0, len(starts), batch_size):
+        batch = starts[k : k + batch_size]
+        logits = _predict_logits(predictor, [sequence[s : s + window] for s in batch], device)
+        for start, logit in zip(batch, logits):
+            total.index_put_((start + ii, dd), weight * torch.sigmoid(logit[ii, ii + dd]), accumulate=True)
+            norm.index_put_((start + ii, dd), weight, accumulate=True)
+
+    rows, dist = torch.nonzero(norm, as_tuple=True)
+    return rows, rows + dist, total[rows, dist] / norm[rows, dist]
+
+
+def fold_windowed(predictor, sequence: str, fmt: str = "dotbracket", device="cpu", **kwargs):
+    """Folds a long sequence in windows (see predict_windowed) and post-processes the stitched band with SparsePostprocess."""
+    from .run import _format
+
+    rows, cols, probabilities = predict_windowed(predictor, sequence, device=device, **kwargs)
+    pairs = sparse_postprocesser.run(rows, cols, torch.logit(probabilities, eps=1e-6), sequence_to_int(sequence))
+    return _format([(i + 1, j + 1) for i, j in pairs], sequence, fmt)
+
+
+def fold_banded(predictor, sequence: str, band: int, fmt: str = "dotbracket", device="cpu"):
+    """Folds a sequence with eFold's banded mode, keeping only the pairs with j - i <= band, and post-processes the band with SparsePostprocess.
+
+    Args:
+        predictor: eFold.forward_sequence, or any callable taking the `band` keyword and returning (N, L, 2 * band + 1) logits.
+    """
+    from .run import _encode, _format
+
+    L = len(sequence)
+    with torch.inference_mode():
+        logits = predictor(_encode([sequence], device), band=band)[0].to("cpu")  # (L, 2 * band + 1)
+
+    # cell (i, d) holds the pair (i, i + d - band), keep j > i in the sequence
+    offset = torch.arange(-band, band + 1)
+    rows, cells = torch.nonzero((offset > 0) & (torch.arange(L)[:, None] + offset < L), as_tuple=True)
+    pairs = sparse_postprocesser.run(rows, rows + offset[cells], logits[rows, cells], sequence_to_int(sequence))
+    return _format([(i + 1, j + 1) for i, j in pairs], sequence, fmt)
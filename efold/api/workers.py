@@ -0,0 +1,125 @@
+import os
+from typing import List, Union
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+# state of a worker process, set once by _init_worker
+_worker = {}
+
+
+def auto_workers(lengths: List[int], cores: int = None):
+    """Chooses the number of worker processes and the threads per worker.
+
+    Intra-op threading barely helps on the small matrices of short RNAs, so short
+    inputs get many single-threaded workers and long inputs fewer, wider ones.
+
+    Example:
+    >>> auto_workers([50] * 100, cores=64)
+    (64, 1)
+    >>> auto_workers([1000] * 100, cores=64)
+    (16, 4)
+    >>> auto_workers([50, 60], cores=64)
+    (2, 1)
+    """
+    cores = cores or os.cpu_count() or 1
+    median = np.median(lengths)
+    threads = 1 if median <= 128 else 2 if median <= 512 else 4
+    threads = min(threads, cores)
+    return max(1, min(len(lengths), cores // threads)), threads
+
+
+def shard_by_length(lengths: List[int], n_shards: int):
+    """Splits the sequence indices into shards of similar cost, taking the cost of a sequence as L^2.
+
+    Sequences are assigned longest first to the least loaded shard. Empty shards are dropped.
+
+    Example:
+    >>> shard_by_length([10, 100, 20, 90], 2)
+    [[1], [3, 2, 0]]
+    """
+    shards = [[] for _ in range(n_shards)]
+    loads = np.zeros(n_shards)
+    for idx in np.argsort(lengths, kind="stable")[::-1]:
+        k = int(np.argmin(loads))
+        shards[k].append(int(idx))
+        loads[k] += lengths[idx] ** 2
+    return [shard for shard in shards if len(shard)]
+
+
+def _init_worker(model, backend, model_path, quantization, fmt, num_threads, options):
+    from .run import _load_predictor
+
+    torch.set_num_threads(num_threads)
+    _worker["predictor"] = _load_predictor(backend, "cpu", model_path, quantization, model=model)
+    _worker["fmt"] = fmt
+    _worker["options"] = options
+
+
+def _fold_shard(shard):
+    from .run import _fold_records
+
+    degraded = []
+    results = _fold_records(_worker["predictor"], shard, _worker["fmt"], "cpu", degraded=degraded, **_worker["options"])
+    return results, degraded
+
+
+def predict_sharded(
+    sequences: List[str],
+    fmt: str = "dotbracket",
+    workers: Union[int, str] = "auto",
+    backend: str = "torch",
+    model_path: str = None,
+    quantization: str = None,
+    threads_per_worker: int = None,
+    model=None,
+    degraded: list = None,
+    **options,
+):
+    """Folds the sequences on CPU worker processes and returns the structures in input order.
+
+    The eager model is loaded once and its weights are shared with the workers through shared memory. Exported graphs are loaded by each worker.
+
+    Args:
+        sequences (list): sequences to fold.
+        workers (int or str): number of worker processes, or 'auto'.
+        threads_per_worker (int): torch threads of each worker. Defaults to an even split of the cores, or to auto_workers in 'auto' mode.
+        model: eager eFold model for the torch backend. Defaults to the packaged weights.
+        degraded (list): the out-of-memory records of the workers are appended to it, see run().
+        options: window, stride, max_span, cost, memory_budget and batch_size of each worker, see run().
+    """
+    if workers != "auto" and not (isinstance(workers, int) and workers >= 1):
+        raise ValueError("workers must be a positive integer or 'auto', got {}".format(workers))
+    lengths = [len(seq) for seq in sequences]
+    if workers == "auto":
+        workers, threads = auto_workers(lengths)
+    else:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+    threads = threads_per_worker or threads
+
+    if backend == "torch":
+        from .run import load_model
+
+        model = (load_model("cpu") if model is None else model).share_memory()
+    else:
+        model = None
+
+    shards = [
+        [(idx, sequences[idx]) for idx in shard]
+        for shard in shard_by_length(lengths, workers)
+    ]
+    ctx = mp.get_context("spawn")
+    with ctx.Pool(
+        len(shards),
+        initializer=_init_worker,
+        initargs=(model, backend, model_path, quantization, fmt, threads, options),
+    ) as pool:
+        results = pool.map(_fold_shard, shards, chunksize=1)
+
+    structures = [None] * len(sequences)
+    for shard, shard_degraded in results:
+        for idx, structure in shard:
+            structures[idx] = structure
+        if degraded is not None:
+            degraded += shard_degraded
+    return structures
@@ -0,0 +1,3 @@
+from .stages import benchmark_stages
+from .scaling import benchmark_scaling
+from .report import compare
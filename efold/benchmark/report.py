@@ -0,0 +1,61 @@
+import json
+import os
+import platform
+import time
+from typing import List
+import numpy as np
+import torch
+
+
+def timeit(fn, repeats: int = 5, warmup: int = 1):
+    """Median and min wall time of fn() over `repeats` runs, in seconds."""
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return float(np.median(times)), float(np.min(times))
+
+
+def environment():
+    """Machine and library versions, so that reports are only compared on like hardware."""
+    return {
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+    }
+
+
+def save(report: dict, path: str):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=4)
+
+
+def load(path: str):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def compare(report: dict, baseline: dict, keys: List[str], metric: str = "median_s", tolerance: float = 0.2):
+    """Entries of `report` slower than the matching entry of `baseline` by more than `tolerance`.
+
+    Entries are matched on the values of `keys`, and compared on `metric` where lower is better.
+
+    Example:
+    >>> baseline = {"results": [{"stage": "trunk", "length": 64, "median_s": 1.0}]}
+    >>> report = {"results": [{"stage": "trunk", "length": 64, "median_s": 1.5}]}
+    >>> compare(report, baseline, keys=["stage", "length"])
+    [{'stage': 'trunk', 'length': 64, 'median_s': 1.5, 'baseline': 1.0, 'ratio': 1.5}]
+    """
+    reference = {tuple(r.get(k) for k in keys): r.get(metric) for r in baseline["results"]}
+    regressions = []
+    for r in report["results"]:
+        base = reference.get(tuple(r.get(k) for k in keys))
+        if base and r.get(metric) is not None and r[metric] > base * (1 + tolerance):
+            regressions.append({**{k: r.get(k) for k in keys}, metric: r[metric], "baseline": base, "ratio": r[metric] / base})
+    return regressions
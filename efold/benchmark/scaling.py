@@ -0,0 +1,210 @@
+import ast
+import multiprocessing as mp
+from os.path import join, dirname
+from typing import List
+import numpy as np
+import torch
+from ..models.cost import _peak_rss
+from .report import timeit, environment, compare
+from .stages import synthetic_sequences, _hairpin
+
+LENGTHS = [32, 64, 128, 256, 512, 1024, 2048, 4096]
+
+SCRIPTS_DIR = join(dirname(dirname(dirname(__file__))), "scripts")
+
+# training script of each model, whose create_model call gives the configuration of the model
+TEMPLATES = {
+    "efold": "efold_training.py",
+    "cnn": "cnn_template.py",
+    "transformer": "transformer-template.py",
+    "unet": "unet_template.py",
+    "ribonanza": "ribonanza-template.py",
+}
+
+
+# data types that a model reads as an input, besides the sequence
+INPUT_DATA_TYPES = {"ribonanza": ["structure"]}
+
+
+def model_config(name: str, scripts_dir: str = SCRIPTS_DIR):
+    """Keyword arguments of the create_model call in the training script of a model, without `model` and `wandb`.
+
+    The assignments of the script's main block that only need torch, e.g. the params of
+    Ribonanza, are run first, the others (logger, DataModule, Trainer) are skipped.
+    """
+    path = join(scripts_dir, TEMPLATES[name])
+    with open(path, "r") as f:
+        tree = ast.parse(f.read(), path)
+    main = next(node.body for node in tree.body if isinstance(node, ast.If) and "__main__" in ast.unparse(node.test))
+
+    namespace = {"torch": torch}
+    for node in main:
+        if not isinstance(node, ast.Assign):
+            continue
+        call = node.value
+        if isinstance(call, ast.Call) and isinstance(call.func, ast.Name) and call.func.id == "create_model":
+            return {
+                keyword.arg: eval(compile(ast.Expression(keyword.value), path, "eval"), namespace)
+                for keyword in call.keywords
+                if keyword.arg not in ["model", "wandb"]
+            }
+        try:
+            exec(compile(ast.Module([node], type_ignores=[]), path, "exec"), namespace)
+        except Exception:
+            continue
+    raise ValueError("No create_model call in {}".format(path))
+
+
+def max_length(name: str, config: dict):
+    """Longest sequence a model takes, or None.
+
+    Example:
+    >>> max_length("ribonanza", {"params": {"max_len": 210}}), max_length("efold", {})
+    (208, None)
+    """
+    if name == "ribonanza":
+        # the start and end tokens take two positions
+        return config["params"]["max_len"] - 2
+    return None
+
+
+METRICS = ["forward_s", "train_s", "peak_rss_bytes", "activation_bytes"]
+
+
+def _activation_bytes(fn):
+    """Bytes of the tensors saved for the backward pass by fn(), counted once per storage."""
+    storages = {}
+
+    def pack(tensor):
+        storage = tensor.untyped_storage()
+        storages[storage.data_ptr()] = storage.nbytes()
+        return tensor
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        fn()
+    return sum(storages.values())
+
+
+def _profile_model(name: str, config: dict, lengths: List[int], batch_size: int, repeats: int, time_limit: float, device: str):
+    """Measures one model at increasing lengths, in a fresh process so that the peak RSS is its own.
+
+    The peak RSS only grows, so it is the peak of the longest length so far, which dominates.
+    Once a length fails or a forward pass takes more than `time_limit` seconds, the longer ones are skipped.
+    """
+    from ..core.batch import Batch
+    from ..models import create_model
+
+    torch.manual_seed(0)
+    model = create_model(name, **config).to(device)
+    n_params = sum(p.numel() for p in model.parameters())
+
+    def loss(output):
+        return sum(v.float().mean() for v in output.values() if isinstance(v, torch.Tensor))
+
+    results, skip = [], None
+    for L in lengths:
+        result = {"model": name, "length": L, "batch_size": batch_size, "params": n_params}
+        results.append(result)
+        if skip:
+            result["skipped"] = skip
+            continue
+        items = [
+            {"reference": str(i), "sequence": seq, "length": L, "structure": {"true": torch.tensor(_hairpin(L))}}
+            for i, seq in enumerate(synthetic_sequences(L, batch_size))
+        ]
+        batch = Batch.from_dataset_items(items, INPUT_DATA_TYPES.get(name, []), use_error=False)
+        batch.to(device)
+
+        def forward():
+            with torch.no_grad():
+                model(batch)
+
+        def train():
+            model.zero_grad(set_to_none=True)
+            loss(model(batch)).backward()
+
+        try:
+            model.eval()
+            result["forward_s"] = timeit(forward, repeats)[0]
+            model.train()
+            result["train_s"] = timeit(train, repeats)[0]
+            result["activation_bytes"] = _activation_bytes(lambda: loss(model(batch)))
+            if device == "cuda":
+                result["cuda_peak_allocated_bytes"] = torch.cuda.max_memory_allocated()
+                torch.cuda.reset_peak_memory_stats()
+        except Exception as e:
+            result["error"] = repr(e)
+            skip = "failed at length {}".format(L)
+        result["peak_rss_bytes"] = _peak_rss()
+        if result.get("forward_s", 0) > time_limit:
+            skip = "forward took {:.1f}s at length {}".format(result["forward_s"], L)
+    return results
+
+
+def fit_exponent(lengths, values, min_length: int = 128):
+    """Slope of log(value) against log(length), on the lengths >= min_length if there are at least 2 of them.
+
+    Example:
+    >>> round(fit_exponent([128, 256, 512], [1.0, 4.0, 16.0]), 3)
+    2.0
+    """
+    points = [(L, v) for L, v in zip(lengths, values) if v]
+    if len([L for L, _ in points if L >= min_length]) >= 2:
+        points = [(L, v) for L, v in points if L >= min_length]
+    if len(points) < 2:
+        return None
+    L, v = np.log(np.array(points, dtype=float)).T
+    return float(np.polyfit(L, v, 1)[0])
+
+
+def benchmark_scaling(
+    models: List[str] = None,
+    lengths: List[int] = LENGTHS,
+    batch_size: int = 1,
+    repeats: int = 3,
+    time_limit: float = 60.0,
+    device: str = "cpu",
+):
+    """Forward and forward+backward time, peak RSS, saved activation bytes and parameter count of each factory model as L grows, with the fitted scaling exponent of each metric.
+
+    Args:
+        models (list): models of TEMPLATES, configured as in their training script. Defaults to all of them.
+        lengths (list): sequence lengths. Those over the longest sequence a model takes are replaced by this maximum.
+    """
+    models = models or list(TEMPLATES)
+    results = []
+    ctx = mp.get_context("spawn")
+    for name in models:
+        config = model_config(name)
+        cap = max_length(name, config)
+        model_lengths = sorted({L if cap is None else min(L, cap) for L in lengths})
+        with ctx.Pool(1) as pool:
+            results += pool.apply(_profile_model, (name, config, model_lengths, batch_size, repeats, time_limit, device))
+
+    exponents = {
+        name: {
+            metric: fit_exponent([r["length"] for r in rows], [r.get(metric) for r in rows])
+            for metric in METRICS
+        }
+        for name in models
+        for rows in [[r for r in results if r["model"] == name]]
+    }
+    return {
+        "environment": environment(),
+        "config": {"models": models, "lengths": sorted(lengths), "batch_size": batch_size, "repeats": repeats, "device": device},
+        "results": results,
+        "exponents": exponents,
+    }
+
+
+def compare_scaling(report: dict, baseline: dict, tolerance: float = 0.2, exponent_tolerance: float = 0.2):
+    """Regressions of a scaling report against a saved profile: metrics slower or larger by more than `tolerance`, and exponents higher by more than `exponent_tolerance`."""
+    regressions = []
+    for metric in METRICS:
+        regressions += [{"metric": metric, **r} for r in compare(report, baseline, ["model", "length"], metric, tolerance)]
+    for name, exponents in report["exponents"].items():
+        for metric, exponent in exponents.items():
+            base = baseline.get("exponents", {}).get(name, {}).get(metric)
+            if exponent is not None and base is not None and exponent > base + exponent_tolerance:
+                regressions.append({"metric": metric + "_exponent", "model": name, "exponent": exponent, "baseline": base})
+    return regressions
@@ -0,0 +1,185 @@
+import os
+import tempfile
+from os.path import join, exists
+from typing import List
+import numpy as np
+import torch
+from ..api.export import load_test_sequences, TEST_DATA_DIR
+from ..api.run import _encode, _load_sequences_from_fasta
+from ..api.weights import LEGACY_WEIGHTS_PATH, WEIGHTS_PATH, META_INIT, load_efold, read_manifest
+from ..core.batch import Batch
+from ..core.embeddings import sequence_to_int
+from ..core.postprocess import Constraints, UFold_processing, HungarianAlgorithm
+from ..models.evofold import eFoldNet
+from ..util.format_conversion import convert_bp_list_to_dotbracket
+from .report import timeit, environment
+
+# the model stages run on a batch, the other ones on each sequence
+STAGES = [
+    "fasta_parsing",
+    "sequence_to_int",
+    "collate",
+    "seq2map",
+    "trunk",
+    "output_structure",
+    "ufold",
+    "hungarian",
+    "dotbracket",
+]
+BATCHED_STAGES = ["fasta_parsing", "sequence_to_int", "collate", "seq2map", "trunk", "output_structure"]
+
+# entries of a report are matched on these keys when compared to a baseline
+KEYS = ["source", "stage", "length"]
+
+
+def synthetic_sequences(length: int, n: int, seed: int = 0):
+    """`n` random sequences of `length` nucleotides, the same for a given seed.
+
+    Example:
+    >>> sequences = synthetic_sequences(8, 2)
+    >>> [len(seq) for seq in sequences], sequences == synthetic_sequences(8, 2)
+    ([8, 8], True)
+    """
+    rng = np.random.default_rng(seed + length)
+    return ["".join(rng.choice(list("ACGU"), length)) for _ in range(n)]
+
+
+def _hairpin(length: int):
+    """Stem closing the whole sequence, 0-indexed, as a stand-in structure."""
+    return [(i, length - 1 - i) for i in range(length // 4)]
+
+
+def _stages(model, sequences: List[str], tmpdir: str):
+    """Callable of each stage, with the inputs of the stage precomputed."""
+    L = len(sequences[0])
+    fasta = join(tmpdir, "{}.fasta".format(L))
+    with open(fasta, "w") as f:
+        f.writelines(">{}\n{}\n".format(i, seq) for i, seq in enumerate(sequences))
+    items = [
+        {"reference": str(i), "sequence": seq, "length": len(seq), "structure": {"true": torch.tensor(_hairpin(len(seq)))}}
+        for i, seq in enumerate(sequences)
+    ]
+
+    src = _encode(sequences)
+    s = model.encoder(src)
+    z = model.encoder_adapter(model.seq2map(src)).permute(0, 2, 3, 1)
+    _, z_out = model.eFold(s, z)
+
+    def output_structure():
+        structure = model.structure_adapter(z_out).permute(0, 3, 1, 2)
+        for layer in model.output_structure:
+            structure = layer(structure)
+        return structure
+
+    logits = model.forward_sequence(src[:1])[0]
+    bppm = Constraints().apply_constraints(logits, sequence=src[0])
+    ufold = UFold_processing().run(bppm)
+    pairs = [(i + 1, j + 1) for i, j in _hairpin(L)]
+
+    return {
+        "fasta_parsing": lambda: _load_sequences_from_fasta(fasta),
+        "sequence_to_int": lambda: [sequence_to_int(seq) for seq in sequences],
+        "collate": lambda: Batch.from_dataset_items(items, ["structure"], use_error=False),
+        "seq2map": lambda: model.seq2map(src),
+        "trunk": lambda: model.eFold(s, z),
+        "output_structure": output_structure,
+        "ufold": lambda: UFold_processing().run(bppm),
+        "hungarian": lambda: HungarianAlgorithm().run(ufold, threshold=0.5),
+        "dotbracket": lambda: convert_bp_list_to_dotbracket(pairs, L),
+    }
+
+
+def _load(weights: str = None):
+    """eFold with the given or packaged weights, else randomly initialised: the model stages take as long, the post-processing does not."""
+    if weights is None:
+        weights = next((path for path in [WEIGHTS_PATH, LEGACY_WEIGHTS_PATH] if exists(path)), None)
+    if weights is not None:
+        return load_efold(weights, "cpu"), weights
+    return eFoldNet(**read_manifest(LEGACY_WEIGHTS_PATH)["hparams"]).eval(), "random"
+
+
+def benchmark_cold_start(repeats: int = 3):
+    """Time to build eFold with random init, on the meta device, and to load each packaged weights file."""
+    hparams = read_manifest(LEGACY_WEIGHTS_PATH)["hparams"]
+
+    def build_meta():
+        with torch.device("meta"):
+            eFoldNet(**hparams)
+
+    stages = {"build_eager": lambda: eFoldNet(**hparams)}
+    if META_INIT:
+        stages["build_meta"] = build_meta
+    for path in [WEIGHTS_PATH, LEGACY_WEIGHTS_PATH]:
+        if exists(path):
+            stages["load_" + path.rsplit(".", 1)[1]] = lambda path=path: load_efold(path, "cpu")
+
+    results = []
+    for stage, fn in stages.items():
+        median, best = timeit(fn, repeats, warmup=0)
+        results.append({"source": "cold_start", "stage": stage, "length": None, "median_s": median, "min_s": best})
+    return results
+
+
+def benchmark_stages(
+    lengths: List[int] = (32, 64, 128, 256, 512),
+    batch_size: int = 8,
+    repeats: int = 5,
+    sets: List[str] = None,
+    max_len: int = 500,
+    n_per_set: int = 16,
+    weights: str = None,
+    data_dir: str = TEST_DATA_DIR,
+):
+    """Times each inference stage on CPU, offline, and returns a JSON-serialisable report.
+
+    Synthetic sequences are timed at each length, on batches of `batch_size` for the
+    BATCHED_STAGES and on one sequence for the post-processing. Each bundled test set
+    (tests/data) is timed one sequence at a time, on its first `n_per_set` sequences
+    of at most `max_len` nucleotides, and reported as the median time per sequence.
+
+    Args:
+        sets (list): test sets to time. Defaults to all the bundled ones, if any.
+        weights (str): weights file. Defaults to the packaged weights, or a random init.
+    """
+    torch.manual_seed(0)
+    results = benchmark_cold_start()
+    model, weights = _load(weights)
+    if sets is None:
+        sets = sorted(os.listdir(data_dir)) if exists(data_dir) else []
+
+    with tempfile.TemporaryDirectory() as tmpdir, torch.inference_mode():
+        for L in lengths:
+            for stage, fn in _stages(model, synthetic_sequences(L, batch_size), tmpdir).items():
+                median, best = timeit(fn, repeats)
+                results.append({
+                    "source": "synthetic",
+                    "stage": stage,
+                    "length": L,
+                    "batch_size": batch_size if stage in BATCHED_STAGES else 1,
+                    "median_s": median,
+                    "min_s": best,
+                })
+
+        for name in sets:
+            sequences = list(load_test_sequences(name, max_len, data_dir).values())[:n_per_set]
+            times = {stage: [] for stage in STAGES}
+            for seq in sequences:
+                for stage, fn in _stages(model, [seq], tmpdir).items():
+                    times[stage].append(timeit(fn, repeats=1)[0])
+            for stage, values in times.items():
+                results.append({
+                    "source": name,
+                    "stage": stage,
+                    "length": None,
+                    "n": len(sequences),
+                    "mean_length": float(np.mean([len(seq) for seq in sequences])) if sequences else 0.0,
+                    "median_s": float(np.median(values)) if values else 0.0,
+                    "total_s": float(np.sum(values)),
+                })
+
+    return {
+        "environment": environment(),
+        "weights": weights,
+        "config": {"lengths": list(lengths), "batch_size": batch_size, "repeats": repeats, "sets": sets, "max_len": max_len, "n_per_set": n_per_set},
+        "results": results,
+    }
@@ -1,28 +1,85 @@
 import json
+from contextlib import nullcontext
 import click
-from efold.api.run import run
+from efold.util import timing
+from efold.api.run import run, BACKENDS, OVERFLOW
+from efold.models.cost import parse_bytes
+from efold.api.quantize import QUANTIZATION_MODES
 
-@click.command('efold')
+
+class DefaultGroup(click.Group):
+    """Group that runs the `fold` command when the first argument is not a subcommand, so that `efold SEQUENCE` keeps working."""
+
+    def parse_args(self, ctx, args):
+        if not args or args[0] not in self.commands:
+            args = ["fold"] + list(args)
+        return super().parse_args(ctx, args)
+
+
+def _bytes(ctx, param, value):
+    return None if value is None else parse_bytes(value)
+
+
+@click.group('efold', cls=DefaultGroup)
+def cli():
+    pass
+
+
+@cli.command('fold')
 @click.argument('sequence', required=False, type=str)
 @click.option('--fasta', '-f', help='Input FASTA file path')
 @click.option('--output', '-o', default='output.txt', help='Output file path (json, txt or csv)', type=click.Path())
 @click.option('--basepair/--dotbracket', '-bp/-db', default=False, help='Output structure format')
+@click.option('--backend', '-b', default='torch', type=click.Choice(BACKENDS), help='Inference backend')
+@click.option('--model', '-m', 'model_path', default=None, type=click.Path(exists=True), help='Exported graph for the torchscript and onnx backends')
+@click.option('--quantize', '-q', 'quantization', default=None, type=click.Choice(QUANTIZATION_MODES), help='Int8 quantized inference on CPU')
+@click.option('--workers', '-w', default=None, help="Number of CPU worker processes, or 'auto'")
+@click.option('--window', default=None, type=int, help='Fold sequences longer than this in overlapping windows of this size')
+@click.option('--stride', default=None, type=int, help='Step between windows (default: half the window)')
+@click.option('--max-span', default=None, type=int, help='Longest base pair in windowed mode (default: window - stride)')
+@click.option('--band', default=None, type=int, help='Only keep pair features for |i - j| <= BAND, memory then grows linearly with the length')
+@click.option('--server', '-s', default=None, help='URL of an efold server to send the sequences to (http://host:port or unix:///path)')
+@click.option('--memory-budget', default=None, callback=_bytes, help='Activation memory a sequence may take, e.g. 8G, according to the cost model of eFold')
+@click.option('--overflow', default='window', type=click.Choice(OVERFLOW), help='Fold the sequences that do not fit in the memory budget in windows, or refuse them')
+@click.option('--recycle-tol', default=None, type=float, help='Stop recycling a sequence once its pair features change by less than this between two passes (relative to their norm)')
+@click.option('--max-recycles', default=None, type=click.IntRange(min=0), help='Number of recycles, or most recycles with --recycle-tol (default: those of the model, 0 for the packaged weights)')
+@click.option('--timings', default=None, type=click.Path(), help='Save the time spent in each stage to this file (json or csv)')
+@click.option('--profile', 'trace', default=None, type=click.Path(), help='Run under torch.profiler and save a Chrome trace to this file')
 @click.option('--help', '-h', is_flag=True, help='Show this message', type=bool)
-def cli(sequence, fasta, output, basepair, help):
-    
+def fold(sequence, fasta, output, basepair, backend, model_path, quantization, workers, window, stride, max_span, band, server, memory_budget, overflow, recycle_tol, max_recycles, timings, trace, help):
+
     if help:
-        click.echo(cli.get_help(click.Context(cli)))
+        click.echo(fold.get_help(click.Context(fold)))
         return
-    
+
     fmt = 'bp' if basepair else 'dotbracket'
-    if sequence:
-        result = run(sequence, fmt)
-    elif fasta:
-        result = run(fasta, fmt)
-    else:
+    if workers is not None and workers != 'auto':
+        workers = int(workers)
+    recycling = recycle_tol is not None or max_recycles is not None
+    kwargs = dict(backend=backend, model_path=model_path, quantization=quantization, workers=workers, server=server, window=window, stride=stride, max_span=max_span, band=band, memory_budget=memory_budget, overflow=overflow, degraded=[], recycle_tol=recycle_tol, max_recycles=max_recycles, recycles=[] if recycling else None)
+    if not (sequence or fasta):
         click.echo("Please provide either a sequence or a FASTA file.")
         return
 
+    if trace:
+        instrument = timing.profile(trace)
+    elif timings:
+        instrument = timing.collect()
+    else:
+        instrument = nullcontext()
+    with instrument:
+        result = run(sequence or fasta, fmt, **kwargs)
+    if trace:
+        click.echo(f"Profiler trace saved to {trace}")
+    if timings:
+        timing.export(timings)
+        click.echo(f"Stage timings saved to {timings}")
+    for record in kwargs["degraded"]:
+        click.echo(f"Out of memory, sequence {record['index']} took the {record['path']} path", err=True)
+    if kwargs["recycles"]:
+        counts = [record["recycles"] for record in kwargs["recycles"]]
+        click.echo(f"Recycles: {sum(counts) / len(counts):.2f} on average, {min(counts)} to {max(counts)}, over {len(counts)} sequence(s) or window(s)", err=True)
+
     with open(output, 'w') as f:
         file_fmt = output.split('.')[-1]
         if file_fmt == 'json':
@@ -40,5 +97,154 @@ def cli(sequence, fasta, output, basepair, help):
             click.echo()
     click.echo(f"Output saved to {output}")
 
+
+@cli.command('serve')
+@click.option('--host', default='127.0.0.1', help='Host to listen on')
+@click.option('--port', default=8765, help='Port to listen on')
+@click.option('--socket', 'socket_path', default=None, type=click.Path(), help='Listen on this unix socket instead of host:port')
+@click.option('--backend', '-b', default='torch', type=click.Choice(BACKENDS), help='Inference backend')
+@click.option('--model', '-m', 'model_path', default=None, type=click.Path(exists=True), help='Exported graph for the torchscript and onnx backends')
+@click.option('--quantize', '-q', 'quantization', default=None, type=click.Choice(QUANTIZATION_MODES), help='Int8 quantized inference on CPU')
+@click.option('--max-batch-size', default=16, help='Largest micro-batch')
+@click.option('--max-latency-ms', default=10.0, help='Longest time a sequence waits for its micro-batch to fill')
+@click.option('--bucket-width', default=1, help='Sequences whose lengths differ by less than this are batched together (1 gives the same structures as a batch of one)')
+@click.option('--postprocess-workers', default=None, type=int, help='Post-processing threads (default: number of cores)')
+@click.option('--memory-budget', default=None, callback=_bytes, help='Activation memory a micro-batch may take, e.g. 8G, according to the cost model of eFold')
+def serve(host, port, socket_path, backend, model_path, quantization, max_batch_size, max_latency_ms, bucket_width, postprocess_workers, memory_budget):
+    """Serve eFold over HTTP with dynamic micro-batching."""
+    from efold.api.server import serve as serve_api
+
+    click.echo(f"Serving eFold on {'unix://' + socket_path if socket_path else f'http://{host}:{port}'}")
+    serve_api(
+        host=host,
+        port=port,
+        socket_path=socket_path,
+        backend=backend,
+        model_path=model_path,
+        quantization=quantization,
+        max_batch_size=max_batch_size,
+        max_latency=max_latency_ms / 1000,
+        bucket_width=bucket_width,
+        postprocess_workers=postprocess_workers,
+        memory_budget=memory_budget,
+    )
+
+
+@cli.command('export')
+@click.argument('path', type=click.Path())
+@click.option('--format', 'fmt', default=None, type=click.Choice(['torchscript', 'onnx']), help='Graph format (default: from the file extension)')
+@click.option('--validate', is_flag=True, help='Compare the exported graph against the eager model on the bundled test sets')
+@click.option('--max-len', default=500, help='Longest test sequence used for validation')
+def export(path, fmt, validate, max_len):
+    """Export eFold to a TorchScript or ONNX graph."""
+    from efold.api.export import export as export_graph, validate as validate_graph
+
+    export_graph(path, fmt=fmt)
+    click.echo(f"Model exported to {path}")
+
+    if validate:
+        report = validate_graph(path, fmt=fmt, max_len=max_len)
+        click.echo(json.dumps(report, indent=4))
+
+
+@cli.command('convert-weights')
+@click.argument('src', default=None, required=False, type=click.Path(exists=True))
+@click.argument('dst', default=None, required=False, type=click.Path())
+def convert_weights(src, dst):
+    """Convert pickled weights (default: the packaged ones) to a memory-mappable safetensors file, for a faster cold start."""
+    from efold.api.weights import convert_weights as convert, LEGACY_WEIGHTS_PATH, WEIGHTS_PATH
+
+    src = src or LEGACY_WEIGHTS_PATH
+    dst = dst or (WEIGHTS_PATH if src == LEGACY_WEIGHTS_PATH else src.rsplit(".", 1)[0] + ".safetensors")
+    convert(src, dst)
+    click.echo(f"Weights converted to {dst}")
+
+
+@cli.command('benchmark')
+@click.option('--lengths', default='32,64,128,256,512', help='Comma separated lengths of the synthetic sequences')
+@click.option('--batch-size', default=8, help='Batch size of the model stages')
+@click.option('--repeats', default=5, help='Timed runs of each stage')
+@click.option('--weights', default=None, type=click.Path(exists=True), help='Weights file (default: the packaged weights, else a random init)')
+@click.option('--output', '-o', default='benchmark.json', type=click.Path(), help='JSON report path')
+@click.option('--baseline', default=None, type=click.Path(exists=True), help='Previous JSON report to compare with')
+@click.option('--tolerance', default=0.2, help='Slowdown over the baseline flagged as a regression')
+def benchmark(lengths, batch_size, repeats, weights, output, baseline, tolerance):
+    """Time each inference stage on CPU, offline, and compare with a baseline report."""
+    from efold.benchmark.stages import benchmark_stages, KEYS
+    from efold.benchmark.report import compare, load, save
+
+    report = benchmark_stages([int(L) for L in lengths.split(',')], batch_size=batch_size, repeats=repeats, weights=weights)
+    save(report, output)
+    click.echo(f"Benchmark saved to {output}")
+
+    if baseline:
+        regressions = compare(report, load(baseline), KEYS, tolerance=tolerance)
+        click.echo(json.dumps(regressions, indent=4))
+        if regressions:
+            raise SystemExit(1)
+
+
+@cli.command('benchmark-scaling')
+@click.option('--models', default=None, help='Comma separated models of create_model (default: all)')
+@click.option('--lengths', default='32,64,128,256,512,1024,2048,4096', help='Comma separated sequence lengths')
+@click.option('--batch-size', default=1, help='Batch size')
+@click.option('--repeats', default=3, help='Timed runs of each measure')
+@click.option('--time-limit', default=60.0, help='Skip the longer lengths of a model once a forward pass takes longer than this, in seconds')
+@click.option('--device', default='cpu', help='Device to run the models on')
+@click.option('--output', '-o', default='scaling.json', type=click.Path(), help='JSON report path')
+@click.option('--baseline', default=None, type=click.Path(exists=True), help='Saved profile to compare with')
+@click.option('--tolerance', default=0.2, help='Increase over the baseline flagged as a regression')
+def benchmark_scaling(models, lengths, batch_size, repeats, time_limit, device, output, baseline, tolerance):
+    """Compare the cost of every model of create_model as the sequence length grows."""
+    from efold.benchmark.scaling import benchmark_scaling as scaling, compare_scaling
+    from efold.benchmark.report import load, save
+
+    report = scaling(
+        models=models.split(',') if models else None,
+        lengths=[int(L) for L in lengths.split(',')],
+        batch_size=batch_size,
+        repeats=repeats,
+        time_limit=time_limit,
+        device=device,
+    )
+    save(report, output)
+    click.echo(json.dumps(report["exponents"], indent=4))
+    click.echo(f"Scaling profile saved to {output}")
+
+    if baseline:
+        regressions = compare_scaling(report, load(baseline), tolerance=tolerance)
+        click.echo(json.dumps(regressions, indent=4))
+        if regressions:
+            raise SystemExit(1)
+
+
+@cli.command('calibrate')
+@click.argument('model', default='efold')
+@click.option('--lengths', default='64,128,256,512', help='Comma separated lengths of the measured runs')
+@click.option('--batch-size', default=1, help='Batch size of the measured runs')
+@click.option('--device', default='cpu', help='Device to calibrate')
+@click.option('--train', is_flag=True, help='Calibrate a training step instead of inference')
+def calibrate(model, lengths, batch_size, device, train):
+    """Fit the memory and FLOP cost model of a model to measured runs on this machine."""
+    from efold.models.cost import calibrate as calibrate_cost, calibration_path
+
+    cost = calibrate_cost(model, lengths=[int(L) for L in lengths.split(',')], batch_size=batch_size, device=device, train=train)
+    click.echo(json.dumps(cost.to_dict(), indent=4))
+    click.echo(f"Cost model saved to {calibration_path(model, device, train)}")
+
+
+@cli.command('quantize')
+@click.argument('mode', type=click.Choice(QUANTIZATION_MODES))
+@click.option('--max-len', default=500, help='Longest test sequence used for the comparison')
+def quantize(mode, max_len):
+    """Report the F1 of the quantized model against fp32 on the bundled test sets."""
+    from efold.api.run import load_model
+    from efold.api.quantize import quantize as quantize_model, compare
+
+    model = load_model("cpu")
+    report = compare(quantize_model(model, mode=mode), model, max_len=max_len)
+    click.echo(json.dumps(report, indent=4))
+
+
 if __name__ == '__main__':
-    cli()
\ No newline at end of file
+    cli()
@@ -5,21 +5,30 @@ seq2int = {"X": 0, "A": 1, "C": 2, "G": 3, "U": 4}  # , 'S': 5, 'E': 6}
 # seq2int = {"X": 0, "A": 1, "U": 2, "C": 3, "G": 4}  
 int2seq = {v: k for k, v in seq2int.items()}
 
-START_TOKEN = None  # seq2int['S']
-END_TOKEN = None  # seq2int['E']
+# tokens of the models that frame the sequence, after the bases of seq2int (sequences never contain them)
+START_TOKEN = len(seq2int)
+END_TOKEN = len(seq2int) + 1
 PADDING_TOKEN = seq2int["X"]
 
 DEFAULT_FORMAT = float32
 torch.set_default_dtype(DEFAULT_FORMAT)
 UKN = -1000.0
 VAL_GU = 0.095
-device = (
-    "cuda"
-    if cuda.is_available()
-    # else "mps"  # moi j'aime bien le mps
-    # if backends.mps.is_available()
-    else "cpu"
-)
+
+
+def __getattr__(name):
+    # probing CUDA takes time, so `device` is only resolved when first imported
+    if name == "device":
+        globals()["device"] = (
+            "cuda"
+            if cuda.is_available()
+            # else "mps"  # moi j'aime bien le mps
+            # if backends.mps.is_available()
+            else "cpu"
+        )
+        return globals()["device"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 TEST_SETS = {
     "structure": ["PDB", "archiveII", "lncRNA_nonFiltered", "viral_fragments"], 
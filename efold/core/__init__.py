@@ -1,4 +1,12 @@
-from .datamodule import DataModule
+from importlib import import_module
 from . import metrics
-from .dataset import Dataset
-from .postprocess import Postprocess
+from .postprocess import Postprocess, SparsePostprocess
+
+# the training stack (lightning, rouskinhf) is only imported when used
+_LAZY = {"DataModule": ".datamodule", "Dataset": ".dataset"}
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        return getattr(import_module(_LAZY[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
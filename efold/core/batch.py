@@ -2,10 +2,11 @@ import torch
 from torch import tensor
 import torch.nn.functional as F
 from .embeddings import base_pairs_to_pairing_matrix, sequence_to_int
-from ..config import device, POSSIBLE_METRICS, UKN
+from ..config import POSSIBLE_METRICS, UKN
 from typing import Dict
 from .datatype import data_type_factory
 from .util import split_data_type
+from ..util.timing import timed
 from torch import cuda, backends
 
 
@@ -61,6 +62,7 @@ class Batch:
         self.device = device
 
     @classmethod
+    @timed("batch.collate")
     def from_dataset_items(
         cls,
         batch_data: list,
@@ -249,3 +251,10 @@ class Batch:
     def to(self, device):
         self.device = device
         return self
+
+    def pin_memory(self):
+        """Page-locks the tensors, called by the DataLoader workers with pin_memory=True."""
+        for attr in ['dms', 'shape', 'structure', 'sequence']:
+            if getattr(self, attr) is not None:
+                setattr(self, attr, getattr(self, attr).pin_memory())
+        return self
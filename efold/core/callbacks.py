@@ -1,4 +1,5 @@
 import os
+import time
 from lightning import LightningModule, Trainer
 import lightning.pytorch as pl
 import torch
@@ -12,7 +13,7 @@ from typing import Any
 from .visualisation import plot_factory
 from .metrics import metric_factory
 from .datamodule import DataModule
-from .loader import Loader
+from .checkpoint import CheckpointManager
 from .batch import Batch
 from ..config import (
     TEST_SETS_NAMES,
@@ -25,23 +26,174 @@ from .logger import Logger, LocalLogger
 
 
 class ModelCheckpoint(pl.Callback):
-    def __init__(self, every_n_epoch=1) -> None:
+    """Saves the model every `every_n_epoch` validations, in the background, and keeps the top_k by `monitor`.
+
+    The checkpoints are named {name}_epoch{n}.pt, with the wandb run name by default, and indexed
+    in `dirpath`/index.json, see efold.core.checkpoint.CheckpointManager. `monitor` defaults to
+    the reference metric of the first data type of the model on its first validation set, e.g.
+    valid/<set>/structure/f1, and `mode` to its direction.
+    """
+
+    def __init__(self, every_n_epoch=1, dirpath="models", monitor=None, mode=None, top_k=3, name=None) -> None:
         super().__init__()
         self.every_n_epoch = every_n_epoch
+        self.dirpath = dirpath
+        self.monitor = monitor
+        self.mode = mode
+        self.top_k = top_k
+        self.name = name
+        self.manager = None
+
+    def _setup_manager(self, trainer: Trainer, pl_module):
+        data_type = pl_module.data_type_output[0]
+        if self.monitor is None:
+            self.monitor = "valid/{}/{}/{}".format(trainer.datamodule.external_valid[0], data_type, REFERENCE_METRIC[data_type])
+            self.mode = self.mode or ("max" if REF_METRIC_SIGN[data_type] > 0 else "min")
+        self.manager = CheckpointManager(self.dirpath, monitor=self.monitor, mode=self.mode or "max", top_k=self.top_k)
 
     @rank_zero_only
     def on_validation_end(self, trainer: Trainer, pl_module, dataloader_idx=0):
-        if dataloader_idx:
+        if dataloader_idx or trainer.sanity_checking:
             return
 
-        # Save best model
-        if wandb.run is None:
+        if trainer.current_epoch % self.every_n_epoch != 0:
             return
 
-        if trainer.current_epoch % self.every_n_epoch != 0:
+        if self.manager is None:
+            self._setup_manager(trainer, pl_module)
+        score = trainer.callback_metrics.get(self.monitor)
+        name = self.name or (wandb.run.name if wandb.run is not None else "efold")
+        self.manager.save(
+            pl_module.state_dict(),
+            "{}_epoch{}.pt".format(name, trainer.current_epoch),
+            score=None if score is None else score.item(),
+            epoch=trainer.current_epoch,
+            step=trainer.global_step,
+        )
+
+    @rank_zero_only
+    def on_fit_end(self, trainer: Trainer, pl_module):
+        if self.manager is not None:
+            self.manager.close()
+
+
+class DataWaitTimer(pl.Callback):
+    """Logs, each training epoch, the time the loop waited for the dataloader (train/data_wait_s) and its share of the epoch (train/data_wait_fraction).
+
+    A high share means the model is starved: raise num_workers or prefetch_factor of the DataModule.
+    """
+
+    def on_train_epoch_start(self, trainer: Trainer, pl_module):
+        self.wait = 0.0
+        self.start = self.last = time.perf_counter()
+
+    def on_train_batch_start(self, trainer: Trainer, pl_module, batch, batch_idx):
+        self.wait += time.perf_counter() - self.last
+
+    def on_train_batch_end(self, trainer: Trainer, pl_module, outputs, batch, batch_idx):
+        self.last = time.perf_counter()
+
+    def on_train_epoch_end(self, trainer: Trainer, pl_module):
+        elapsed = time.perf_counter() - self.start
+        pl_module.log("train/data_wait_s", self.wait, sync_dist=True)
+        pl_module.log("train/data_wait_fraction", self.wait / elapsed if elapsed else 0.0, sync_dist=True)
+
+
+class WeightAveraging(pl.Callback):
+    """Keeps an average of the weights during training, and validates and checkpoints it.
+
+    With mode 'ema', the average is updated as avg += (1 - decay) * (w - avg); with 'swa',
+    it is the running mean of the weights since start_step. The update is one in-place
+    foreach lerp every `every_n_steps` optimizer steps, on a CPU copy with `on_cpu` to spare
+    accelerator memory. The floating point buffers, such as the batch norm statistics, are
+    averaged with the parameters.
+
+    The averaged weights are swapped into the model at the start of validation and swapped
+    out before the next training batch, so that the validation metrics and the checkpoints
+    saved at the end of validation (ModelCheckpoint) are those of the average. The average
+    is saved with the callback states of the Lightning checkpoints, and left in the model
+    at the end of training with `swap_at_end`.
+    """
+
+    MODES = ["ema", "swa"]
+
+    def __init__(self, mode="ema", decay=0.999, every_n_steps=1, start_step=0, on_cpu=False, swap_at_end=True) -> None:
+        super().__init__()
+        assert mode in self.MODES, "Invalid mode. Must be one of {}".format(self.MODES)
+        self.mode = mode
+        self.decay = decay
+        self.every_n_steps = every_n_steps
+        self.start_step = start_step
+        self.on_cpu = on_cpu
+        self.swap_at_end = swap_at_end
+        self.averaged = None
+        self.n_averaged = 0
+        self._last_step = None
+        self._swapped = False
+        self._restored = False
+
+    def _tensors(self, pl_module):
+        # the floating point parameters and buffers, in state dict order
+        return [t for t in pl_module.state_dict(keep_vars=True).values() if t.is_floating_point()]
+
+    def _place(self, pl_module):
+        # the average restored from a checkpoint is on the device it was loaded to, which some strategies do after on_fit_start
+        if self._restored:
+            self.averaged = [a.to("cpu" if self.on_cpu else t.device) for a, t in zip(self.averaged, self._tensors(pl_module))]
+            self._restored = False
+
+    def on_fit_start(self, trainer: Trainer, pl_module):
+        if self.averaged is None:
+            self.averaged = [t.detach().to("cpu", copy=True) if self.on_cpu else t.detach().clone() for t in self._tensors(pl_module)]
+        self._place(pl_module)
+        self._last_step = trainer.global_step
+
+    @torch.no_grad()
+    def on_train_batch_start(self, trainer: Trainer, pl_module, batch, batch_idx):
+        self._place(pl_module)
+        if self._swapped:
+            self._swap(pl_module)
+
+    @torch.no_grad()
+    def on_train_batch_end(self, trainer: Trainer, pl_module, outputs, batch, batch_idx):
+        # with gradient accumulation, the weights only change when the global step does
+        step = trainer.global_step
+        if step == self._last_step or step < self.start_step or step % self.every_n_steps:
             return
+        self._last_step = step
+
+        weights = [t.detach() for t in self._tensors(pl_module)]
+        if self.on_cpu:
+            weights = [t.to("cpu", non_blocking=True) for t in weights]
+            if torch.cuda.is_available():
+                torch.cuda.current_stream().synchronize()
+        self.n_averaged += 1
+        weight = 1.0 / self.n_averaged if self.mode == "swa" else 1.0 - self.decay
+        torch._foreach_lerp_(self.averaged, weights, weight)
+
+    @torch.no_grad()
+    def _swap(self, pl_module):
+        for t, a in zip(self._tensors(pl_module), self.averaged):
+            current = t.detach().clone()
+            t.detach().copy_(a)
+            a.copy_(current)
+        self._swapped = not self._swapped
+
+    @torch.no_grad()
+    def on_validation_start(self, trainer: Trainer, pl_module):
+        self._place(pl_module)
+        if self.averaged is not None and not self._swapped:
+            self._swap(pl_module)
+
+    @torch.no_grad()
+    def on_train_end(self, trainer: Trainer, pl_module):
+        if self._swapped != self.swap_at_end:
+            self._swap(pl_module)
+
+    def state_dict(self):
+        # the average, or the weights while it is swapped into the model, copied as the next swap changes them in place
+        return {"averaged": [a.clone() for a in self.averaged] if self.averaged is not None else None, "n_averaged": self.n_averaged, "swapped": self._swapped}
 
-        name = "{}_epoch{}.pt".format(wandb.run.name, trainer.current_epoch)
-        loader = Loader(path="models/" + name)
-        # logs what MAE it corresponds to
-        loader.dump(pl_module)
+    def load_state_dict(self, state_dict):
+        self.averaged, self.n_averaged, self._swapped = state_dict["averaged"], state_dict["n_averaged"], state_dict["swapped"]
+        self._restored = self.averaged is not None
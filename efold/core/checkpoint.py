@@ -0,0 +1,124 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import torch
+
+INDEX_NAME = "index.json"
+
+
+def _atomic_write(path: str, write):
+    """Calls write(tmp_path), then renames tmp_path to path, so that readers never see a partial file."""
+    tmp = "{}.tmp{}".format(path, os.getpid())
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _dump_json(obj, path: str):
+    with open(path, "w") as f:
+        json.dump(obj, f, indent=4)
+
+
+def read_index(directory: str = "models"):
+    """Index of a checkpoint directory, or None if it has none.
+
+    Example:
+    >>> read_index("/nonexistent") is None
+    True
+    """
+    path = os.path.join(directory, INDEX_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def best_checkpoint(directory: str = "models", prefix: str = ""):
+    """Path of the best checkpoint in the index of `directory` whose name starts with `prefix`, or None."""
+    index = read_index(directory)
+    for entry in index["checkpoints"] if index else []:
+        if entry["name"].startswith(prefix):
+            return os.path.join(directory, entry["name"])
+    return None
+
+
+class CheckpointManager:
+    """Saves state dicts in the background and keeps the top_k by a validation score.
+
+    save() takes a CPU snapshot of the state dict, which is the only part done in the
+    caller's thread, then one background thread writes it to a temporary file and
+    renames it, so that a checkpoint is either whole or absent. The kept checkpoints are
+    listed best first in the JSON index `directory`/index.json, {'monitor', 'mode',
+    'checkpoints': [{'name', 'score', 'epoch', 'step'}]}, which best_checkpoint() reads
+    instead of scanning the directory. The checkpoints of this manager that fall out of
+    the top_k are deleted, those of earlier runs in the index are kept. Checkpoints
+    without a score rank after those with one, newest first.
+    """
+
+    def __init__(self, directory: str = "models", monitor: str = None, mode: str = "max", top_k: int = 3):
+        assert mode in ["min", "max"], "Invalid mode. Must be either 'min' or 'max'"
+        self.directory = directory
+        self.monitor = monitor
+        self.mode = mode
+        self.top_k = top_k
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint")
+        self._pending = []
+        self._saved = set()
+        os.makedirs(directory, exist_ok=True)
+        index = read_index(directory)
+        self.entries = index["checkpoints"] if index else []
+
+    def _rank(self, entry):
+        score = entry["score"]
+        if score is None:
+            return (1, -entry["step"])
+        return (0, -score if self.mode == "max" else score)
+
+    def save(self, state_dict: dict, name: str, score: float = None, epoch: int = None, step: int = 0):
+        """Snapshots `state_dict` to CPU and writes it as `directory`/`name` in the background.
+
+        Returns:
+            concurrent.futures.Future: done once the checkpoint and the index are written.
+        """
+        snapshot = {key: value.detach().to("cpu", copy=True) if torch.is_tensor(value) else value for key, value in state_dict.items()}
+        entry = {"name": name, "score": None if score is None else float(score), "epoch": epoch, "step": step}
+        future = self._executor.submit(self._write, snapshot, entry)
+        self._pending = [f for f in self._pending if not f.done()] + [future]
+        return future
+
+    def _write(self, snapshot, entry):
+        _atomic_write(os.path.join(self.directory, entry["name"]), lambda path: torch.save(snapshot, path))
+        with self._lock:
+            # the top_k only applies to the checkpoints of this manager, those of other runs stay indexed
+            self._saved.add(entry["name"])
+            entries = sorted([e for e in self.entries if e["name"] != entry["name"]] + [entry], key=self._rank)
+            evicted = [e for e in entries if e["name"] in self._saved][self.top_k :]
+            self.entries = [e for e in entries if e not in evicted]
+            index = {"monitor": self.monitor, "mode": self.mode, "checkpoints": self.entries}
+            _atomic_write(os.path.join(self.directory, INDEX_NAME), lambda path: _dump_json(index, path))
+        for e in evicted:
+            path = os.path.join(self.directory, e["name"])
+            if os.path.exists(path):
+                os.remove(path)
+
+    def best(self):
+        """Path of the best checkpoint of this manager, or None."""
+        self.wait()
+        with self._lock:
+            entries = [e for e in self.entries if e["name"] in self._saved]
+            return os.path.join(self.directory, entries[0]["name"]) if entries else None
+
+    def wait(self):
+        """Blocks until the pending checkpoints are written, and raises their errors."""
+        for future in self._pending:
+            future.result()
+        self._pending = []
+
+    def close(self):
+        self.wait()
+        self._executor.shutdown()
@@ -1,14 +1,57 @@
-from torch.utils.data import random_split, Subset
+from torch.utils.data import random_split, Subset, get_worker_info
+import functools
+import os
+import torch
 import lightning.pytorch as pl
 from typing import Union, List
 from .dataset import Dataset
 from ..config import TEST_SETS, UKN
-from .sampler import sampler_factory
+from .sampler import sampler_factory, MemoryBudgetBatchSampler
 from .dataloader import DataLoader
 import numpy as np
 import datetime
 
 
+def _lengths(dataset):
+    if isinstance(dataset, Subset):
+        return [dataset.dataset.length[i] for i in dataset.indices]
+    return dataset.length
+
+
+def _init_worker(worker_id, hook=None):
+    """Lets each dataset reached from the worker's dataset reopen its files (a `reopen` method, e.g. for memory-mapped data, whose handles must not be shared with the parent), then calls `hook`."""
+    datasets = [get_worker_info().dataset]
+    while datasets:
+        dataset = datasets.pop()
+        if hasattr(dataset, "reopen"):
+            dataset.reopen()
+        if isinstance(dataset, Subset):
+            datasets.append(dataset.dataset)
+        datasets += getattr(dataset, "datasets", [])
+    if hook is not None:
+        hook(worker_id)
+
+
+def _num_workers(num_workers):
+    """Number of dataloader workers, with 'auto' for the CPU cores per GPU, at most 8.
+
+    Example:
+    >>> _num_workers(0), _num_workers(3)
+    (0, 3)
+    """
+    if num_workers == "auto":
+        return min(8, (os.cpu_count() or 1) // max(torch.cuda.device_count(), 1))
+    if not isinstance(num_workers, int) or num_workers < 0:
+        raise ValueError("num_workers must be a non-negative integer or 'auto', got {}".format(num_workers))
+    return num_workers
+
+
+def _default_cost_model():
+    from ..models.cost import load_cost_model
+
+    return load_cost_model(device="cuda" if torch.cuda.is_available() else "cpu", train=True)
+
+
 class DataModule(pl.LightningDataModule):
     def __init__(
         self,
@@ -16,7 +59,7 @@ class DataModule(pl.LightningDataModule):
         batch_size: int,
         data_type: List[str] = ["dms", "shape", "structure"],
         force_download=False,
-        num_workers: int = 0,
+        num_workers: Union[int, str] = 0,
         train_split: float = 1.0,
         predict_split: float = 0,
         strategy="random",
@@ -29,6 +72,12 @@ class DataModule(pl.LightningDataModule):
         structure_padding_value=UKN,
         tqdm=True,
         buckets=None,
+        memory_budget=None,
+        cost_model=None,
+        persistent_workers: bool = False,
+        prefetch_factor: int = 4,
+        pin_memory: bool = False,
+        worker_init_fn=None,
         **kwargs,
     ):
         """DataModule for the Rouskin lab datasets.
@@ -38,7 +87,11 @@ class DataModule(pl.LightningDataModule):
             data: type of the data (e.g. 'dms', 'structure')
             force_download: re-download the dataset from the Rouskin lab HuggingFace repository
             batch_size: batch size for the dataloaders
-            num_workers: number of workers for the dataloaders
+            num_workers: number of workers for the dataloaders, or 'auto' for up to 8 per GPU. Default 0 loads in the main process.
+            persistent_workers: keep the train and validation workers alive across epochs instead of re-forking them
+            prefetch_factor: batches loaded in advance by each worker
+            pin_memory: load the batches in page-locked memory, for faster copies to the GPU. Only used when CUDA is available.
+            worker_init_fn: called with the worker id in each worker, after the datasets reopened their files (see _init_worker)
             train_split: percentage of the dataset to use for training or number of samples to use for training. If None, the entire dataset minus the validation set is used for training
             valid_split: percentage of the dataset to use for validation or number of samples to use for validation
             predict_split: percentage of the dataset to use for prediction or number of samples to use for prediction
@@ -46,6 +99,8 @@ class DataModule(pl.LightningDataModule):
             overfit_mode: if True, the train set is used for validation and testing. Useful for debugging. Default is False.
             sampler: 'bucket' or 'random'. If 'bucket', the data is sampled by bucketing sequences of similar lengths. If 'random', the data is sampled randomly. Default is 'bucket'.
             strategy: 'random', 'ddp' or 'sorted'
+            memory_budget: bytes of activation memory a training batch may take. If set, the train batches are as large as the budget allows, up to batch_size. Not available with strategy='ddp'.
+            cost_model: cost model of the trained model (see efold.models.cost). Defaults to eFold's.
         """
         # Save arguments
         super().__init__(**kwargs)
@@ -57,7 +112,11 @@ class DataModule(pl.LightningDataModule):
 
         self.batch_size = batch_size
         self.strategy = strategy
-        self.num_workers = num_workers
+        self.num_workers = _num_workers(num_workers)
+        self.persistent_workers = persistent_workers
+        self.prefetch_factor = prefetch_factor
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        self.worker_init_fn = worker_init_fn
         self.data_type = data_type
         self.external_valid = external_valid
         self.splits = {
@@ -83,9 +142,13 @@ class DataModule(pl.LightningDataModule):
             "min_len": min_len,
         }
         self.buckets = buckets
+        if memory_budget is not None and strategy == "ddp":
+            raise ValueError("memory_budget is not available with strategy='ddp', as the ranks would get different numbers of batches")
+        self.memory_budget = memory_budget
+        self.cost_model = cost_model
 
         # Log hyperparameters
-        self.save_hyperparameters(ignore=["force_download"])
+        self.save_hyperparameters(ignore=["force_download", "cost_model", "worker_init_fn"])
 
     def _use_multiple_datasets(self, name):
         if isinstance(name, str):
@@ -173,6 +236,17 @@ class DataModule(pl.LightningDataModule):
             for name in datasets
         ]
 
+    def _loader_kwargs(self, persistent=True):
+        """Worker settings of the dataloaders. The test loaders are iterated once, so their workers are not kept."""
+        kwargs = dict(num_workers=self.num_workers, pin_memory=self.pin_memory)
+        if self.num_workers > 0:
+            kwargs.update(
+                persistent_workers=self.persistent_workers and persistent,
+                prefetch_factor=self.prefetch_factor,
+                worker_init_fn=functools.partial(_init_worker, hook=self.worker_init_fn),
+            )
+        return kwargs
+
     def train_dataloader(self):
         if self.strategy == "ddp":
             if self.trainer is None:
@@ -186,10 +260,25 @@ class DataModule(pl.LightningDataModule):
             num_replicas = 1
             rank = 0
 
+        if self.memory_budget is not None:
+            return DataLoader(
+                self.train_set,
+                collate_fn=self.collate_fn,
+                to_device=self.strategy != "ddp",
+                batch_sampler=MemoryBudgetBatchSampler(
+                    _lengths(self.train_set),
+                    self.cost_model or _default_cost_model(),
+                    self.memory_budget,
+                    max_batch_size=self.batch_size,
+                    shuffle=self.shuffle["train"],
+                    seed=os.environ.get("PL_GLOBAL_SEED", 0),
+                ),
+                **self._loader_kwargs(),
+            )
+
         return DataLoader(
             self.train_set,
             shuffle=self.shuffle["train"],
-            num_workers=self.num_workers,
             collate_fn=self.collate_fn,
             batch_size=self.batch_size,
             to_device=self.strategy != "ddp",
@@ -200,6 +289,7 @@ class DataModule(pl.LightningDataModule):
                 seed=datetime.datetime.now().hour,
                 rank=rank,
             ),
+            **self._loader_kwargs(),
         )
 
     def val_dataloader(self):
@@ -223,6 +313,7 @@ class DataModule(pl.LightningDataModule):
                             seed=datetime.datetime.now().hour,
                             rank=self.trainer.local_rank,
                         ),
+                        **self._loader_kwargs(),
                     )
                 )
         return val_dls
@@ -231,9 +322,9 @@ class DataModule(pl.LightningDataModule):
         return [
             DataLoader(
                 test_set,
-                num_workers=self.num_workers,
                 collate_fn=test_set.collate_fn,
                 batch_size=self.batch_size,
+                **self._loader_kwargs(persistent=False),
             )
             for test_set in self.test_sets
         ]
@@ -241,10 +332,10 @@ class DataModule(pl.LightningDataModule):
     def predict_dataloader(self):
         return DataLoader(
             self.predict_set,
-            num_workers=self.num_workers,
             collate_fn=self.collate_fn,
             batch_size=self.batch_size,
             shuffle=False,
+            **self._loader_kwargs(persistent=False),
         )
 
     def teardown(self, stage: str):
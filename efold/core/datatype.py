@@ -1,5 +1,5 @@
 import torch
-from ..config import device, UKN, DTYPE_PER_DATA_TYPE
+from ..config import UKN, DTYPE_PER_DATA_TYPE
 import torch.nn.functional as F
 from .util import _pad
 
@@ -17,6 +17,12 @@ class DataType:
             if hasattr(getattr(self, attr), "to"):
                 setattr(self, attr, getattr(self, attr).to(device))
         return self
+
+    def pin_memory(self):
+        for attr in DataType.attributes:
+            if hasattr(getattr(self, attr), "pin_memory"):
+                setattr(self, attr, getattr(self, attr).pin_memory())
+        return self
     
     def __del__(self):
         del self.true
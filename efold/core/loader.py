@@ -2,6 +2,7 @@ from os.path import dirname
 from os import makedirs, listdir
 import torch
 import os
+from .checkpoint import best_checkpoint
 
 
 class Loader:
@@ -14,6 +15,10 @@ class Loader:
 
     @classmethod
     def find_best_model(cls, prefix):
+        """Best checkpoint of the index of models/ (see efold.core.checkpoint), else the lowest `_mae:` in the file names."""
+        path = best_checkpoint("models", prefix)
+        if path is not None:
+            return cls(path=path)
         models = [model for model in listdir("models") if model.startswith(prefix)]
         if len(models) == 0:
             return None
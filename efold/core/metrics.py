@@ -127,34 +127,129 @@ metric_factory = {
 }
 
 
-class MetricsStack:
-    def __init__(self, name, data_type=["dms", "shape", "structure"]):
+# upper edges of the length bins of the metric breakdowns
+LENGTH_BINS = [100, 200, 400, 800]
+
+# per-sample metrics of the MetricsAccumulator
+SAMPLE_METRICS = {
+    "structure": ["precision", "recall", "f1"],
+    "dms": ["mae", "r2", "pearson"],
+    "shape": ["mae", "r2", "pearson"],
+}
+
+
+def structure_scores(pred, true, length, threshold=0.5):
+    """Per-sample precision, recall and F1 of (N, L, L) pairing matrices, on the pairs within each length where `true` is not UKN.
+
+    A sample with no pair, predicted or true, scores 1.
+
+    Returns:
+        dict: metric -> (values (N,), valid (N,))
+
+    Example:
+    >>> true = torch.tensor([[[0.0, 1.0, UKN], [1.0, 0.0, UKN], [UKN, UKN, UKN]]])
+    >>> scores = structure_scores(torch.ones(1, 3, 3), true, torch.tensor([2]))
+    >>> {metric: round(values.item(), 4) for metric, (values, valid) in scores.items()}
+    {'precision': 0.5, 'recall': 1.0, 'f1': 0.6667}
+    """
+    inside = torch.arange(true.shape[-1], device=true.device)[None, :] < length[:, None]
+    mask = (true != UKN) & inside[:, :, None] & inside[:, None, :]
+    pred = (pred > threshold) & mask
+    true = (true == 1) & mask
+
+    tp = (pred & true).sum((1, 2)).float()
+    n_pred = pred.sum((1, 2)).float()
+    n_true = true.sum((1, 2)).float()
+    empty = (n_pred + n_true) == 0
+    valid = mask.any(2).any(1)
+    return {
+        "precision": (torch.where(n_pred > 0, tp / n_pred.clamp(min=1), empty.float()), valid),
+        "recall": (torch.where(n_true > 0, tp / n_true.clamp(min=1), empty.float()), valid),
+        "f1": (torch.where(empty, torch.ones_like(tp), 2 * tp / (n_pred + n_true).clamp(min=1)), valid),
+    }
+
+
+def signal_scores(pred, true, eps=1e-8):
+    """Per-sample MAE, R2 and Pearson coefficient of (N, L) signals, on the positions where `true` is not UKN.
+
+    Returns:
+        dict: metric -> (values (N,), valid (N,))
+
+    Example:
+    >>> true = torch.tensor([[0.0, 0.5, 1.0, UKN]])
+    >>> scores = signal_scores(torch.tensor([[0.0, 0.5, 1.0, 0.3]]), true)
+    >>> {metric: round(values.item(), 4) for metric, (values, valid) in scores.items()}
+    {'mae': 0.0, 'r2': 1.0, 'pearson': 1.0}
+    """
+    mask = true != UKN
+    n = mask.sum(1).float()
+    true = torch.where(mask, true, torch.zeros_like(true))
+    pred = torch.where(mask, pred, torch.zeros_like(pred))
+    d_pred = torch.where(mask, pred - pred.sum(1, keepdim=True) / n.clamp(min=1)[:, None], torch.zeros_like(pred))
+    d_true = torch.where(mask, true - true.sum(1, keepdim=True) / n.clamp(min=1)[:, None], torch.zeros_like(true))
+
+    sst = (d_true**2).sum(1)
+    spread = (sst > eps) & ((d_pred**2).sum(1) > eps)
+    return {
+        "mae": ((pred - true).abs().sum(1) / n.clamp(min=1), n > 0),
+        "r2": (1 - ((pred - true) ** 2).sum(1) / sst.clamp(min=eps), sst > eps),
+        "pearson": ((d_pred * d_true).sum(1) / ((d_pred**2).sum(1) * sst).sqrt().clamp(min=eps), spread),
+    }
+
+
+class MetricsAccumulator:
+    """Running sums of per-sample metrics, kept on the device of the predictions so that update() never syncs.
+
+    The metrics are averaged over the samples, overall and per bin of LENGTH_BINS, and
+    summed across the DDP ranks once, in compute().
+    """
+
+    def __init__(self, name, data_type=["dms", "shape", "structure"], length_bins=LENGTH_BINS):
         self.name = name
         self.data_type = data_type
-        self.dms = dict(mae=[], pearson=[], r2=[])
-        self.shape = dict(mae=[], pearson=[], r2=[])
-        self.structure = dict(f1=[])
+        self.metrics = [(dt, metric) for dt in data_type for metric in SAMPLE_METRICS[dt]]
+        self.length_bins = length_bins
+        self.state = None  # (sum, count) x metric x length bin
+
+    def _labels(self):
+        edges = [0] + self.length_bins
+        return ["len_{}-{}".format(lo, hi - 1) for lo, hi in zip(edges[:-1], edges[1:])] + ["len_{}+".format(edges[-1])]
 
     def update(self, batch: Batch):
         for dt in self.data_type:
             pred, true = batch.get_pairs(dt)
-            for metric in POSSIBLE_METRICS[dt]:
-                self._add_metric(dt, metric, metric_factory[metric](pred, true))
+            if pred is None or true is None:
+                continue
+            if self.state is None:
+                self.state = torch.zeros(2, len(self.metrics), len(self.length_bins) + 1, device=true.device)
+            length = torch.as_tensor(batch.get("length"), device=true.device)
+            bins = torch.bucketize(length, torch.tensor(self.length_bins, device=true.device), right=True)
+            scores = structure_scores(pred, true, length) if dt == "structure" else signal_scores(pred, true)
+            for metric, (values, valid) in scores.items():
+                k = self.metrics.index((dt, metric))
+                self.state[0, k].index_add_(0, bins, torch.where(valid, values.float(), torch.zeros_like(values, dtype=torch.float)))
+                self.state[1, k].index_add_(0, bins, valid.float())
         return self
 
     def compute(self) -> dict:
-        out = {}
-        for dt in self.data_type:
-            out[dt] = {}
-            for metric in POSSIBLE_METRICS[dt]:
-                out[dt][metric] = self._get_nanmean(dt, metric)
+        """{data_type: {metric: mean, metric/len_a-b: mean}}, NaN without samples. Sums across the DDP ranks, which must all call it."""
+        state = self.state
+        if state is None:
+            state = torch.zeros(2, len(self.metrics), len(self.length_bins) + 1)
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            if state.device.type == "cpu" and torch.distributed.get_backend() == "nccl":
+                state = state.cuda()
+            torch.distributed.all_reduce(state)
+        sums, counts = state.cpu().double().numpy()
+
+        out = {dt: {} for dt in self.data_type}
+        labels = self._labels()
+        with np.errstate(invalid="ignore", divide="ignore"):
+            for k, (dt, metric) in enumerate(self.metrics):
+                out[dt][metric] = float(sums[k].sum() / counts[k].sum()) if counts[k].sum() else np.nan
+                for label, total, count in zip(labels, sums[k], counts[k]):
+                    out[dt]["{}/{}".format(metric, label)] = float(total / count) if count else np.nan
         return out
 
-    def _get_nanmean(self, data_type, metric):
-        return np.nanmean(self._get_list(data_type, metric))
-
-    def _get_list(self, data_type, metric):
-        return getattr(self, data_type)[metric]
-
-    def _add_metric(self, data_type, metric, value):
-        self._get_list(data_type, metric).append(value)
+    def reset(self):
+        self.state = None
@@ -7,11 +7,13 @@ from ..config import device, UKN, TEST_SETS_NAMES
 import torch.nn.functional as F
 from .batch import Batch
 from torchmetrics import R2Score, PearsonCorrCoef, MeanAbsoluteError, F1Score
-from .metrics import MetricsStack
+from .metrics import MetricsAccumulator
 from .datamodule import DataModule
 import time
+import os
 
 from .postprocess import Postprocess
+from .predictions import PredictionWriter
 
 METRIC_ARGS = dict(dist_sync_on_step=True)
 
@@ -33,6 +35,25 @@ def corrcoef(target, pred):
     return 1 - ((pred_n * target_n).sum()) ** 2
 
 
+def pack_upper_triangle(pred, true, length, min_hairpin_length=3):
+    """Packs the cells (i, j) with j - i > min_hairpin_length, j < length and a known `true` (not UKN) of (B, L, L) matrices into 1D vectors.
+
+    Only these cells can pair: the lower triangle mirrors the upper one, and the cells
+    closer to the diagonal and the padding are constrained out at inference.
+
+    Example:
+    >>> true = torch.zeros(2, 6, 6)
+    >>> pred, true = pack_upper_triangle(torch.zeros(2, 6, 6), true, torch.tensor([6, 5]))
+    >>> len(pred), len(true)
+    (4, 4)
+    """
+    L = pred.shape[-1]
+    i, j = torch.triu_indices(L, L, offset=min_hairpin_length + 1, device=pred.device)
+    pred, true = pred[:, i, j], true[:, i, j]
+    valid = (j[None, :] < torch.as_tensor(length, device=pred.device)[:, None]) & (true != UKN)
+    return pred[valid], true[valid]
+
+
 class Model(pl.LightningModule):
     def __init__(self, lr: float, optimizer_fn, weight_data: bool = False, **kwargs):
         super().__init__()
@@ -46,13 +67,23 @@ class Model(pl.LightningModule):
 
         self.weight_data = weight_data
         self.save_hyperparameters(ignore=['loss_fn'])
-        self.lossBCE = nn.BCEWithLogitsLoss(pos_weight=torch.tensor([300])).to(device)
+        # weight of the paired cells in the structure BCE, or 'auto' for the ratio of unpaired to paired cells of each batch
+        self.pos_weight = kwargs.get("pos_weight", 300)
+        assert self.pos_weight == "auto" or self.pos_weight > 0, "pos_weight must be positive or 'auto'"
+        self.lossBCE = nn.BCEWithLogitsLoss(pos_weight=torch.tensor([300 if self.pos_weight == "auto" else self.pos_weight])).to(device)
+        # 'dense': BCE on the whole (B, L, L) matrices, 'triangle': on the cells that can pair only, see pack_upper_triangle
+        self.structure_loss = kwargs.get("structure_loss", "dense")
+        self.min_hairpin_length = kwargs.get("min_hairpin_length", 3)
+        assert self.structure_loss in ["dense", "triangle"], "structure_loss must be 'dense' or 'triangle'"
 
         # Metrics
         self.metrics_stack = None
         self.tic = None
 
-        self.test_results = {'reference':[], 'sequence':[] ,'structure':[]}
+        # test predictions, streamed to one feather file per test set, see efold.core.predictions
+        self.test_output_dir = kwargs.get("test_output_dir", "test_results")
+        self.save_test_probabilities = kwargs.get("save_test_probabilities", False)
+        self.test_writers = {}
 
         self.postprocesser = Postprocess()
 
@@ -98,7 +129,18 @@ class Model(pl.LightningModule):
 
     def _loss_structure(self, batch: Batch):
         pred, true = batch.get_pairs("structure")
-        loss = self.lossBCE(pred, true)
+        if self.structure_loss == "triangle":
+            # a structure of P pairs has 2P positives in the L^2 dense cells and P in the about L^2 / 2 packed
+            # ones, so the unpaired / paired ratio that pos_weight=300 was set for only loses the
+            # min_hairpin_length band and the padding, a few % for L >= 200 in batches of similar lengths
+            pred, true = pack_upper_triangle(pred, true, batch.get("length"), self.min_hairpin_length)
+            if not len(pred):
+                return pred.sum()
+        if self.pos_weight == "auto":
+            paired = true.sum()
+            loss = F.binary_cross_entropy_with_logits(pred, true, pos_weight=((true.numel() - paired) / paired.clamp(min=1)).detach())
+        else:
+            loss = self.lossBCE(pred, true)
         assert not torch.isnan(loss), "Loss is NaN for structure"
         return loss
 
@@ -137,7 +179,7 @@ class Model(pl.LightningModule):
     def on_validation_start(self):
         val_dl_names = self.trainer.datamodule.external_valid
         self.metrics_stack = [
-            MetricsStack(name=name, data_type=self.data_type_output)
+            MetricsAccumulator(name=name, data_type=self.data_type_output)
             for name in val_dl_names
         ]
 
@@ -170,29 +212,40 @@ class Model(pl.LightningModule):
             torch.cuda.empty_cache()
 
     def on_validation_epoch_end(self) -> None:
-        # aggregate the stack and log it
+        self._log_metrics("valid")
+        torch.cuda.empty_cache()
+
+    def _log_metrics(self, stage: str):
+        # the accumulators are already reduced across the ranks
         for metrics_dl in self.metrics_stack:
             metrics_pack = metrics_dl.compute()
             for dt, metrics in metrics_pack.items():
                 for name, metric in metrics.items():
-                    # to replace with a gather_all?
                     self.log(
-                        f"valid/{metrics_dl.name}/{dt}/{name}",
+                        f"{stage}/{metrics_dl.name}/{dt}/{name}",
                         metric,
                         add_dataloader_idx=False,
-                        sync_dist=True,
                     )
         self.metrics_stack = None
-        torch.cuda.empty_cache()
+
+    def on_test_start(self):
+        self.metrics_stack = [
+            MetricsAccumulator(name=name, data_type=self.data_type_output)
+            for name in TEST_SETS_NAMES
+        ]
 
     def test_step(self, batch: Batch, batch_idx: int, dataloader_idx=0):
         predictions = self.forward(batch)
+        probabilities = torch.sigmoid(predictions['structure']) if self.save_test_probabilities else None
         predictions['structure'] = self.postprocesser.run(predictions['structure'], batch.get('sequence'))
 
-        from ..config import int2seq
-        self.test_results['reference'] += batch.get('reference')
-        self.test_results['sequence'] += [''.join([int2seq[base] for base in seq]) for seq in batch.get('sequence').detach().tolist()]
-        self.test_results['structure'] += predictions['structure'].tolist()
+        self._test_writer(dataloader_idx).write(
+            batch.get('reference'),
+            batch.get('sequence'),
+            batch.get('length'),
+            predictions['structure'],
+            probabilities,
+        )
 
         predictions = self._clean_predictions(batch, predictions)
         batch.integrate_prediction(predictions)
@@ -200,30 +253,29 @@ class Model(pl.LightningModule):
     def on_test_batch_end(
         self, outputs: STEP_OUTPUT, batch: Any, batch_idx: int, dataloader_idx: int = 0
     ) -> None:
-        # push the metric directly
-        metric_pack = MetricsStack(
-            name=TEST_SETS_NAMES[dataloader_idx],
-            data_type=self.data_type_output,
-            )
-        for dt, metrics in metric_pack.update(batch).compute().items():
-            for name, metric in metrics.items():
-                self.log(
-                    f"test/{metric_pack.name}/{dt}/{name}",
-                    float(metric),
-                    add_dataloader_idx=False,
-                    batch_size=len(batch),
-                )
+        self.metrics_stack[dataloader_idx].update(batch)
         if batch_idx % 100 == 0:
             torch.cuda.empty_cache()
 
     def on_test_epoch_end(self) -> None:
+        self._log_metrics("test")
         torch.cuda.empty_cache()
         
+    def _test_writer(self, dataloader_idx):
+        if dataloader_idx not in self.test_writers:
+            name = TEST_SETS_NAMES[dataloader_idx]
+            if self.trainer.world_size > 1:
+                name += ".rank{}".format(self.global_rank)
+            self.test_writers[dataloader_idx] = PredictionWriter(
+                os.path.join(self.test_output_dir, name + ".feather"),
+                probabilities=self.save_test_probabilities,
+            )
+        return self.test_writers[dataloader_idx]
+
     def on_test_end(self) -> None:
-        
-        import pandas as pd
-        df = pd.DataFrame(self.test_results)
-        df.to_feather('test_results.feather')
+        for writer in self.test_writers.values():
+            writer.close()
+        self.test_writers = {}
 
         torch.cuda.empty_cache()
 
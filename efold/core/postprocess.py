@@ -2,8 +2,8 @@ import torch
 import math
 import numpy as np
 import torch.nn.functional as F
-from scipy.optimize import linear_sum_assignment
 from ..config import seq2int
+from ..util.timing import span
 
 class Constraints:
 
@@ -114,6 +114,8 @@ class HungarianAlgorithm:
     
     def _hungarian_algorithm(self, cost_matrix):
         """Returns the row and column indices of the optimal assignment using the Hungarian algorithm"""
+        from scipy.optimize import linear_sum_assignment
+
         row_ind, col_ind = linear_sum_assignment(cost_matrix, maximize=True)
         return row_ind, col_ind
     
@@ -209,17 +211,126 @@ class Postprocess:
         pairing_matrices = []
         for bppm in bppms:
 
-            pairing_matrix = Constraints().apply_constraints(bppm, sequence=sequence,
-                                                            min_hairpin_length=self.min_hairpin_length, 
-                                                            canonical_only=self.canonical_only)
+            with span("postprocess.constraints"):
+                pairing_matrix = Constraints().apply_constraints(bppm, sequence=sequence,
+                                                                min_hairpin_length=self.min_hairpin_length, 
+                                                                canonical_only=self.canonical_only)
             
-            pairing_matrix_UFold = UFold_processing().run(pairing_matrix)
+            with span("postprocess.ufold"):
+                pairing_matrix_UFold = UFold_processing().run(pairing_matrix)
             if not pairing_matrix_UFold.isnan().any(): pairing_matrix = pairing_matrix_UFold 
 
 
-            pairing_matrix = HungarianAlgorithm().run(pairing_matrix, threshold=self.threshold)
+            with span("postprocess.hungarian"):
+                pairing_matrix = HungarianAlgorithm().run(pairing_matrix, threshold=self.threshold)
 
             pairing_matrices.append(pairing_matrix)
 
         return (torch.stack(pairing_matrices) > self.threshold).type(torch.int)
 
+
+class SparsePostprocess:
+
+    """ Postprocess for a sparse set of candidate pairs, such as the band of a long RNA folded in windows.
+
+    Same steps as Postprocess (constraints, UFold, Hungarian algorithm), but on the (i, j) entries only, with i < j, 
+    so that memory grows with the number of entries instead of L^2. Entries that are not given are exact zeros.
+
+    Example:
+    >>> rows, cols = torch.tensor([0, 1]), torch.tensor([8, 7])
+    >>> sequence = torch.tensor([seq2int[a] for a in "GGGAAAUCC"])
+    >>> SparsePostprocess().run(rows, cols, torch.tensor([8., -8.]), sequence)
+    [(0, 8)]
+    """
+
+    def __init__(self, threshold=0.5, canonical_only=True, min_hairpin_length=3):
+        self.threshold = threshold
+        self.canonical_only = canonical_only
+        self.min_hairpin_length = min_hairpin_length
+
+    def run(self, rows, cols, logits, sequence):
+        """Returns the sorted 0-indexed base pairs (i, j), i < j.
+
+        Args:
+        - rows, cols (torch.Tensor): indices of the entries, rows < cols
+        - logits (torch.Tensor): base pair logits of the entries
+        - sequence (torch.Tensor): integer encoded sequence
+        """
+
+        # constraints
+        keep = cols - rows > self.min_hairpin_length
+        if self.canonical_only:
+            allowable_pair = torch.tensor([seq2int[pair[0]] + seq2int[pair[1]] for pair in ["GU", "GC", "AU"]])
+            keep &= torch.isin(sequence[rows] + sequence[cols], allowable_pair)
+        rows, cols, logits = rows[keep], cols[keep], logits[keep]
+
+        contacts = self.ufold(rows, cols, logits, len(sequence))
+        if contacts.isnan().any(): contacts = logits
+
+        return self.hungarian(rows.numpy(), cols.numpy(), contacts.numpy(), len(sequence))
+
+    def ufold(self, rows, cols, u, L, lr_min=0.01, lr_max=0.1, num_itr=100, rho=1.6, with_l1=True, s=1.5):
+        """UFold_processing.postprocess on the upper entries of the symmetric utility matrix."""
+
+        def soft_sign(x):
+            k = 1
+            return 1.0/(1.0+torch.exp(-2*k*x))
+
+        def row_sum(x):
+            # row sums of the symmetric matrix with upper entries x
+            return torch.zeros(L, dtype=x.dtype).index_add_(0, rows, x).index_add_(0, cols, x)
+
+        u = soft_sign(u - s) * u
+
+        # initialization
+        a_hat = (torch.sigmoid(u)) * soft_sign(u - s)
+        lmbd = F.relu(row_sum(a_hat * a_hat) - 1)
+
+        # gradient descent
+        for t in range(num_itr):
+
+            grad_a = lmbd * soft_sign(row_sum(a_hat * a_hat) - 1)
+            grad = a_hat * (grad_a[rows] + grad_a[cols] - u)
+            a_hat = a_hat - lr_min * grad
+            lr_min = lr_min * 0.99
+
+            if with_l1:
+                a_hat = F.relu(torch.abs(a_hat) - rho * lr_min)
+
+            lmbd_grad = F.relu(row_sum(a_hat * a_hat) - 1)
+            lmbd += lr_max * lmbd_grad
+            lr_max = lr_max * 0.99
+
+        return a_hat * a_hat
+
+    def hungarian(self, rows, cols, values, L):
+        """HungarianAlgorithm.run on the entries, solved independently on each connected component of the pairable bases."""
+        from scipy.optimize import linear_sum_assignment
+        from scipy.sparse import coo_matrix
+        from scipy.sparse.csgraph import connected_components
+
+        # only keep bases with at least one value greater than threshold
+        pairable = np.zeros(L, dtype=bool)
+        strong = values > self.threshold
+        pairable[rows[strong]] = True
+        pairable[cols[strong]] = True
+        keep = pairable[rows] & pairable[cols] & (values > 0)
+        rows, cols, values = rows[keep], cols[keep], values[keep]
+        if not len(values):
+            return []
+
+        _, labels = connected_components(coo_matrix((values, (rows, cols)), shape=(L, L)), directed=False)
+        edge_labels = labels[rows]
+        order = np.argsort(edge_labels, kind="stable")
+
+        pairs = set()
+        for edges in np.split(order, np.flatnonzero(np.diff(edge_labels[order])) + 1):
+            nodes, local = np.unique(np.concatenate([rows[edges], cols[edges]]), return_inverse=True)
+            bppm = np.zeros((len(nodes), len(nodes)))
+            bppm[local[:len(edges)], local[len(edges):]] = values[edges]
+            bppm = bppm + bppm.T
+            row_ind, col_ind = linear_sum_assignment(bppm, maximize=True)
+            for row, col in zip(row_ind, col_ind):
+                if bppm[row, col] > self.threshold:
+                    pairs.add((min(nodes[row], nodes[col]), max(nodes[row], nodes[col])))
+        return sorted((int(i), int(j)) for i, j in pairs)
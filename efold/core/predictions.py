@@ -0,0 +1,100 @@
+import os
+import numpy as np
+import torch
+from ..config import int2seq
+
+# byte of each integer encoded base, to decode whole batches at once
+_BASES = np.frombuffer("".join(int2seq[i] for i in range(len(int2seq))).encode(), dtype=np.uint8)
+
+
+def decode_sequences(sequences, lengths):
+    """Strings of a (N, L) batch of integer encoded sequences, cropped to their lengths.
+
+    Example:
+    >>> decode_sequences(torch.tensor([[1, 2, 3, 4], [4, 3, 0, 0]]), [4, 2])
+    ['ACGU', 'UG']
+    """
+    codes = _BASES[sequences.detach().cpu().numpy()]
+    return [codes[n, :L].tobytes().decode() for n, L in enumerate(lengths)]
+
+
+def base_pair_arrays(structures, threshold=0.5):
+    """0-indexed (i, j), i < j, int32 arrays of the pairs of each (L, L) pairing matrix of a (N, L, L) batch.
+
+    Example:
+    >>> structure = torch.zeros(1, 4, 4)
+    >>> structure[0, 0, 3] = structure[0, 3, 0] = 1
+    >>> [(i.tolist(), j.tolist()) for i, j in base_pair_arrays(structure)]
+    [([0], [3])]
+    """
+    n, i, j = torch.nonzero(structures > threshold, as_tuple=True)
+    upper = i < j
+    n, i, j = (x[upper].cpu().numpy().astype(np.int32) for x in (n, i, j))
+    bounds = np.searchsorted(n, np.arange(len(structures) + 1))
+    return [(i[a:b], j[a:b]) for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+class PredictionWriter:
+    """Appends test-set predictions to an Arrow IPC (Feather v2) file, one record batch per call of write().
+
+    Each row holds the reference, the sequence, its length and its base pairs as two
+    0-indexed lists, pair_i < pair_j. With `probabilities`, the pairs i < j whose
+    probability is at least `min_probability` are also stored, as a sparse matrix in
+    the columns prob_i, prob_j and prob.
+    """
+
+    def __init__(self, path: str, probabilities: bool = False, min_probability: float = 0.01):
+        self.path = path
+        self.probabilities = probabilities
+        self.min_probability = min_probability
+        self._writer = None
+
+    def _schema(self):
+        import pyarrow as pa
+
+        fields = [
+            ("reference", pa.string()),
+            ("sequence", pa.string()),
+            ("length", pa.int32()),
+            ("pair_i", pa.list_(pa.int32())),
+            ("pair_j", pa.list_(pa.int32())),
+        ]
+        if self.probabilities:
+            fields += [("prob_i", pa.list_(pa.int32())), ("prob_j", pa.list_(pa.int32())), ("prob", pa.list_(pa.float32()))]
+        return pa.schema(fields)
+
+    def write(self, reference, sequence, length, structure, probabilities=None):
+        """Writes a batch.
+
+        Args:
+            sequence (torch.Tensor): (N, L) integer encoded sequences.
+            structure (torch.Tensor): (N, L, L) binary pairing matrices.
+            probabilities (torch.Tensor): (N, L, L) base pair probabilities, if the writer stores them.
+        """
+        import pyarrow as pa
+
+        pairs = base_pair_arrays(structure)
+        columns = {
+            "reference": list(reference),
+            "sequence": decode_sequences(sequence, length),
+            "length": np.asarray(length, dtype=np.int32),
+            "pair_i": [i for i, _ in pairs],
+            "pair_j": [j for _, j in pairs],
+        }
+        if self.probabilities:
+            entries = base_pair_arrays(probabilities, threshold=self.min_probability - 1e-12)
+            columns["prob_i"] = [i for i, _ in entries]
+            columns["prob_j"] = [j for _, j in entries]
+            probabilities = probabilities.detach().float().cpu().numpy()
+            columns["prob"] = [probabilities[n, i, j] for n, (i, j) in enumerate(entries)]
+
+        schema = self._schema()
+        if self._writer is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._writer = pa.ipc.new_file(self.path, schema)
+        self._writer.write_batch(pa.record_batch([pa.array(columns[name], type=schema.field(name).type) for name in schema.names], schema=schema))
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
@@ -166,4 +166,72 @@ def sampler_factory(
         return DDPSampler(dataset, num_replicas=num_replicas, rank=rank, shuffle=True, seed=seed)
     else:
         raise ValueError(f"Invalid strategy value: {strategy}")
-  
\ No newline at end of file
+  
+
+class MemoryBudgetBatchSampler(Sampler):
+    """Batch sampler that makes batches as large as a memory budget allows.
+
+    Indices are taken in order, or shuffled with `shuffle`, `window` at a time, sorted by
+    length within the window and cut into batches whose cost, with the padding to their
+    longest sequence, fits in `memory_budget` bytes according to `cost_model` (see
+    efold.models.cost). A sequence that does not fit on its own is a batch of one.
+
+    The shuffled order only depends on the seed and the epoch, which Lightning sets with
+    set_epoch. The batches of an epoch are made once, so that len() is the number of
+    batches that the epoch yields.
+
+    Args:
+        lengths: length of each sequence of the dataset.
+        cost_model: any object with a memory(batch_size, length) method.
+
+    Example:
+    >>> class Cost:
+    ...     def memory(self, batch_size, length): return batch_size * length ** 2
+    >>> sampler = MemoryBudgetBatchSampler([10, 10, 20, 10, 30], Cost(), memory_budget=400)
+    >>> list(sampler), len(sampler)
+    ([[0, 1, 3], [2], [4]], 3)
+    """
+
+    def __init__(self, lengths, cost_model, memory_budget: float, max_batch_size: int = None, window: int = 1024, shuffle: bool = False, seed: int = 0) -> None:
+        self.lengths = lengths
+        self.cost_model = cost_model
+        self.memory_budget = memory_budget
+        self.max_batch_size = max_batch_size
+        self.window = window
+        self.shuffle = shuffle
+        self.seed = int(seed)
+        self.epoch = 0
+        self._epoch_batches = None  # (epoch, batches)
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def _batches(self, indices):
+        batch = []
+        for idx in sorted(indices, key=lambda i: self.lengths[i]):
+            too_many = self.max_batch_size is not None and len(batch) >= self.max_batch_size
+            if batch and (too_many or self.cost_model.memory(len(batch) + 1, self.lengths[idx]) > self.memory_budget):
+                yield batch
+                batch = []
+            batch.append(idx)
+        if batch:
+            yield batch
+
+    def batches(self):
+        """Batches of the current epoch."""
+        if self._epoch_batches is None or self._epoch_batches[0] != self.epoch:
+            if self.shuffle:
+                generator = torch.Generator()
+                generator.manual_seed(self.seed + self.epoch)
+                indices = torch.randperm(len(self.lengths), generator=generator).tolist()
+            else:
+                indices = list(range(len(self.lengths)))
+            batches = [batch for start in range(0, len(indices), self.window) for batch in self._batches(indices[start : start + self.window])]
+            self._epoch_batches = (self.epoch, batches)
+        return self._epoch_batches[1]
+
+    def __iter__(self):
+        return iter(self.batches())
+
+    def __len__(self) -> int:
+        return len(self.batches())
@@ -1 +1,2 @@
 from .factory import create_model
+from .evofold import eFoldNet
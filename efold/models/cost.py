@@ -0,0 +1,292 @@
+"""Peak activation memory and FLOPs of the models as a function of the batch size B and the length L.
+
+Every model of create_model costs `fixed + B * (per_pair * L^2 + per_residue * L)`: eFold's
+pair stack, the attention maps of the transformers and the 2D convolutions of the CNNs all
+grow as B * L^2. eFold has an analytical estimate of the coefficients (efold_cost). calibrate()
+fits them to measured runs of any model, once per machine, and load_cost_model() prefers
+the calibration when there is one.
+
+Example:
+>>> cost = CostModel(bytes_per_pair=100, bytes_per_residue=0, flops_per_pair=1000, flops_per_residue=0)
+>>> cost.memory(2, 10), cost.flops(2, 10)
+(20000.0, 200000.0)
+>>> cost.max_batch_size(10, budget=50000), cost.max_length(budget=40000)
+(5, 20)
+"""
+import json
+import math
+import os
+import sys
+from os.path import expanduser, join, exists
+from typing import List
+import numpy as np
+import torch
+
+CALIBRATION_DIR = os.environ.get("EFOLD_CACHE", join(expanduser("~"), ".cache", "efold"))
+
+# lengths of the calibration runs
+CALIBRATION_LENGTHS = [64, 128, 256, 512]
+
+_UNITS = {"": 1, "K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+
+
+def parse_bytes(size) -> int:
+    """Bytes of a size such as 8G, 8GB, 8GiB or 512M (powers of 1024), or of a plain number.
+
+    Example:
+    >>> parse_bytes("1.5G"), parse_bytes("512MiB"), parse_bytes(1000)
+    (1610612736, 536870912, 1000)
+    """
+    if isinstance(size, (int, float)):
+        return int(size)
+    size = size.strip().upper().rstrip("B").rstrip("I")
+    unit = size[-1] if size and size[-1] in _UNITS else ""
+    return int(float(size[: len(size) - len(unit)]) * _UNITS[unit])
+
+
+class CostModel:
+    """Peak activation memory (bytes) and FLOPs of one step on a batch of B sequences of length L.
+
+    memory(B, L) = fixed_bytes + B * (bytes_per_pair * L^2 + bytes_per_residue * L), and likewise
+    for the FLOPs without the fixed term. FLOPs count a multiply-add as 2.
+
+    Args:
+        train (bool): whether it is the cost of a forward and backward pass, or of a forward pass without gradients.
+    """
+
+    def __init__(self, bytes_per_pair, bytes_per_residue, flops_per_pair, flops_per_residue, fixed_bytes=0.0, train=False):
+        self.bytes_per_pair = bytes_per_pair
+        self.bytes_per_residue = bytes_per_residue
+        self.flops_per_pair = flops_per_pair
+        self.flops_per_residue = flops_per_residue
+        self.fixed_bytes = fixed_bytes
+        self.train = train
+
+    def memory(self, batch_size: int, length: int) -> float:
+        return float(self.fixed_bytes + batch_size * (self.bytes_per_pair * length**2 + self.bytes_per_residue * length))
+
+    def flops(self, batch_size: int, length: int) -> float:
+        return float(batch_size * (self.flops_per_pair * length**2 + self.flops_per_residue * length))
+
+    def max_batch_size(self, length: int, budget: float, limit: int = None) -> int:
+        """Largest batch of sequences of `length` that fits in `budget` bytes, at most `limit`. 0 if one sequence does not fit."""
+        per_sequence = self.bytes_per_pair * length**2 + self.bytes_per_residue * length
+        n = int((budget - self.fixed_bytes) // per_sequence) if per_sequence > 0 else limit or sys.maxsize
+        return max(0, min(n, limit) if limit else n)
+
+    def max_length(self, budget: float, batch_size: int = 1) -> int:
+        """Longest length of which `batch_size` sequences fit in `budget` bytes."""
+        a, b, c = self.bytes_per_pair, self.bytes_per_residue, (budget - self.fixed_bytes) / batch_size
+        if c <= 0:
+            return 0
+        if a == 0:
+            return int(c // b) if b > 0 else sys.maxsize
+        return int((-b + math.sqrt(b * b + 4 * a * c)) / (2 * a))
+
+    def to_dict(self):
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, d: dict):
+        return cls(**d)
+
+    @classmethod
+    def fit(cls, measurements: List[dict], train=False):
+        """Least-squares coefficients, clipped at 0, of measurements with the keys batch_size, length, memory and flops (None if unknown).
+
+        Example:
+        >>> runs = [{"batch_size": 1, "length": L, "memory": 10 + 4 * L**2, "flops": 2 * L**2} for L in [8, 16, 32]]
+        >>> cost = CostModel.fit(runs)
+        >>> round(cost.bytes_per_pair, 6), round(cost.fixed_bytes, 6), round(cost.flops_per_pair, 6)
+        (4.0, 10.0, 2.0)
+        """
+        B = np.array([m["batch_size"] for m in measurements], dtype=float)
+        L = np.array([m["length"] for m in measurements], dtype=float)
+        memory = np.array([m["memory"] for m in measurements], dtype=float)
+        fixed, per_pair, per_residue = np.linalg.lstsq(np.stack([np.ones_like(L), B * L**2, B * L], 1), memory, rcond=None)[0]
+        flops = [m for m in measurements if m.get("flops") is not None]
+        flops_per_pair = flops_per_residue = 0.0
+        if flops:
+            B = np.array([m["batch_size"] for m in flops], dtype=float)
+            L = np.array([m["length"] for m in flops], dtype=float)
+            flops_per_pair, flops_per_residue = np.linalg.lstsq(
+                np.stack([B * L**2, B * L], 1), np.array([m["flops"] for m in flops], dtype=float), rcond=None
+            )[0]
+        return cls(
+            bytes_per_pair=max(float(per_pair), 0.0),
+            bytes_per_residue=max(float(per_residue), 0.0),
+            flops_per_pair=max(float(flops_per_pair), 0.0),
+            flops_per_residue=max(float(flops_per_residue), 0.0),
+            fixed_bytes=max(float(fixed), 0.0),
+            train=train,
+        )
+
+
+def efold_cost(d_model: int, c_z: int, d_cnn: int, num_blocks: int, no_recycles: int, train: bool = False, n_heads: int = 8, bytes_per_value: int = 4, **kwargs):
+    """Analytical CostModel of eFold, counting the tensors of each layer (see efold.models.evofold).
+
+    Without gradients, the memory is the largest set of pair tensors alive at once. With
+    gradients, it is the pair tensors saved for the backward pass, which only happens on
+    the last recycle. Both are estimates, that calibrate() replaces with measured values.
+
+    Example:
+    >>> cost = efold_cost(d_model=64, c_z=32, d_cnn=64, num_blocks=4, no_recycles=0)
+    >>> cost.bytes_per_pair
+    1152
+    """
+    # pair stack: encoder adapter, then per block the pair bias, the sequence attention
+    # logits, SequenceToPair, the ResLayer (2 blocks of 2 3x3 convs and a 7x7 conv) and the pair MLP
+    adapter = 2 * 17 * 15 * 15 * c_z
+    block = 2 * c_z * n_heads + 6 * d_model + 2 * c_z * c_z + 2 * 2 * 2 * 9 * c_z * c_z + 2 * 49 * c_z * c_z + 8 * c_z * c_z
+    output = 2 * c_z * d_cnn + (4 * 2 * 2 * 9 * d_cnn**2 + 2 * 49 * d_cnn * d_cnn // 2) + (4 * 2 * 2 * 9 * (d_cnn // 2) ** 2 + 2 * 49 * d_cnn // 2)
+    recycles = no_recycles + 1
+    flops_per_pair = adapter + recycles * num_blocks * block + output
+    # sequence stack: attention projections, the two feed-forwards, the convolution module and the MLP
+    flops_per_residue = recycles * num_blocks * (36 * d_model * d_model + 2 * d_model * c_z)
+
+    peak = max(
+        2 * 17 + c_z,  # seq2map and the encoder adapter
+        c_z + 6 * n_heads,  # sequence attention logits, bias and softmax
+        7 * c_z,  # pair MLP
+        c_z + 4 * d_cnn,  # output convolutions
+    )
+    per_residue = 8 * d_model
+    if train:
+        # the forward and the backward of the last recycle, and of the input and output layers
+        flops_per_pair += 2 * (adapter + num_blocks * block + output)
+        flops_per_residue += 2 * num_blocks * (36 * d_model * d_model + 2 * d_model * c_z)
+        peak += 17 + 2 * c_z + num_blocks * (17 * c_z + 5 * n_heads) + 26 * d_cnn
+        per_residue += num_blocks * 20 * d_model
+    return CostModel(
+        bytes_per_pair=peak * bytes_per_value,
+        bytes_per_residue=per_residue * bytes_per_value,
+        flops_per_pair=flops_per_pair,
+        flops_per_residue=flops_per_residue,
+        train=train,
+    )
+
+
+def _peak_rss():
+    """Peak resident memory of this process, in bytes."""
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _measure(name: str, hparams: dict, lengths: List[int], batch_size: int, device: str, train: bool):
+    """Peak memory above the loaded model, and FLOPs, of one step at each length, in a fresh process so that the peak RSS is its own.
+
+    The peak RSS only grows, so the lengths are run in increasing order.
+    """
+    from ..core.batch import Batch
+    from ..core.embeddings import int2seq
+
+    try:
+        from torch.utils.flop_counter import FlopCounterMode
+    except ImportError:  # torch < 2.1
+        FlopCounterMode = None
+
+    torch.manual_seed(0)
+    if name == "efold" and not train:
+        from .evofold import eFoldNet
+
+        model = eFoldNet(**hparams)
+    else:
+        from .factory import create_model
+
+        model = create_model(name, **hparams)
+    model.to(device).train(train)
+    cuda = torch.device(device).type == "cuda"
+    base = torch.cuda.memory_allocated() if cuda else _peak_rss()
+
+    measurements = []
+    for L in sorted(lengths):
+        sequences = ["".join(int2seq[int(i)] for i in torch.randint(1, 5, (L,))) for _ in range(batch_size)]
+        batch = Batch.from_dataset_items(
+            [{"reference": str(i), "sequence": seq, "length": L} for i, seq in enumerate(sequences)], [], use_error=False
+        )
+        batch.to(device)
+
+        def step():
+            if name == "efold" and not train:
+                return model(batch.get("sequence"))
+            output = model(batch)
+            if train:
+                sum(v.float().mean() for v in output.values() if isinstance(v, torch.Tensor)).backward()
+                model.zero_grad(set_to_none=True)
+
+        if cuda:
+            torch.cuda.reset_peak_memory_stats()
+        flops = None
+        with torch.set_grad_enabled(train):
+            if FlopCounterMode is not None:
+                with FlopCounterMode(display=False) as counter:
+                    step()
+                flops = counter.get_total_flops()
+            else:
+                step()
+        memory = (torch.cuda.max_memory_allocated() if cuda else _peak_rss()) - base
+        measurements.append({"batch_size": batch_size, "length": L, "memory": memory, "flops": flops})
+    return measurements
+
+
+def calibration_path(name: str = "efold", device: str = "cpu", train: bool = False):
+    return join(CALIBRATION_DIR, "cost_{}_{}_{}.json".format(name, torch.device(device).type, "train" if train else "inference"))
+
+
+def _default_hparams(name: str):
+    if name == "efold":
+        from ..api.weights import LEGACY_WEIGHTS_PATH, read_manifest
+
+        return read_manifest(LEGACY_WEIGHTS_PATH)["hparams"]
+    from ..benchmark.scaling import model_config
+
+    return model_config(name)
+
+
+def calibrate(
+    name: str = "efold",
+    hparams: dict = None,
+    lengths: List[int] = CALIBRATION_LENGTHS,
+    batch_size: int = 1,
+    device: str = "cpu",
+    train: bool = False,
+    save: bool = True,
+):
+    """Fits the CostModel of a model of create_model to runs at each length on this machine, and saves it for load_cost_model.
+
+    On CPU, the memory is the growth of the peak RSS over the loaded model, measured in a
+    fresh process. On CUDA, it is the peak of the allocated memory over the loaded model.
+
+    Args:
+        hparams (dict): model configuration. Defaults to the packaged eFold, or to the training scripts for the other models.
+    """
+    import multiprocessing as mp
+
+    hparams = hparams or _default_hparams(name)
+    with mp.get_context("spawn").Pool(1) as pool:
+        measurements = pool.apply(_measure, (name, hparams, lengths, batch_size, device, train))
+    cost = CostModel.fit(measurements, train=train)
+    if save:
+        os.makedirs(CALIBRATION_DIR, exist_ok=True)
+        with open(calibration_path(name, device, train), "w") as f:
+            json.dump({"hparams": hparams, "measurements": measurements, "cost": cost.to_dict()}, f, indent=4)
+    return cost
+
+
+def load_cost_model(name: str = "efold", hparams: dict = None, device: str = "cpu", train: bool = False):
+    """The calibrated CostModel of this model on this kind of device, else eFold's analytical one.
+
+    Raises:
+        ValueError: if a model other than eFold has not been calibrated.
+    """
+    path = calibration_path(name, device, train)
+    if exists(path):
+        with open(path, "r") as f:
+            calibration = json.load(f)
+        if hparams is None or calibration["hparams"] == hparams:
+            return CostModel.from_dict(calibration["cost"])
+    if name != "efold":
+        raise ValueError("No cost model for {}, run efold.models.cost.calibrate('{}') first".format(name, name))
+    return efold_cost(train=train, **(hparams or _default_hparams(name)))
@@ -0,0 +1,1185 @@
+import numpy as np
+import torch
+from torch import nn, Tensor
+from contextlib import ExitStack
+import warnings
+
+import typing as T
+from einops import rearrange
+import torch.nn.functional as F
+from ..config import seq2int
+from ..util.timing import span
+
+
+class eFoldNet(nn.Module):
+    """The network of eFold, without its training logic.
+
+    Same layers and state dict as the eFold LightningModule, which is built with
+    eFoldNet._build, so it loads the same weights without importing lightning.
+    """
+
+    def __init__(
+        self,
+        ntoken: int,
+        d_model: int,
+        c_z: int,
+        d_cnn: int,
+        num_blocks: int,
+        no_recycles: int,
+        dropout: float = 0,
+        **kwargs,
+    ):
+        super().__init__()
+        self._build(ntoken, d_model, c_z, d_cnn, num_blocks, no_recycles, dropout)
+
+    def _build(self, ntoken, d_model, c_z, d_cnn, num_blocks, no_recycles, dropout=0):
+        # Encoder layers
+        self.encoder = nn.Embedding(ntoken, d_model)
+        # self.encoder_adapter = nn.Linear(d_model, int(c_z / 2))
+        # self.activ = nn.ReLU()
+        self.encoder_adapter = nn.Conv2d(17, c_z, kernel_size=15, padding=7, bias=True)
+        self.register_buffer("pairing_energy", _pairing_energy_table(), persistent=False)
+        self.eFold = EvoFold(
+            c_s=d_model,
+            c_z=c_z,
+            # CHANGE
+            no_heads_s=8,
+            ######
+            no_heads_z=4,
+            num_blocks=num_blocks,
+            dropout=dropout,
+            no_recycles=no_recycles,
+        )
+
+        # self.output_net_DMS = nn.Sequential(
+        #     nn.LayerNorm(d_model),
+        #     nn.Linear(d_model, d_model),
+        #     nn.ReLU(),
+        #     nn.Linear(d_model, 1),
+        # )
+
+        # self.output_net_SHAPE = nn.Sequential(
+        #     nn.LayerNorm(d_model),
+        #     nn.Linear(d_model, d_model),
+        #     nn.ReLU(),
+        #     nn.Linear(d_model, 1),
+        # )
+
+        self.structure_adapter = nn.Linear(c_z, d_cnn)
+        self.output_structure = nn.Sequential(
+            ResLayer(
+                dim_in=d_cnn,
+                dim_out=d_cnn // 2,
+                n_blocks=4,
+                kernel_size=3,
+                dropout=dropout,
+            ),
+            ResLayer(
+                dim_in=d_cnn // 2, dim_out=1, n_blocks=4, kernel_size=3, dropout=dropout
+            ),
+        )
+
+    def forward(self, src: Tensor, band: int = None, recycle_tol: float = None, max_recycles: int = None) -> Tensor:
+        return self.forward_sequence(src, band, recycle_tol, max_recycles)
+
+    def _reset_buffers(self):
+        """Recomputes the buffers that are not in the state dict, e.g. after building the model on the meta device."""
+        device = self.encoder.weight.device
+        self.register_buffer("pairing_energy", _pairing_energy_table().to(device), persistent=False)
+
+    def forward_sequence(self, src: Tensor, band: int = None, recycle_tol: float = None, max_recycles: int = None) -> Tensor:
+        """Structure logits (N, L, L) of an integer encoded sequence (N, L).
+
+        Same as eFold.forward, but tensor in and tensor out so that it can be traced.
+
+        With `band` = W, the pair features are only kept for |i - j| <= W, in a
+        (N, L, 2W + 1, c) layout where cell (i, d) holds the pair (i, i + d - W),
+        and the features outside the band are taken as zeros. Memory and compute
+        of the pair stack then grow as L * W instead of L^2. The logits are then
+        (N, L, 2W + 1) in the same layout, zero where i + d - W is out of the
+        sequence. Banded mode is meant for inference: in training, the batch norm
+        statistics would see the cells out of the sequence.
+
+        With `recycle_tol`, in eval mode, a sequence stops recycling through the trunk
+        once the relative change of its pair features between two passes is below
+        it, and the converged sequences of a batch are dropped from the next passes.
+        `max_recycles` caps the recycles, which default to the no_recycles of the model.
+        The recycles run for each sequence are then in self.eFold.recycles.
+        """
+        with span("model.seq2map"):
+            s = self.encoder(src)  # (N, L, d_model)
+            z = _conv2d(self.encoder_adapter, self.seq2map(src, band), band).permute(0, 2, 3, 1) # (N, L, L, d_model)
+
+        # z = self.activ(self.encoder_adapter(s))  # (N, L, c_z / 2)
+        # # Outer concatenation
+        # z = z.unsqueeze(1).repeat(1, z.shape[1], 1, 1)  # (N, L, L, c_z / 2)
+        # z = torch.cat((z, z.permute(0, 2, 1, 3)), dim=-1)  # (N, L, L, c_z)
+
+        with span("model.trunk"):
+            s, z = self.eFold(s, z, band, recycle_tol, max_recycles)
+
+        with span("model.output_structure"):
+            structure = self.structure_adapter(z).permute(0, 3, 1, 2)  # (N, d_cnn, L, L)
+            for layer in self.output_structure:
+                structure = layer(structure, band)
+            structure = structure.squeeze(1)  # (N, L, L)
+
+        if band is None:
+            return (structure + structure.permute(0, 2, 1)) / 2
+
+        # the mirror of (i, d) is (i + d - W, 2W - d)
+        j, valid = _band_index(structure.shape[1], band, structure.device)
+        mirror = structure[:, j, torch.arange(2 * band, -1, -1, device=j.device)]
+        return (structure + mirror) / 2 * valid
+
+    def seq2map(self, seq_int, band: int = None):
+        """Input map (N, 17, L, L) of an integer encoded sequence (N, L).
+
+        The first 16 channels are the one-hot encoding of each base pair, the last
+        one is the Gaussian-weighted pairing energy of the helix stacked around
+        each pair. Only tensor ops are used, so the map is traced with the model.
+        With `band`, the map is (N, 17, L, 2 * band + 1), see forward_sequence.
+        """
+        n = seq_int.shape[1]
+        device = seq_int.device
+
+        with torch.no_grad():
+            i = torch.arange(n, device=device)[:, None, None]
+            if band is None:
+                j = torch.arange(n, device=device)[None, :, None]
+            else:
+                j, valid = _band_index(n, band, device)
+                j = j[:, :, None]
+
+            def energy(a, b):
+                # pairing energy of the pairs of bases (a, b)
+                return self.pairing_energy[seq_int[:, a.clamp(0, n - 1)], seq_int[:, b.clamp(0, n - 1)]]
+
+            # stack outwards (i-t, j+t), only keep the contiguous run of pairs
+            t = torch.arange(30, device=device)
+            m1 = torch.where((i - t >= 0) & (j + t < n), energy(i - t, j + t), 0)
+            m1 = m1 * torch.exp(-0.5 * t * t)
+            m1 = (m1 * (torch.cumsum((m1 == 0).int(), dim=-1) == 0)).sum(dim=-1)
+
+            # stack inwards (i+t, j-t), only where the outward stack exists
+            t = torch.arange(1, 30, device=device)
+            m2 = torch.where((i + t < n) & (j - t >= 0), energy(i + t, j - t), 0)
+            m2 = m2 * torch.exp(-0.5 * t * t)
+            m2 = (m2 * (torch.cumsum((m2 == 0).int(), dim=-1) == 0)).sum(dim=-1)
+            m2 = m2 * (m1 != 0)
+
+            # one-hot encoding of the pairs, X is all zeros
+            seq_hot = torch.eye(5, device=device)[:, 1:][seq_int]  # (N, L, 4)
+            hot_i, hot_j = seq_hot[:, :, None, :], seq_hot[:, j[:, :, 0]]
+            pair_map = (hot_i[..., :, None] * hot_j[..., None, :]).flatten(3)
+
+            full_map = torch.cat((pair_map, (m1 + m2).unsqueeze(-1)), dim=-1)
+            if band is not None:
+                full_map = full_map * valid[:, :, None]
+
+        return full_map.permute(0, 3, 1, 2).contiguous()
+
+
+def _pairing_energy_table():
+    """Pairing energy of each pair of integer encoded bases (0 if they don't pair)."""
+    table = torch.zeros(len(seq2int), len(seq2int))
+    for pair, energy in {"AU": 2.0, "GC": 3.0, "GU": 0.8}.items():
+        table[seq2int[pair[0]], seq2int[pair[1]]] = energy
+        table[seq2int[pair[1]], seq2int[pair[0]]] = energy
+    return table
+
+
+def _band_index(L: int, band: int, device=None):
+    """Column j of each cell (i, d) of the band layout, clamped to the sequence, and whether it is in the sequence.
+
+    Example:
+    >>> j, valid = _band_index(3, 1)
+    >>> j.tolist(), valid.tolist()
+    ([[0, 0, 1], [0, 1, 2], [1, 2, 2]], [[False, True, True], [True, True, True], [True, True, False]])
+    """
+    j = torch.arange(L, device=device)[:, None] + torch.arange(-band, band + 1, device=device)
+    valid = (j >= 0) & (j < L)
+    return j.clamp(0, L - 1), valid
+
+
+def _dense_to_band(x: Tensor, band: int) -> Tensor:
+    """Band layout (..., L, 2 * band + 1) of a pair map (..., L, L)."""
+    j, valid = _band_index(x.shape[-1], band, x.device)
+    return x.gather(-1, j.expand(*x.shape[:-1], j.shape[-1])) * valid
+
+
+def _band_to_dense(x: Tensor, band: int) -> Tensor:
+    """Pair map (..., L, L) of a band layout (..., L, 2 * band + 1), zero outside the band."""
+    L = x.shape[-2]
+    col = torch.arange(L, device=x.device)[:, None] + torch.arange(2 * band + 1, device=x.device)
+    out = x.new_zeros(*x.shape[:-1], L + 2 * band)
+    out.scatter_(-1, col.expand(x.shape), x)
+    return out[..., band : band + L]
+
+
+def _band_conv2d(conv: nn.Conv2d, x: Tensor) -> Tensor:
+    """Applies a 'same' padded conv to a pair map in band layout (N, C, L, 2W + 1).
+
+    The (a, b) tap of the kernel reads the pair (i + a, j + b), which is cell
+    (i + a, d + b - a) of the band, so the conv is the same conv with a sheared
+    kernel of width 2k - 1. It is exact for the pairs of the band, given the
+    features outside the band are zeros.
+
+    Example:
+    >>> conv = nn.Conv2d(2, 3, kernel_size=3, padding=2, dilation=2)
+    >>> x = _band_to_dense(_dense_to_band(torch.randn(1, 2, 9, 9), 3), 3)
+    >>> torch.allclose(_band_conv2d(conv, _dense_to_band(x, 3)) * _band_index(9, 3)[1], _dense_to_band(conv(x), 3), atol=1e-5)
+    True
+    """
+    if not isinstance(conv, nn.Conv2d):
+        raise ValueError("Banded mode only runs with float convolutions")
+    k, dilation = conv.kernel_size[0], conv.dilation[0]
+    assert conv.padding == (dilation * (k // 2),) * 2, "Banded mode needs 'same' padded convolutions"
+
+    weight = conv.weight.new_zeros(*conv.weight.shape[:3], 2 * k - 1)
+    for a in range(k):
+        weight[:, :, a, k - 1 - a : 2 * k - 1 - a] = conv.weight[:, :, a]
+
+    _, valid = _band_index(x.shape[-2], (x.shape[-1] - 1) // 2, x.device)
+    return F.conv2d(
+        x * valid,
+        weight,
+        conv.bias,
+        padding=(dilation * (k // 2), dilation * (k - 1)),
+        dilation=dilation,
+    )
+
+
+def _is_pointwise(conv: nn.Module, x: Tensor) -> bool:
+    """Whether every off-centre tap of a 'same' padded conv reads the zero padding of x (N, C, H, W).
+
+    That is when H and W are at most the dilation, as the (a, b) tap reads (i + a * d, j + b * d).
+    The traced graphs keep the full conv, as they must hold for any length.
+    """
+    if not isinstance(conv, nn.Conv2d) or torch.jit.is_tracing() or torch.onnx.is_in_onnx_export():
+        return False
+    k, dilation = conv.kernel_size, conv.dilation
+    return (
+        conv.stride == (1, 1)
+        and conv.padding_mode == "zeros"
+        and k[0] % 2 == 1
+        and k[1] % 2 == 1
+        and conv.padding == (dilation[0] * (k[0] // 2), dilation[1] * (k[1] // 2))
+        and x.shape[-2] <= dilation[0]
+        and x.shape[-1] <= dilation[1]
+    )
+
+
+def _conv2d(conv: nn.Module, x: Tensor, band: int = None) -> Tensor:
+    """Applies conv to x, as the equivalent 1x1 conv with its centre weights when the other taps only read padding.
+
+    Example:
+    >>> conv = nn.Conv2d(4, 5, kernel_size=3, padding=12, dilation=12)
+    >>> x = torch.randn(2, 4, 10, 10)
+    >>> _is_pointwise(conv, x), torch.allclose(_conv2d(conv, x), conv(x), atol=1e-6)
+    (True, True)
+    """
+    if band is not None:
+        return _band_conv2d(conv, x)
+    if _is_pointwise(conv, x):
+        a, b = conv.kernel_size[0] // 2, conv.kernel_size[1] // 2
+        return F.conv2d(x, conv.weight[:, :, a : a + 1, b : b + 1], conv.bias, groups=conv.groups)
+    return conv(x)
+
+
+class EvoBlock(nn.Module):
+    def __init__(
+        self,
+        c_s,
+        c_z,
+        no_heads_s,
+        no_heads_z,
+        dropout=0,
+    ):
+        super(EvoBlock, self).__init__()
+        assert c_s % no_heads_s == 0
+        assert c_z % no_heads_z == 0
+        assert c_z % 2 == 0
+        assert no_heads_s % 2 == 0
+        assert no_heads_z % 2 == 0
+
+        self.c_s = c_s
+        self.c_z = c_z
+
+        self.layernorm = nn.LayerNorm(c_s)
+
+        # Adapter to add sequence rep to pair rep
+        self.sequence_to_pair = SequenceToPair(c_s, c_z // 2, c_z)
+
+        # bias attention heads
+        self.pair_to_sequence = PairToSequence(c_z, no_heads_s)
+
+        # self.seq_attention = Attention(c_s, no_heads_s, c_s / no_heads_s, gated=True)
+
+        # print('---------')
+        # print(no_heads_s)
+        # print(int(c_s/no_heads_s))
+        # print('---------')
+        self.seq_attention = RelPositionMultiHeadAttention(
+            num_heads=no_heads_s, head_size=int(c_s / no_heads_s), output_size=c_s
+        )
+        self.pos = PositionalEncoding(self.c_s, dropout)
+        self.ln = nn.LayerNorm(self.c_s, eps=1e-12, elementwise_affine=True)
+
+        self.resNet = ResLayer(
+            dim_in=c_z, dim_out=c_z, n_blocks=2, kernel_size=3, dropout=dropout
+        )
+
+        # self.tri_mul_out = TriangleMultiplicationOutgoing(
+        #     c_z,
+        #     c_z,
+        # )
+
+        # self.tri_mul_in = TriangleMultiplicationIncoming(
+        #     c_z,
+        #     c_z,
+        # )
+
+        # self.tri_att_start = TriangleAttentionStartingNode(
+        #     c_z,
+        #     int(c_z / no_heads_z),
+        #     no_heads_z,
+        # )
+
+        # self.tri_att_end = TriangleAttentionEndingNode(
+        #     c_z,
+        #     int(c_z / no_heads_z),
+        #     no_heads_z,
+        # )
+
+        # Transition
+        self.mlp_seq = ResidueMLP(c_s, 2 * c_s, dropout=dropout)
+        self.mlp_pair = ResidueMLP(c_z, 2 * c_z, dropout=dropout)
+
+        assert dropout < 0.4
+        self.drop = nn.Dropout(dropout)
+        # self.row_drop = Dropout(dropout * 2, 2)
+        # self.col_drop = Dropout(dropout * 2, 1)
+
+        self.FF1 = FFMod(c_s, dropout=dropout)
+        self.FF2 = FFMod(c_s, dropout=dropout)
+        self.convMod = ConvModule(input_dim=c_s, dropout=dropout)
+
+        # self.ln_1 = nn.LayerNorm(c_s)
+        # self.ln_2 = nn.LayerNorm(c_s)
+        self.ln_3 = nn.LayerNorm(c_s)
+        self.ln_4 = nn.LayerNorm(c_s)
+
+        self._initZeros()
+
+    def _initZeros(self):
+        # torch.nn.init.zeros_(self.tri_mul_in.linear_z.weight)
+        # torch.nn.init.zeros_(self.tri_mul_in.linear_z.bias)
+        # torch.nn.init.zeros_(self.tri_mul_out.linear_z.weight)
+        # torch.nn.init.zeros_(self.tri_mul_out.linear_z.bias)
+        # torch.nn.init.zeros_(self.tri_att_start.mha.linear_o.weight)
+        # torch.nn.init.zeros_(self.tri_att_start.mha.linear_o.bias)
+        # torch.nn.init.zeros_(self.tri_att_end.mha.linear_o.weight)
+        # torch.nn.init.zeros_(self.tri_att_end.mha.linear_o.bias)
+
+        torch.nn.init.zeros_(self.sequence_to_pair.o_proj.weight)
+        torch.nn.init.zeros_(self.sequence_to_pair.o_proj.bias)
+        torch.nn.init.zeros_(self.pair_to_sequence.linear.weight)
+        # torch.nn.init.zeros_(self.seq_attention.o_proj.weight)
+        # torch.nn.init.zeros_(self.seq_attention.o_proj.bias)
+        torch.nn.init.zeros_(self.mlp_seq.mlp[-2].weight)
+        torch.nn.init.zeros_(self.mlp_seq.mlp[-2].bias)
+        torch.nn.init.zeros_(self.mlp_pair.mlp[-2].weight)
+        torch.nn.init.zeros_(self.mlp_pair.mlp[-2].bias)
+
+    def forward(self, sequence_state, pairwise_state, band=None):
+        """
+        Inputs:
+          sequence_state: B x L x sequence_state_dim
+          pairwise_state: B x L x L x pairwise_state_dim (B x L x 2*band+1 x pairwise_state_dim in banded mode)
+
+        Output:
+          sequence_state: B x L x sequence_state_dim
+          pairwise_state: B x L x L x pairwise_state_dim
+        """
+        assert len(sequence_state.shape) == 3
+        assert len(pairwise_state.shape) == 4
+
+        batch_dim, seq_dim, sequence_state_dim = sequence_state.shape
+        pairwise_state_dim = pairwise_state.shape[3]
+        assert sequence_state_dim == self.c_s
+        assert pairwise_state_dim == self.c_z
+        assert batch_dim == pairwise_state.shape[0]
+        assert seq_dim == pairwise_state.shape[1]
+        assert pairwise_state.shape[2] == (seq_dim if band is None else 2 * band + 1)
+
+        # Update sequence state
+        bias = self.pair_to_sequence(pairwise_state)
+        if band is not None:
+            # the sequence attention is dense, so is its bias (B x L x L x num_heads)
+            bias = _band_to_dense(bias.permute(0, 3, 1, 2), band).permute(0, 2, 3, 1)
+
+        # Self attention with bias + mlp.
+        y = self.layernorm(sequence_state)
+        pe = self.pos(y)
+        y = self.ln(y)
+        # y, _ = self.seq_attention(y,bias=bias)
+        y, _ = self.seq_attention([y, y, y, pe], bias=bias)
+        sequence_state = sequence_state + self.drop(y)
+        # FF + Local conv + FF
+
+        sequence_state_ff = self.FF1(sequence_state)
+        sequence_state = sequence_state + sequence_state_ff
+
+        # sequence_stae = self.ln_2(sequence_state)
+        sequence_state_con = self.convMod(sequence_state)
+        sequence_state = sequence_state + sequence_state_con
+
+        sequence_state = self.ln_3(sequence_state)
+        sequence_state_ff = self.FF2(sequence_state)
+        sequence_state = sequence_state + sequence_state_ff
+
+        sequence_state = self.ln_4(sequence_state)
+
+        sequence_state = self.mlp_seq(sequence_state)
+
+        # Update pairwise state
+        pairwise_state = pairwise_state + self.sequence_to_pair(sequence_state, band)
+
+        pairwise_state = self.resNet(pairwise_state.permute(0, 3, 1, 2), band).permute(
+            0, 2, 3, 1
+        )
+
+        # # Axial attention
+        # pairwise_state = pairwise_state + self.row_drop(
+        #     self.tri_mul_out(pairwise_state)
+        # )
+        # pairwise_state = pairwise_state + self.col_drop(
+        #     self.tri_mul_in(pairwise_state)
+        # )
+        # pairwise_state = pairwise_state + self.row_drop(
+        #     self.tri_att_start(pairwise_state)
+        # )
+        # pairwise_state = pairwise_state + self.col_drop(
+        #     self.tri_att_end(pairwise_state)
+        # )
+
+        # MLP over pairs.
+        pairwise_state = self.mlp_pair(pairwise_state)
+
+        return sequence_state, pairwise_state
+
+
+class EvoFold(nn.Module):
+    def __init__(
+        self,
+        c_s=1024,
+        c_z=128,
+        no_heads_s=8,
+        no_heads_z=4,
+        num_blocks=10,
+        position_bins=32,
+        dropout=0.0,
+        no_recycles=2,
+    ):
+        super(EvoFold, self).__init__()
+        """
+        Inputs:
+            c_z:            Channels for pair rep
+            c_s:            Channels for seq rep
+            position_bins:  Position Encoder Bins
+        """
+
+        # First 'recycle' is just the standard forward pass through the model.
+        self.itters = no_recycles + 1
+
+        self.pairwise_positional_embedding = RelativePosition(position_bins, c_z)
+
+        self.blocks = nn.ModuleList(
+            [
+                EvoBlock(
+                    c_s=c_s,
+                    c_z=c_z,
+                    no_heads_s=no_heads_s,
+                    no_heads_z=no_heads_z,
+                    dropout=dropout,
+                )
+                for i in range(num_blocks)
+            ]
+        )
+
+        self.s_norm = nn.LayerNorm(c_s)
+        self.z_norm = nn.LayerNorm(c_z)
+
+    def forward(self, seq_feats, pair_feats, band=None, recycle_tol=None, max_recycles=None):
+        """
+        Inputs:
+            seq_feats:     B x L x c_s          tensor of sequence features
+            pair_feats:    B x L x L x c_z      tensor of pair features (B x L x 2*band+1 x c_z in banded mode)
+            recycle_tol:   scalar               in eval mode, stop recycling a sample once the relative change of its pair features falls below this
+            max_recycles:  scalar               number of recycles, or most recycles with recycle_tol (default: no_recycles)
+
+        Output:
+            pair_feats:    B x L x L x c_z      tensor of pair features
+
+        The number of recycles run for each sample, B, is left in self.recycles.
+        """
+
+        L = seq_feats.shape[1]
+
+        s = seq_feats
+        z = pair_feats
+
+        # The relative positions only depend on L: embed them once, as 1 x L x L x c_z, and broadcast over the batch
+        res_index = torch.arange(L, device=z.device)[None]
+        relative_position = self.pairwise_positional_embedding(res_index, band)
+
+        if recycle_tol is not None and max_recycles is None and self.itters == 1:
+            warnings.warn("recycle_tol has no effect on a model without recycles (no_recycles=0), set max_recycles to recycle it")
+        if recycle_tol is not None and not self.training:
+            return self._adaptive_recycling(s, z, relative_position, band, recycle_tol, max_recycles)
+
+        itters = self.itters if max_recycles is None else max_recycles + 1
+        for itter in range(itters):
+            # Only compute gradients on last itter
+            with ExitStack() if itter == itters - 1 else torch.no_grad():
+                s, z = self._trunk(s, z, relative_position, band)
+
+        self.recycles = torch.full((s.shape[0],), itters - 1, device=z.device)
+        return s, z
+
+    def _trunk(self, s, z, relative_position, band=None):
+        s = self.s_norm(s)
+        z = self.z_norm(z)
+        z = z + relative_position
+
+        for block in self.blocks:
+            s, z = block(s, z, band)
+        return s, z
+
+    @torch.no_grad()
+    def _adaptive_recycling(self, s, z, relative_position, band, recycle_tol, max_recycles=None):
+        """Recycles the samples whose pair features still change by more than recycle_tol, relative to their norm.
+
+        The converged samples are dropped from the next passes. In eval mode the blocks treat the
+        samples independently, so each sample gets the features of a full run with as many recycles.
+        """
+        max_recycles = self.itters - 1 if max_recycles is None else max_recycles
+        s, z = self._trunk(s, z, relative_position, band)
+        recycles = torch.zeros(s.shape[0], dtype=torch.long, device=z.device)
+        active = torch.arange(s.shape[0], device=z.device)
+
+        for _ in range(max_recycles):
+            s_new, z_new = self._trunk(s[active], z[active], relative_position, band)
+            change = (z_new - z[active]).flatten(1).norm(dim=1) / z[active].flatten(1).norm(dim=1).clamp_min(1e-6)
+            s[active], z[active] = s_new, z_new
+            recycles[active] += 1
+            active = active[change >= recycle_tol]
+            if len(active) == 0:
+                break
+
+        self.recycles = recycles
+        return s, z
+
+
+class SequenceToPair(nn.Module):
+    def __init__(self, sequence_state_dim, inner_dim, pairwise_state_dim):
+        super(SequenceToPair, self).__init__()
+
+        self.layernorm = nn.LayerNorm(sequence_state_dim)
+        self.proj = nn.Linear(sequence_state_dim, inner_dim * 2, bias=True)
+        self.o_proj = nn.Linear(2 * inner_dim, pairwise_state_dim, bias=True)
+
+        # set bias to zero
+        torch.nn.init.zeros_(self.proj.bias)
+        torch.nn.init.zeros_(self.o_proj.bias)
+
+    def forward(self, sequence_state, band=None):
+        """
+        Inputs:
+          sequence_state: B x L x c_s
+
+        Output:
+          pairwise_state: B x L x L x c_z (B x L x 2*band+1 x c_z in banded mode)
+
+        Intermediate state:
+          B x L x L x 2*inner_dim
+        """
+
+        assert len(sequence_state.shape) == 3
+
+        s = self.layernorm(sequence_state)
+        s = self.proj(s)
+        q, k = s.chunk(2, dim=-1)
+
+        if band is None:
+            q = q[:, None, :, :]
+        else:
+            q = q[:, _band_index(q.shape[1], band, q.device)[0]]
+        prod = q * k[:, :, None, :]
+        diff = q - k[:, :, None, :]
+
+        x = torch.cat([prod, diff], dim=-1)
+        x = self.o_proj(x)
+
+        return x
+
+
+class Dropout(nn.Module):
+    """
+    Implementation of dropout with the ability to share the dropout mask
+    along a particular dimension.
+    """
+
+    def __init__(self, r: float, batch_dim: T.Union[int, T.List[int]]):
+        super(Dropout, self).__init__()
+
+        self.r = r
+        if isinstance(batch_dim, int):
+            batch_dim = [batch_dim]
+        self.batch_dim = batch_dim
+        self.dropout = nn.Dropout(self.r)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        shape = list(x.shape)
+        if self.batch_dim is not None:
+            for bd in self.batch_dim:
+                shape[bd] = 1
+        return x * self.dropout(x.new_ones(shape))
+
+
+class PairToSequence(nn.Module):
+    def __init__(self, pairwise_state_dim, num_heads):
+        super(PairToSequence, self).__init__()
+
+        self.layernorm = nn.LayerNorm(pairwise_state_dim)
+        self.linear = nn.Linear(pairwise_state_dim, num_heads, bias=False)
+
+    def forward(self, pairwise_state):
+        """
+        Inputs:
+          pairwise_state: B x L x L x pairwise_state_dim
+
+        Output:
+          pairwise_bias: B x L x L x num_heads
+        """
+        assert len(pairwise_state.shape) == 4
+        z = self.layernorm(pairwise_state)
+        pairwise_bias = self.linear(z)
+        return pairwise_bias
+
+
+class ResidueMLP(nn.Module):
+    def __init__(self, embed_dim, inner_dim, dropout=0):
+        super(ResidueMLP, self).__init__()
+
+        self.mlp = nn.Sequential(
+            nn.LayerNorm(embed_dim),
+            nn.Linear(embed_dim, inner_dim),
+            nn.ReLU(),
+            nn.Linear(inner_dim, embed_dim),
+            nn.Dropout(dropout),
+        )
+
+    def forward(self, x):
+        return x + self.mlp(x)
+
+
+class Attention(nn.Module):
+    def __init__(self, embed_dim, num_heads, head_width, gated=False):
+        super(Attention, self).__init__()
+        assert embed_dim == num_heads * head_width
+
+        self.embed_dim = embed_dim
+        self.num_heads = num_heads
+        self.head_width = head_width
+
+        self.proj = nn.Linear(embed_dim, embed_dim * 3, bias=False)
+        self.o_proj = nn.Linear(embed_dim, embed_dim, bias=True)
+        self.gated = gated
+        if gated:
+            self.g_proj = nn.Linear(embed_dim, embed_dim)
+            torch.nn.init.zeros_(self.g_proj.weight)
+            torch.nn.init.ones_(self.g_proj.bias)
+
+        self.rescale_factor = self.head_width**-0.5
+
+        torch.nn.init.zeros_(self.o_proj.bias)
+
+    def forward(self, x, bias=None):
+        """
+        Basic self attention with optional mask and external pairwise bias.
+        To handle sequences of different lengths, use mask.
+
+        Inputs:
+          x: batch of input sequneces (.. x L x C)
+          bias: batch of scalar pairwise attention biases (.. x Lq x Lk x num_heads). optional.
+
+        Outputs:
+          sequence projection (B x L x embed_dim), attention maps (B x L x L x num_heads)
+        """
+
+        t = rearrange(self.proj(x), "... l (h c) -> ... h l c", h=self.num_heads)
+        q, k, v = t.chunk(3, dim=-1)
+
+        q = self.rescale_factor * q
+        a = torch.einsum("...qc,...kc->...qk", q, k)
+
+        # Add external attention bias.
+        if bias is not None:
+            a = a + rearrange(bias, "... lq lk h -> ... h lq lk")
+
+        a = F.softmax(a, dim=-1)
+
+        y = torch.einsum("...hqk,...hkc->...qhc", a, v)
+        y = rearrange(y, "... h c -> ... (h c)", h=self.num_heads)
+
+        if self.gated:
+            y = self.g_proj(x).sigmoid() * y
+        y = self.o_proj(y)
+
+        return y, rearrange(a, "... lq lk h -> ... h lq lk")
+
+
+class RelativePosition(nn.Module):
+    def __init__(self, bins, c_z):
+        super(RelativePosition, self).__init__()
+        self.bins = bins
+
+        # Note an additional offset is used so that the 0th position
+        # is reserved for masked pairs.
+        self.embedding = torch.nn.Embedding(2 * bins + 2, c_z)
+
+    def forward(self, residue_index, band=None):
+        """
+        Input:
+          residue_index: B x L tensor of indices (dytpe=torch.long)
+
+        Output:
+          pairwise_state: B x L x L x c_z tensor of embeddings (1 x 1 x 2*band+1 x c_z in banded mode, as it only depends on j - i)
+        """
+
+        assert residue_index.dtype == torch.long
+
+        if band is None:
+            diff = residue_index[:, None, :] - residue_index[:, :, None]
+        else:
+            diff = torch.arange(-band, band + 1, device=residue_index.device)[None, None, :]
+        diff = diff.clamp(-self.bins, self.bins)
+        diff = diff + self.bins + 1  # Add 1 to adjust for padding index.
+        output = self.embedding(diff)
+        return output
+
+
+class ResLayer(nn.Module):
+    def __init__(self, n_blocks, dim_in, dim_out, kernel_size, dropout=0.0):
+        super(ResLayer, self).__init__()
+
+        # Basic Residula block
+        self.res_layers = []
+        for i in range(n_blocks):
+            # dilation = pow(2, (i % 3))
+            self.res_layers.append(
+                ResBlock(
+                    inplanes=dim_in,
+                    planes=dim_in,
+                    kernel_size=kernel_size,
+                    dilation1=12 * (4 - i % 4),
+                    dilation2=pow(2, (i % 4)),
+                    dropout=dropout,
+                )
+            )
+        self.res_blocks = nn.Sequential(*self.res_layers)
+
+        # Adapter to change depth
+        self.conv_output = nn.Conv2d(
+            dim_in, dim_out, kernel_size=7, padding=3, bias=True
+        )
+
+    def forward(self, x: Tensor, band: int = None) -> Tensor:
+        for block in self.res_blocks:
+            x = block(x, band)
+        x = _conv2d(self.conv_output, x, band)
+
+        return x
+
+
+class ResBlock(nn.Module):
+    expansion: int = 1
+
+    def __init__(
+        self,
+        inplanes: int,
+        planes: int,
+        kernel_size=3,
+        dilation1: int = 1,
+        dilation2: int = 1,
+        dropout=0.0,
+    ) -> None:
+        super(ResBlock, self).__init__()
+
+        self.bn1 = nn.BatchNorm2d(inplanes)
+        self.relu1 = nn.ReLU(inplace=True)
+        self.conv1 = conv3x3(
+            inplanes, planes, dilation=dilation1, kernel_size=kernel_size
+        )
+        self.dropout = nn.Dropout(p=dropout)
+        self.relu2 = nn.ReLU(inplace=True)
+        self.conv2 = conv3x3(
+            planes, planes, dilation=dilation2, kernel_size=kernel_size
+        )
+
+    def forward(self, x: Tensor, band: int = None) -> Tensor:
+        identity = x
+
+        out = self.bn1(x)
+        out = self.relu1(out)
+        out = _conv2d(self.conv1, out, band)
+        out = self.dropout(out)
+        out = self.relu2(out)
+        out = _conv2d(self.conv2, out, band)
+
+        out += identity
+
+        return out
+
+
+def conv3x3(
+    in_planes: int, out_planes: int, dilation: int = 1, kernel_size=3
+) -> nn.Conv2d:
+    """3x3 convolution with padding"""
+    return nn.Conv2d(
+        in_planes,
+        out_planes,
+        kernel_size=kernel_size,
+        padding=dilation,
+        bias=False,
+        dilation=dilation,
+    )
+
+
+class PositionalEncoding(nn.Module):
+    def __init__(self, d_model: int, dropout: float = 0.1, max_len: int = 5000):
+        super().__init__()
+        self.dropout = nn.Dropout(p=dropout)
+
+        position = torch.arange(max_len).unsqueeze(1)
+        div_term = torch.exp(torch.arange(0, d_model, 2) * (-np.log(10000.0) / d_model))
+        pe = torch.zeros(max_len, d_model)
+        pe[:, 0::2] = torch.sin(position * div_term)
+        pe[:, 1::2] = torch.cos(position * div_term)
+        self.register_buffer("pe", pe)
+
+    def forward(self, x: Tensor) -> Tensor:
+        """
+        Args:
+            x: Tensor, shape [seq_len, batch_size, embedding_dim]
+        """
+        pe = self.pe[: x.shape[1]]
+        # x = torch.concatenate((x, torch.tile(self.pe[:x.shape[1]], (x.shape[0], 1, 1))), 2)
+        return pe
+
+
+class MultiHeadAttention(nn.Module):
+    def __init__(
+        self,
+        num_heads,
+        head_size,
+        output_size=None,
+        dropout=0.0,
+        use_projection_bias=True,
+        return_attn_coef=True,
+        **kwargs,
+    ):
+        super(MultiHeadAttention, self).__init__(**kwargs)
+
+        if output_size is not None and output_size < 1:
+            raise ValueError("output_size must be a positive number")
+
+        self.head_size = head_size
+        self.num_heads = num_heads
+        self.output_size = output_size
+        self.use_projection_bias = use_projection_bias
+        self.return_attn_coef = return_attn_coef
+
+        self.dropout = nn.Dropout(dropout)
+        self._dropout_rate = dropout
+
+        input_max = (self.num_heads * self.head_size) ** -0.5
+        ### DOUBLE CHECK THIS CODE:
+        self.query = nn.Linear(num_heads * head_size, num_heads * head_size, bias=False)
+        self.key = nn.Linear(num_heads * head_size, num_heads * head_size, bias=False)
+        self.value = nn.Linear(num_heads * head_size, num_heads * head_size, bias=False)
+        ###########################
+
+        self.projection_kernel = nn.Parameter(
+            torch.rand(num_heads, head_size, output_size) * 2 - 1
+        )
+
+        if use_projection_bias:
+            self.projection_bias = nn.Parameter(torch.rand(output_size) * 2 - 1)
+        else:
+            self.projection_bias = None
+
+    def call_qkv(self, query, key, value, training=False):
+        # Verify shapes
+        if key.size(-2) != value.size(-2):
+            raise ValueError(
+                "the number of elements in 'key' must be equal to "
+                "the same as the number of elements in 'value'"
+            )
+
+        # Linear transformations
+        query = self.query(query)
+        B, T, E = query.size()
+        query = query.view(B, T, self.num_heads, self.head_size)
+
+        key = self.key(key)
+        B, T, E = key.size()
+        key = key.view(B, T, self.num_heads, self.head_size)
+
+        value = self.value(value)
+        B, T, E = value.size()
+        value = value.view(B, T, self.num_heads, self.head_size)
+
+        return query, key, value
+
+    def call_attention(
+        self, query, key, value, logits, bias=None, training=False, mask=None
+    ):
+        # Mask = attention mask with shape [B, Tquery, Tkey] with 1 for positions we want to attend, 0 for masked
+        if mask is not None:
+            if len(mask.size()) < 2:
+                raise ValueError("'mask' must have at least 2 dimensions")
+            if query.size(-3) != mask.size(-2):
+                raise ValueError(
+                    "mask's second to last dimension must be equal to "
+                    "the number of elements in 'query'"
+                )
+            if key.size(-3) != mask.size(-1):
+                raise ValueError(
+                    "mask's last dimension must be equal to the number of elements in 'key'"
+                )
+
+        # Apply mask
+        if mask is not None:
+            mask = mask.float()
+
+            # Possibly expand on the head dimension so broadcasting works
+            if len(mask.size()) != len(logits.size()):
+                mask = mask.unsqueeze(-3)
+
+            logits += -1e9 * (1.0 - mask)
+
+        if bias is not None:
+            logits = logits + rearrange(bias, "... lq lk h -> ... h lq lk")
+
+        attn_coef = F.softmax(logits, dim=-1)
+
+        # Attention dropout
+        attn_coef_dropout = self.dropout(attn_coef)
+
+        # Attention * value
+        multihead_output = torch.einsum(
+            "...HNM,...MHI->...NHI", attn_coef_dropout, value
+        )
+
+        # Run the outputs through another linear projection layer. Recombining heads
+        # is automatically done.
+        output = torch.einsum(
+            "...NHI,HIO->...NO", multihead_output, self.projection_kernel
+        )
+
+        if self.projection_bias is not None:
+            output += self.projection_bias
+
+        return output, attn_coef
+
+    def forward(self, inputs, training=False, mask=None, **kwargs):
+        query, key, value = inputs
+
+        query, key, value = self.call_qkv(query, key, value, training=training)
+
+        # Scale dot-product, doing the division to either query or key
+        # instead of their product saves some computation
+        depth = torch.tensor(self.head_size, dtype=torch.float32)
+        query /= torch.sqrt(depth)
+
+        # Calculate dot product attention
+        logits = torch.einsum("...NHO,...MHO->...HNM", query, key)
+
+        output, attn_coef = self.call_attention(
+            query, key, value, logits, training=training, mask=mask
+        )
+
+        if self.return_attn_coef:
+            return output, attn_coef
+        else:
+            return output
+
+
+class RelPositionMultiHeadAttention(MultiHeadAttention):
+    def __init__(self, kernel_sizes=None, strides=None, **kwargs):
+        super(RelPositionMultiHeadAttention, self).__init__(**kwargs)
+
+        num_pos_features = self.num_heads * self.head_size
+        input_max = (self.num_heads * self.head_size) ** -0.5
+        self.pos_kernel = nn.Parameter(
+            torch.rand(self.num_heads, num_pos_features, self.head_size) * 2 - 1
+        )
+        self.pos_bias_u = nn.Parameter(torch.zeros(self.num_heads, self.head_size))
+        self.pos_bias_v = nn.Parameter(torch.zeros(self.num_heads, self.head_size))
+
+    @staticmethod
+    def relative_shift(x):
+        x_shape = x.size()
+        # x = F.pad(x, (1, 0))
+        # replace pad with torch.cat
+        x = torch.cat([x, x.new_zeros(x_shape[0], x_shape[1], x_shape[2], 1)], dim=-1)
+
+        x = x.view(x_shape[0], x_shape[1], x_shape[3] + 1, x_shape[2])
+        x = x[:, :, 1:, :].view(x_shape)
+        return x
+
+    def forward(self, inputs, bias=None, training=False, mask=None, **kwargs):
+        query, key, value, pos = inputs
+
+        query, key, value = self.call_qkv(query, key, value, training=training)
+
+        # explicit subscripts: pos (M x I) is shared by the batch, and ONNX does not broadcast "..." of different ranks
+        pos = torch.einsum("mi,hio->mho", pos, self.pos_kernel)
+
+        query_with_u = query + self.pos_bias_u
+        query_with_v = query + self.pos_bias_v
+
+        logits_with_u = torch.einsum("bnho,bmho->bhnm", query_with_u, key)
+        logits_with_v = torch.einsum("bnho,mho->bhnm", query_with_v, pos)
+
+        logits_with_v = self.relative_shift(logits_with_v)
+
+        logits = logits_with_u + logits_with_v[:, :, :, : logits_with_u.size(3)]
+
+        depth = torch.tensor(self.head_size, dtype=torch.float32)
+        logits /= torch.sqrt(depth)
+
+        output, attn_coef = self.call_attention(
+            query, key, value, logits, training=training, mask=mask, bias=bias
+        )
+
+        if self.return_attn_coef:
+            return output, attn_coef
+        else:
+            return output
+
+
+class GLU(nn.Module):
+    def __init__(self, name="glu"):
+        super(GLU, self).__init__()
+
+    def forward(self, x):
+        return x[:, : x.size(1) // 2] * torch.sigmoid(x[:, x.size(1) // 2 :])
+
+
+class ConvModule(nn.Module):
+    def __init__(
+        self,
+        input_dim,
+        kernel_size=31,
+        dropout=0.0,
+        depth_multiplier=1,
+        conv_expansion_rate=2,
+        conv_use_glu=False,
+        adaptive_scale=False,
+        name="conv_module",
+        **kwargs,
+    ):
+        super(ConvModule, self).__init__()
+
+        self.adaptive_scale = adaptive_scale
+        if not adaptive_scale:
+            self.ln = nn.LayerNorm(input_dim, elementwise_affine=True)
+        else:
+            self.scale = nn.Parameter(torch.ones(input_dim))
+            self.bias = nn.Parameter(torch.zeros(input_dim))
+
+        pw1_max = input_dim**-0.5
+        dw_max = kernel_size**-0.5
+        pw2_max = input_dim**-0.5
+
+        self.pw_conv_1 = nn.Conv1d(
+            in_channels=input_dim,
+            out_channels=conv_expansion_rate * input_dim,
+            kernel_size=1,
+            stride=1,
+            padding=0,
+            bias=True,
+        )
+
+        if conv_use_glu:
+            self.act1 = GLU()
+        else:
+            self.act1 = nn.SiLU()
+        self.act1 = GLU()
+
+        self.dw_conv = nn.Conv1d(
+            in_channels=input_dim,
+            out_channels=conv_expansion_rate * input_dim,
+            kernel_size=5,
+            stride=1,
+            padding=(5 // 2),
+            groups=depth_multiplier,
+            bias=True,
+        )
+
+        self.bn = nn.BatchNorm1d(conv_expansion_rate * input_dim, momentum=0.985)
+        self.act2 = nn.SiLU()
+
+        self.pw_conv_2 = nn.Conv1d(
+            in_channels=conv_expansion_rate * input_dim,
+            out_channels=input_dim,
+            kernel_size=1,
+            stride=1,
+            padding=0,
+            bias=True,
+        )
+
+        self.do = nn.Dropout(dropout)
+        self.res_add = nn.quantized.FloatFunctional()
+
+    def forward(self, inputs, training=False, pad_mask=None, **kwargs):
+        if not self.adaptive_scale:
+            outputs = self.ln(inputs)
+        # else:
+        # scale = self.scale.view(1, 1, -1)
+        # bias = self.bias.view(1, 1, -1)
+        # outputs = inputs * scale + bias
+
+        B, T, E = outputs.size()
+        outputs = outputs.view(B, E, T)
+        outputs = self.pw_conv_1(outputs)
+        outputs = self.act1(outputs)
+        outputs = self.dw_conv(outputs)
+        outputs = self.bn(outputs)
+        outputs = self.act2(outputs)
+        outputs = self.pw_conv_2(outputs)
+        outputs = outputs.view(B, T, E)
+        outputs = self.do(outputs)
+
+        return outputs
+
+
+class FFMod(nn.Module):
+    def __init__(self, emb_dim, dropout=0.0, expand=2):
+        super(FFMod, self).__init__()
+        self.lin = nn.Linear(emb_dim, emb_dim * expand)
+        self.act = nn.SiLU()
+        self.drop = nn.Dropout(dropout)
+        self.lin_2 = nn.Linear(emb_dim * expand, emb_dim)
+
+    def forward(self, x):
+        x = self.lin(x)
+        x = self.act(x)
+        x = self.drop(x)
+        x = self.lin_2(x)
+
+        return self.drop(x)
@@ -1,19 +1,23 @@
-from .transformer import Transformer
-from .efold import eFold 
-from .cnn import CNN
-from .ribonanza import Ribonanza
-from .unet import U_Net
-
-
 def create_model(model: str, *args, **kwargs):
+    # each model is only imported when built, as they all import lightning
     if model == "transformer":
+        from .transformer import Transformer
+
         return Transformer(*args, **kwargs)
     if model == "efold":
+        from .efold import eFold
+
         return eFold(*args, **kwargs)
     if model == "cnn":
+        from .cnn import CNN
+
         return CNN(*args, **kwargs)
     if model == "unet":
+        from .unet import U_Net
+
         return U_Net(*args, **kwargs)
     if model == "ribonanza":
+        from .ribonanza import Ribonanza
+
         return Ribonanza(*args, **kwargs)
     raise ValueError(f"Unknown model: {model}")
@@ -1,6 +1,6 @@
-from torch import nn, tensor
+from torch import nn
 import torch
-from ..config import device, seq2int, START_TOKEN, END_TOKEN, PADDING_TOKEN
+from ..config import START_TOKEN, END_TOKEN, PADDING_TOKEN
 from ..core.model import Model
 from torch.nn import init
 
@@ -133,60 +133,88 @@ class DynamicPositionalEncoding(nn.Module):
         self.lin3 = nn.Linear(48, params["num_heads"])
         init.xavier_normal_(self.lin3.weight, gain=global_gain)
 
-    def create_matrix(self, size):
-        # Initialize an empty matrix filled with zeros
-        matrix = torch.zeros((size, size), dtype=torch.int64)
-        # Fill the upper diagonals with 1, 2, 3
-        for i in range(size - 1):
-            matrix[i, i + 1 :] = torch.arange(1, size - i)
-        # Fill the lower diagonals with -1, -2, -3
-        for i in range(1, size):
-            matrix[i, :i] = torch.arange(-1, -i - 1, -1)
-        return matrix
+        # bias of each length, in eval mode without gradients, for the weights of version _cache_key
+        self._cache = {}
+        self._cache_key = None
 
-    def forward(self, sequence):
-        seq_len = sequence.shape[1]
-        # [seq_len, seq_len, 1]
-        x = self.positional_encoding[:seq_len, :seq_len].unsqueeze(-1)
-        # [seq_len, seq_len, 1] -> [seq_len, seq_len, 48]
+    def create_matrix(self, size):
+        """Offset of each position pair: j - i above the diagonal, -(j + 1) below it.
+
+        Example:
+        >>> DynamicPositionalEncoding.create_matrix(None, 3)
+        tensor([[ 0,  1,  2],
+                [-1,  0,  1],
+                [-1, -2,  0]])
+        """
+        i = torch.arange(size)[:, None]
+        j = torch.arange(size)[None, :]
+        return torch.where(j >= i, j - i, -(j + 1))
+
+    def _mlp(self, x):
         x = self.lin1(x)
         x = self.silu(x)
         x = self.lin2(x)
         x = self.silu(x)
-        # [seq_len, seq_len, 48] -> [seq_len, seq_len, num_heads]
-        x = self.lin3(x)
+        return self.lin3(x)
+
+    def _bias(self, seq_len):
+        # the offsets take 2 * max_len - 1 values: run the MLP once on each of them and gather
+        max_len = self.params["max_len"]
+        offsets = torch.arange(1 - max_len, max_len, device=self.lin1.weight.device, dtype=self.lin1.weight.dtype)
+        # [2 * max_len - 1, num_heads]
+        table = self._mlp(offsets.unsqueeze(-1))
         # [seq_len, seq_len, num_heads] -> [1, num_heads, seq_len, seq_len]
-        x = x.permute(2, 0, 1).unsqueeze(0)
-        return x
+        index = self.positional_encoding[:seq_len, :seq_len].long() + max_len - 1
+        return table[index].permute(2, 0, 1).unsqueeze(0)
+
+    def forward(self, sequence):
+        seq_len = sequence.shape[1]
+        if self.training or torch.is_grad_enabled():
+            return self._bias(seq_len)
+
+        # the optimizer and load_state_dict update the weights in place, which bumps their version
+        key = tuple((p.data_ptr(), p._version) for p in self.parameters())
+        if key != self._cache_key:
+            self._cache, self._cache_key = {}, key
+        if seq_len not in self._cache:
+            self._cache[seq_len] = self._bias(seq_len)
+        return self._cache[seq_len]
 
 
 class Preprocessing:
     def sequence_batch(batch):
-        out = []
-        L = max(batch.get("length"))
-        for sequence, length in zip(batch.get("sequence"), batch.get("length")):
-            out.append(
-                torch.concat(
-                    [
-                        tensor([START_TOKEN], dtype=torch.long).to(device),
-                        sequence[:length],
-                        tensor([END_TOKEN], dtype=torch.long).to(device),
-                        tensor([PADDING_TOKEN] * (L - length), dtype=torch.long).to(
-                            device
-                        ),
-                    ],
-                )
-            )
-        return torch.stack(out)
+        """Sequences framed by START_TOKEN and END_TOKEN and padded with PADDING_TOKEN, as one (N, L + 2) tensor.
+
+        Example:
+        >>> from types import SimpleNamespace
+        >>> batch = SimpleNamespace(get={"sequence": torch.tensor([[1, 2, 3], [4, 1, 0]]), "length": [3, 2]}.get)
+        >>> Preprocessing.sequence_batch(batch)
+        tensor([[5, 1, 2, 3, 6],
+                [5, 4, 1, 6, 0]])
+        """
+        sequence = batch.get("sequence")
+        length = torch.as_tensor(batch.get("length"), device=sequence.device)
+        L = int(length.max())
+        inside = torch.arange(L, device=sequence.device)[None, :] < length[:, None]
+        out = torch.full((len(length), L + 2), PADDING_TOKEN, dtype=torch.long, device=sequence.device)
+        out[:, 0] = START_TOKEN
+        out[:, 1:-1] = torch.where(inside, sequence[:, :L], PADDING_TOKEN)
+        out[torch.arange(len(length), device=sequence.device), length + 1] = END_TOKEN
+        return out
 
     def structure_batch(batch):
-        structure = batch.get("structure")
-        batch_size, L, _ = structure.shape
-        embedded_matrix = torch.zeros(
-            (batch_size, L + 2, L + 2), dtype=torch.float32
-        ).to(device)
-        embedded_matrix[:, 1:-1, 1:-1] = structure
-        return embedded_matrix
+        """Structures with a zero border for the START and END tokens, as one (N, L + 2, L + 2) float tensor.
+
+        Example:
+        >>> from types import SimpleNamespace
+        >>> Preprocessing.structure_batch(SimpleNamespace(get={"structure": torch.ones(1, 1, 1)}.get))
+        tensor([[[0., 0., 0.],
+                 [0., 1., 0.],
+                 [0., 0., 0.]]])
+        """
+        # a new tensor each call: a buffer kept across calls would be overwritten under its previous users,
+        # and one made under inference_mode cannot be written to in training
+        return torch.nn.functional.pad(batch.get("structure").float(), (1, 1, 1, 1))
 
 
 class Encoder(nn.Module):
@@ -215,7 +243,8 @@ class Ribonanza(Model):
         lr=1e-3,
         optimizer_fn=torch.optim.Adam,
     ):
-        super().__init__(**params, lr=lr, optimizer_fn=optimizer_fn)
+        # the lr and optimizer_fn of params, as in scripts/ribonanza-template.py, take precedence
+        super().__init__(**{"lr": lr, "optimizer_fn": optimizer_fn, **params})
 
         # Layers
         self.table_embedding = nn.Embedding(self.ntokens, params["embed_dim"])
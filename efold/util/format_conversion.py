@@ -92,12 +92,9 @@ def _get_list_bp_conflicts(bp_list):
     returns:
             List of conflicting basepairs, where conflicting is pairs of base pairs that are intertwined.
     '''
-    if len(bp_list) <= 1:
-        return []
-    else:
-        current_bp = bp_list[0]
-        conflicts = []
-        for bp in bp_list[1:]:
+    conflicts = []
+    for k, current_bp in enumerate(bp_list):
+        for bp in bp_list[k + 1:]:
             if (bp[0] < current_bp[1] and current_bp[1] < bp[1]):
                 conflicts.append([current_bp, bp])
-        return conflicts + _get_list_bp_conflicts(bp_list[1:])
+    return conflicts
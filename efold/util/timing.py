@@ -0,0 +1,164 @@
+"""Named timing spans around the stages of inference and training, and a torch.profiler switch.
+
+Spans cost one global lookup when timing is disabled, which is the default. Enable it
+with the EFOLD_TIMING=1 environment variable, enable(), or the collect() context.
+
+Example:
+>>> reset()
+>>> with collect():
+...     with span("stage"):
+...         pass
+>>> summary()["stage"]["count"]
+1
+"""
+import csv
+import functools
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+import numpy as np
+
+# upper edges of the histogram bins, in seconds
+BINS = [1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.0, 10.0, float("inf")]
+
+_NULL = nullcontext()
+_lock = threading.Lock()
+_timings = defaultdict(list)
+_state = {"enabled": os.environ.get("EFOLD_TIMING", "0") not in ["", "0"], "sync": False, "profiler": False}
+
+
+class _Span:
+    __slots__ = ("name", "t0", "record")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.record = None
+        if _state["profiler"]:
+            from torch.profiler import record_function
+
+            self.record = record_function(self.name)
+            self.record.__enter__()
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if _state["sync"]:
+            import torch
+
+            torch.cuda.synchronize()
+        dt = time.perf_counter() - self.t0
+        if self.record is not None:
+            self.record.__exit__(*exc)
+        with _lock:
+            _timings[self.name].append(dt)
+        return False
+
+
+def span(name: str):
+    """Context timing its block under `name` when timing is enabled."""
+    return _Span(name) if _state["enabled"] else _NULL
+
+
+def timed(name: str):
+    """Decorator timing each call of the function under `name`."""
+
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if not _state["enabled"]:
+                return f(*args, **kwargs)
+            with _Span(name):
+                return f(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def enable(sync_cuda: bool = False):
+    """Starts timing the spans. With sync_cuda, each span waits for the CUDA kernels it launched."""
+    if sync_cuda:
+        import torch
+
+        sync_cuda = torch.cuda.is_available()
+    _state["enabled"], _state["sync"] = True, sync_cuda
+
+
+def disable():
+    _state["enabled"], _state["sync"] = False, False
+
+
+def reset():
+    with _lock:
+        _timings.clear()
+
+
+def timings():
+    """Durations of each span, in seconds."""
+    with _lock:
+        return {name: list(values) for name, values in _timings.items()}
+
+
+@contextmanager
+def collect(sync_cuda: bool = False):
+    """Enables timing within the block."""
+    previous = dict(_state)
+    enable(sync_cuda)
+    try:
+        yield
+    finally:
+        _state.update(previous)
+
+
+def summary():
+    """Count, total, mean, percentiles and histogram (counts per BINS upper edge) of each span."""
+    out = {}
+    for name, values in timings().items():
+        values = np.array(values)
+        out[name] = {
+            "count": int(len(values)),
+            "total_s": float(values.sum()),
+            "mean_s": float(values.mean()),
+            "p50_s": float(np.percentile(values, 50)),
+            "p90_s": float(np.percentile(values, 90)),
+            "p99_s": float(np.percentile(values, 99)),
+            "max_s": float(values.max()),
+            "histogram": dict(zip([str(b) for b in BINS], np.histogram(values, [0.0] + BINS)[0].tolist())),
+        }
+    return out
+
+
+def export(path: str):
+    """Writes the summary as JSON, or as CSV (one row per span, without the histogram) if path ends with .csv."""
+    stats = summary()
+    with open(path, "w", newline="") as f:
+        if path.endswith(".csv"):
+            fields = ["span", "count", "total_s", "mean_s", "p50_s", "p90_s", "p99_s", "max_s"]
+            writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows({"span": name, **values} for name, values in stats.items())
+        else:
+            json.dump(stats, f, indent=4)
+
+
+@contextmanager
+def profile(trace_path: str, sync_cuda: bool = False, **profiler_kwargs):
+    """Runs the block under torch.profiler, with the spans as named ranges, and writes a Chrome trace to `trace_path`."""
+    import torch
+    from torch.profiler import ProfilerActivity
+
+    activities = [ProfilerActivity.CPU] + ([ProfilerActivity.CUDA] if torch.cuda.is_available() else [])
+    previous = dict(_state)
+    enable(sync_cuda)
+    _state["profiler"] = True
+    try:
+        with torch.profiler.profile(activities=profiler_kwargs.pop("activities", activities), **profiler_kwargs) as prof:
+            yield prof
+    finally:
+        _state.update(previous)
+    prof.export_chrome_trace(trace_path)
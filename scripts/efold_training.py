@@ -10,7 +10,7 @@ import pandas as pd
 from lightning.pytorch.callbacks.early_stopping import EarlyStopping
 from lightning.pytorch import Trainer
 from lightning.pytorch.callbacks import LearningRateMonitor
-from efold.core.callbacks import ModelCheckpoint  # , WandbTestLogger
+from efold.core.callbacks import ModelCheckpoint, DataWaitTimer, WeightAveraging  # , WandbTestLogger
 from efold.config import device
 from efold import DataModule, create_model
 import sys
@@ -57,6 +57,9 @@ if __name__ == "__main__":
         train_split=None,
         external_valid=["RNAStralign_Group_I_intron",
                         "RNAStralign_validation"],
+        num_workers="auto",
+        persistent_workers=True,
+        pin_memory=True,
     )
 
     model = create_model(
@@ -71,6 +74,8 @@ if __name__ == "__main__":
         lr=1e-3,
         weight_decay=0,
         gamma=0.995,
+        structure_loss="dense",  # the library default, or "triangle" for the BCE on the cells that can pair only
+        pos_weight=300,  # or "auto" for the unpaired / paired ratio of each batch
         wandb=USE_WANDB,
     )
 
@@ -92,11 +97,13 @@ if __name__ == "__main__":
         use_distributed_sampler=STRATEGY != "ddp",
         logger=wandb_logger if USE_WANDB else None,
         callbacks=[
-            LearningRateMonitor(logging_interval="epoch"),
+            # validate and save the EMA of the weights, instead of averaging checkpoints afterwards
+            WeightAveraging(mode="ema", decay=0.999),
             ModelCheckpoint(every_n_epoch=1),
+            DataWaitTimer(),
         ]
-        if USE_WANDB
-        else [],
+        # the learning rate monitor needs a logger
+        + ([LearningRateMonitor(logging_interval="epoch")] if USE_WANDB else []),
         enable_checkpointing=False,
     )
 
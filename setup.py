@@ -18,6 +18,6 @@ setup(
     python_requires='>=3.10',
     py_modules=['efold'],
     include_package_data=True,
-    package_data={'': ['resources/*.pt']},
+    package_data={'': ['resources/*.pt', 'resources/*.safetensors', 'resources/*.json']},
     packages=find_packages(),
 ) 
\ No newline at end of file
@@ -0,0 +1,47 @@
+import json
+import os
+import pytest
+import torch
+import efold.api.run
+from efold.api.export import TEST_DATA_DIR
+from efold.models.evofold import eFoldNet
+
+# hyperparameters of the packaged weights, see efold/resources/efold_weights.json
+HPARAMS = {"ntoken": 5, "d_model": 64, "c_z": 32, "d_cnn": 64, "num_blocks": 4, "no_recycles": 0, "dropout": 0}
+
+
+@pytest.fixture
+def model():
+    """eFoldNet with the packaged hyperparameters and a random init, in eval mode.
+
+    The output logits are scaled up so that the post-processing keeps a few pairs.
+    """
+    torch.manual_seed(0)
+    model = eFoldNet(**HPARAMS).eval()
+    with torch.no_grad():
+        model.output_structure[-1].conv_output.weight *= 100
+    return model
+
+
+@pytest.fixture
+def packaged(model, monkeypatch):
+    """Makes run() load the random eFoldNet instead of the packaged weights."""
+    monkeypatch.setattr(efold.api.run, "load_model", lambda device="cpu", path=None: model)
+    return model
+
+
+@pytest.fixture
+def sequences():
+    return ["GGGAAAUCC", "AUGCUAGCUAGCUGAUCGAU", "GGGGAAAACCCCUUUUGGGGAAAACCCC"]
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    """The shortest sequence of each test set of tests/data, to keep the validation short."""
+    for name in sorted(os.listdir(TEST_DATA_DIR)):
+        with open(os.path.join(TEST_DATA_DIR, name, "data.json")) as f:
+            data = json.load(f)
+        os.makedirs(tmp_path / "data" / name)
+        with open(tmp_path / "data" / name / "data.json", "w") as f:
+            json.dump(dict(sorted(data.items(), key=lambda item: len(item[1]["sequence"]))[:1]), f)
+    return str(tmp_path / "data")
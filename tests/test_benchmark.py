@@ -0,0 +1,31 @@
+"""Smoke test of the per-stage benchmark, on the random eFoldNet."""
+import json
+import efold.benchmark.stages
+from efold.benchmark.stages import BATCHED_STAGES, STAGES, benchmark_cold_start, benchmark_stages
+
+
+def test_benchmark_cold_start():
+    results = benchmark_cold_start(repeats=1)
+    assert results[0]["stage"] == "build_eager"
+    for record in results:
+        assert set(record) == {"source", "stage", "length", "median_s", "min_s"}
+        assert record["source"] == "cold_start" and record["stage"].startswith(("build_", "load_"))
+        assert 0 <= record["min_s"] <= record["median_s"]
+
+
+def test_benchmark_stages(model, monkeypatch, data_dir):
+    monkeypatch.setattr(efold.benchmark.stages, "_load", lambda weights=None: (model, "random"))
+    report = benchmark_stages(lengths=[16, 24], batch_size=2, repeats=1, sets=["PDB"], n_per_set=1, data_dir=data_dir)
+    assert report["weights"] == "random" and report["config"]["lengths"] == [16, 24]
+    json.dumps(report)
+
+    records = {source: [r for r in report["results"] if r["source"] == source] for source in ["cold_start", "synthetic", "PDB"]}
+    assert sum(map(len, records.values())) == len(report["results"])
+    assert [(r["length"], r["stage"]) for r in records["synthetic"]] == [(L, stage) for L in [16, 24] for stage in STAGES]
+    for record in records["synthetic"]:
+        assert set(record) == {"source", "stage", "length", "batch_size", "median_s", "min_s"}
+        assert record["batch_size"] == (2 if record["stage"] in BATCHED_STAGES else 1)
+    assert [r["stage"] for r in records["PDB"]] == STAGES
+    for record in records["PDB"]:
+        assert set(record) == {"source", "stage", "length", "n", "mean_length", "median_s", "total_s"}
+        assert record["n"] == 1 and record["length"] is None
@@ -0,0 +1,65 @@
+"""Weight averaging in training."""
+import pytest
+import torch
+from torch import nn
+from types import SimpleNamespace
+from efold.core.callbacks import WeightAveraging
+
+
+def _step(callback, module, trainer, value):
+    with torch.no_grad():
+        module.weight.fill_(value)
+    trainer.global_step += 1
+    callback.on_train_batch_end(trainer, module, None, None, 0)
+
+
+@pytest.mark.parametrize("mode, expected", [("ema", 0.5 * (0.5 * 0 + 0.5 * 1) + 0.5 * 3), ("swa", (1 + 3) / 2)])
+def test_weight_averaging(mode, expected):
+    module, trainer = nn.Linear(1, 1, bias=False), SimpleNamespace(global_step=0)
+    with torch.no_grad():
+        module.weight.zero_()
+    callback = WeightAveraging(mode=mode, decay=0.5)
+    callback.on_fit_start(trainer, module)
+    _step(callback, module, trainer, 1.0)
+    _step(callback, module, trainer, 3.0)
+    # the same step again, e.g. with gradient accumulation, is not averaged twice
+    callback.on_train_batch_end(trainer, module, None, None, 1)
+
+    # validation, and the checkpoints saved then, see the average, training the weights
+    callback.on_validation_start(trainer, module)
+    assert module.weight.item() == pytest.approx(expected)
+    checkpoint = {"model": {k: v.clone() for k, v in module.state_dict().items()}, "callback": callback.state_dict()}
+    callback.on_train_batch_start(trainer, module, None, 0)
+    assert module.weight.item() == 3.0
+
+    # resumed from the checkpoint, training goes on with the weights, and the average is left in the model at the end
+    resumed, restored = nn.Linear(1, 1, bias=False), WeightAveraging(mode=mode, decay=0.5)
+    resumed.load_state_dict(checkpoint["model"])
+    restored.load_state_dict(checkpoint["callback"])
+    restored.on_train_batch_start(trainer, resumed, None, 0)
+    assert resumed.weight.item() == 3.0
+    restored.on_train_end(trainer, resumed)
+    assert resumed.weight.item() == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("device", ["meta"] + (["cuda"] if torch.cuda.is_available() else []))
+@pytest.mark.parametrize("on_cpu", [False, True])
+def test_weight_averaging_resume_device(device, on_cpu):
+    module, trainer = nn.Linear(2, 2), SimpleNamespace(global_step=0)
+    callback = WeightAveraging(on_cpu=on_cpu)
+    callback.on_fit_start(trainer, module)
+    _step(callback, module, trainer, 1.0)
+    # Lightning loads the checkpoints on the CPU, before or after on_fit_start depending on the strategy
+    checkpoint = {k: [t.cpu() for t in v] if k == "averaged" else v for k, v in callback.state_dict().items()}
+
+    resumed, restored = nn.Linear(2, 2, device=device), WeightAveraging(on_cpu=on_cpu)
+    restored.load_state_dict(checkpoint)
+    restored.on_fit_start(trainer, resumed)
+    assert [a.device.type for a in restored.averaged] == ["cpu" if on_cpu else device] * 2
+    assert restored.n_averaged == 1
+
+    # restored after on_fit_start, the average is placed before it is swapped or updated
+    placed, restored = restored.averaged, WeightAveraging(on_cpu=on_cpu)
+    restored.load_state_dict(checkpoint)
+    restored.on_train_batch_start(trainer, resumed, None, 0)
+    assert [a.device for a in restored.averaged] == [a.device for a in placed]
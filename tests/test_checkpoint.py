@@ -0,0 +1,26 @@
+"""Background checkpointing and the checkpoint index."""
+import os
+import torch
+from efold.core.checkpoint import CheckpointManager, INDEX_NAME, best_checkpoint, read_index
+
+
+def test_checkpoint_manager(tmp_path):
+    directory = str(tmp_path)
+    earlier = CheckpointManager(directory, monitor="valid/f1", mode="max", top_k=1)
+    earlier.save({}, "earlier_run.pt", 0.9)
+    earlier.close()
+    manager = CheckpointManager(directory, monitor="valid/f1", mode="max", top_k=2)
+    for epoch, score in enumerate([0.5, 0.7, None, 0.6]):
+        manager.save({"weight": torch.full((2,), float(epoch))}, "run_epoch{}.pt".format(epoch), score, epoch, step=epoch)
+    manager.close()
+
+    # the top 2 of this run are kept, those of earlier runs stay indexed
+    index = read_index(directory)
+    assert [e["name"] for e in index["checkpoints"]] == ["earlier_run.pt", "run_epoch1.pt", "run_epoch3.pt"]
+    assert index["monitor"] == "valid/f1"
+    assert sorted(os.listdir(directory)) == sorted(["earlier_run.pt", "run_epoch1.pt", "run_epoch3.pt", INDEX_NAME])
+    assert manager.best() == os.path.join(directory, "run_epoch1.pt")
+    assert best_checkpoint(directory, prefix="run") == manager.best()
+    assert torch.load(manager.best())["weight"].tolist() == [1.0, 1.0]
+    # a checkpoint without a score ranks after those with one
+    assert [e["name"] for e in sorted(index["checkpoints"] + [{"name": "x", "score": None, "step": 9}], key=manager._rank)][-1] == "x"
@@ -0,0 +1,42 @@
+"""Cost model and the memory-budget batch sampler."""
+import random
+from efold.models.cost import CostModel, efold_cost
+from efold.core.sampler import MemoryBudgetBatchSampler
+from conftest import HPARAMS
+
+
+def test_cost_model_budget():
+    cost = efold_cost(**HPARAMS)
+    budget = cost.memory(4, 100)
+    assert cost.max_batch_size(100, budget) == 4
+    assert cost.max_batch_size(100, budget, limit=2) == 2
+    assert cost.memory(1, cost.max_length(budget)) <= budget < cost.memory(1, cost.max_length(budget) + 1)
+    assert efold_cost(**HPARAMS, train=True).memory(1, 100) > cost.memory(1, 100)
+    assert CostModel.from_dict(cost.to_dict()).memory(3, 50) == cost.memory(3, 50)
+
+
+def _sampler(**kwargs):
+    lengths = [random.Random(i).randint(10, 200) for i in range(300)]
+    return MemoryBudgetBatchSampler(lengths, efold_cost(**HPARAMS), memory_budget=2**24, window=64, **kwargs), lengths
+
+
+def test_sampler_batches_fit_the_budget():
+    sampler, lengths = _sampler(shuffle=True, seed=1)
+    batches = list(sampler)
+    assert sorted(i for batch in batches for i in batch) == list(range(len(lengths)))
+    for batch in batches:
+        assert len(batch) == 1 or sampler.cost_model.memory(len(batch), max(lengths[i] for i in batch)) <= sampler.memory_budget
+
+
+def test_sampler_epochs():
+    sampler, _ = _sampler(shuffle=True, seed=1)
+    first = list(sampler)
+    # len() does not draw another order, and the order only changes with the epoch
+    assert len(sampler) == len(first) and list(sampler) == first
+    assert list(_sampler(shuffle=True, seed=1)[0]) == first
+    sampler.set_epoch(1)
+    second = list(sampler)
+    assert len(sampler) == len(second) and second != first
+    sampler.set_epoch(0)
+    assert list(sampler) == first
+    assert list(_sampler(shuffle=True, seed=2)[0]) != first
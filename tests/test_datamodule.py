@@ -0,0 +1,80 @@
+"""Dataloader settings of the DataModule and the data wait timer."""
+import functools
+import os
+import time
+import pytest
+import torch
+from types import SimpleNamespace
+from torch.utils.data import DataLoader, Dataset, Subset
+from efold.core.callbacks import DataWaitTimer
+from efold.core.datamodule import DataModule, _init_worker, _num_workers
+from efold.core.datatype import DataType
+
+
+def test_num_workers():
+    assert _num_workers(0) == 0 and _num_workers(4) == 4
+    assert _num_workers("auto") == min(8, (os.cpu_count() or 1) // max(torch.cuda.device_count(), 1))
+    for num_workers in [-1, 1.5, "many"]:
+        with pytest.raises(ValueError):
+            _num_workers(num_workers)
+
+
+def test_loader_kwargs():
+    # loads in the main process unless asked otherwise
+    assert DataModule("PDB", batch_size=2)._loader_kwargs() == {"num_workers": 0, "pin_memory": False}
+
+    dm = DataModule("PDB", batch_size=2, num_workers=2, persistent_workers=True, prefetch_factor=3, pin_memory=True)
+    kwargs = dm._loader_kwargs()
+    assert kwargs["num_workers"] == 2 and kwargs["persistent_workers"] and kwargs["prefetch_factor"] == 3
+    assert kwargs["pin_memory"] == torch.cuda.is_available()
+    assert kwargs["worker_init_fn"].func is _init_worker
+    # the test loaders run once and do not keep their workers
+    assert not dm._loader_kwargs(persistent=False)["persistent_workers"]
+
+
+class Reopened(Dataset):
+    def __init__(self):
+        self.reopened = False
+
+    def reopen(self):
+        self.reopened = True
+
+    def __len__(self):
+        return 2
+
+    def __getitem__(self, idx):
+        return self.reopened, os.environ.get("EFOLD_TEST_WORKER")
+
+
+def _hook(worker_id):
+    os.environ["EFOLD_TEST_WORKER"] = str(worker_id)
+
+
+def test_init_worker():
+    # the datasets under a Subset reopen their files in the worker, then the hook runs
+    dataset = Subset(Reopened(), [0, 1])
+    loader = DataLoader(dataset, batch_size=None, num_workers=1, worker_init_fn=functools.partial(_init_worker, hook=_hook))
+    assert [tuple(item) for item in loader] == [(True, "0"), (True, "0")]
+    assert not dataset.dataset.reopened
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="pinned memory needs CUDA")
+def test_pin_memory():
+    data = DataType(true=torch.zeros(3), error=None).pin_memory()
+    assert data.true.is_pinned() and data.error is None
+
+
+def test_data_wait_timer():
+    logged = {}
+    module = SimpleNamespace(log=lambda name, value, **kwargs: logged.update({name: value}))
+    timer = DataWaitTimer()
+    timer.on_train_epoch_start(None, module)
+    for batch_idx in range(2):
+        time.sleep(0.02)  # waiting for the batch
+        timer.on_train_batch_start(None, module, None, batch_idx)
+        time.sleep(0.01)  # training step
+        timer.on_train_batch_end(None, module, None, None, batch_idx)
+    timer.on_train_epoch_end(None, module)
+    # the waits before each batch, not the training steps
+    assert logged["train/data_wait_s"] >= 0.04
+    assert 0.4 < logged["train/data_wait_fraction"] < 1
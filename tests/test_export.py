@@ -0,0 +1,27 @@
+"""Export of eFold to TorchScript and ONNX, and inference with the exported graphs."""
+import os
+import pytest
+import torch
+from efold.api.export import export, load_exported, validate, TEST_DATA_DIR
+from efold.api.run import _encode
+
+
+@pytest.mark.parametrize("fmt", ["torchscript", "onnx"])
+def test_export_validate(model, tmp_path, data_dir, fmt):
+    path = str(tmp_path / ("efold.onnx" if fmt == "onnx" else "efold.pt"))
+    export(path, model=model, example_length=20)
+    report = validate(path, max_len=None, data_dir=data_dir, model=model)
+    assert sorted(report) == sorted(os.listdir(TEST_DATA_DIR))
+    for name, values in report.items():
+        assert values["n"] > 0, name
+        assert values["max_abs_diff"] < 1e-4 and values["same_structure"] == 1.0, (name, values)
+
+
+@pytest.mark.parametrize("fmt", ["torchscript", "onnx"])
+def test_exported_dynamic_shapes(model, sequences, tmp_path, fmt):
+    path = str(tmp_path / ("efold.onnx" if fmt == "onnx" else "efold.pt"))
+    exported = load_exported(export(path, model=model, example_length=20))
+    for batch in [sequences[:1], sequences]:
+        src = _encode(batch)
+        with torch.inference_mode():
+            assert torch.allclose(exported(src), model.forward_sequence(src), atol=1e-4)
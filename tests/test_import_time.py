@@ -0,0 +1,53 @@
+"""Import-time benchmark of the inference path.
+
+`import efold` and the `efold` CLI should only load torch, numpy and the eFold
+modules they need. Run with pytest, or as a script to print the timings as JSON.
+"""
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# seconds that `import efold.cli` may add on top of `import torch, numpy`
+IMPORT_BUDGET_S = 0.5
+
+# training, logging and visualisation stacks, imported lazily
+HEAVY_MODULES = ["lightning", "wandb", "matplotlib", "rouskinhf", "pandas", "scipy", "torchmetrics"]
+
+
+def _import(statement):
+    """Time and loaded modules of `statement`, run in a fresh interpreter."""
+    code = (
+        "import time, sys, json\n"
+        "t = time.perf_counter()\n"
+        f"{statement}\n"
+        "print(json.dumps({'time': time.perf_counter() - t, 'modules': sorted(sys.modules)}))"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(out.splitlines()[-1])
+
+
+def measure(repeats=3):
+    base = min(_import("import torch, numpy")["time"] for _ in range(repeats))
+    cli = min(_import("import efold, efold.cli")["time"] for _ in range(repeats))
+    return {"import_torch_numpy_s": base, "import_efold_cli_s": cli, "overhead_s": cli - base, "budget_s": IMPORT_BUDGET_S}
+
+
+def test_no_heavy_imports():
+    modules = _import("import efold, efold.cli")["modules"]
+    heavy = [m for m in HEAVY_MODULES if m in modules]
+    assert not heavy, "efold.cli imports {}".format(heavy)
+
+
+def test_import_time():
+    report = measure()
+    print(json.dumps(report))
+    assert report["overhead_s"] < IMPORT_BUDGET_S, report
+
+
+if __name__ == "__main__":
+    print(json.dumps(measure(), indent=2))
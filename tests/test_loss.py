@@ -0,0 +1,47 @@
+"""Structure loss on the cells that can pair."""
+import pytest
+import torch
+import torch.nn.functional as F
+from types import SimpleNamespace
+from efold import create_model
+from efold.core.model import pack_upper_triangle
+from conftest import HPARAMS
+
+
+def _batch(pred, true, length):
+    data = {"pred_structure": pred, "true_structure": true, "length": length}
+    return SimpleNamespace(get=data.get, get_pairs=lambda data_type: (data["pred_" + data_type], data["true_" + data_type]))
+
+
+def _structures(length, L):
+    true = torch.zeros(len(length), L, L)
+    for b, n in enumerate(length.tolist()):
+        for i in range(n // 4):
+            true[b, i, n - 1 - i] = true[b, n - 1 - i, i] = 1
+    return true
+
+
+@pytest.mark.parametrize("pos_weight", [300, "auto"])
+def test_triangle_loss_gradient(pos_weight):
+    model = create_model(model="efold", **HPARAMS, structure_loss="triangle", pos_weight=pos_weight)
+    length, L = torch.tensor([20, 12]), 20
+    pred = torch.randn(2, L, L, requires_grad=True)
+    model._loss_structure(_batch(pred, _structures(length, L), length)).backward()
+    i, j = torch.meshgrid(torch.arange(L), torch.arange(L), indexing="ij")
+    trained = (j - i > model.min_hairpin_length)[None] & (j[None] < length[:, None, None])
+    # the padding, the lower triangle and the cells too close to the diagonal get no gradient
+    assert (pred.grad[~trained] == 0).all()
+    assert (pred.grad[trained] != 0).all()
+
+
+def test_triangle_loss_ratio():
+    length, L = torch.tensor([200]), 200
+    logits, true = torch.randn(1, L, L), _structures(length, L)
+    pred, packed = pack_upper_triangle(logits, true, length)
+    ratio = (len(packed) - packed.sum()) / packed.sum()
+    # without padding, the packed cells keep about the unpaired / paired ratio of the dense matrix that pos_weight was set for
+    assert ratio == pytest.approx((true.numel() - true.sum()) / true.sum(), rel=0.05)
+    # 'auto' weighs the paired cells by the ratio of the packed cells
+    model = create_model(model="efold", **HPARAMS, structure_loss="triangle", pos_weight="auto")
+    expected = F.binary_cross_entropy_with_logits(pred, packed, pos_weight=ratio)
+    assert model._loss_structure(_batch(logits, true, length)) == pytest.approx(expected.item())
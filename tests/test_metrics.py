@@ -0,0 +1,50 @@
+"""Per-sample metrics accumulated on the device."""
+import math
+import torch
+from types import SimpleNamespace
+from efold.core.metrics import MetricsAccumulator, f1, structure_scores
+
+
+def _batch(pred, true, length):
+    data = {"pred_structure": pred, "true_structure": true, "length": length}
+    return SimpleNamespace(get=data.get, get_pairs=lambda data_type: (data.get("pred_" + data_type), data.get("true_" + data_type)))
+
+
+def _hairpins(length, L, stem):
+    true = torch.zeros(len(length), L, L)
+    for b, n in enumerate(length.tolist()):
+        for i in range(stem):
+            true[b, i, n - 1 - i] = true[b, n - 1 - i, i] = 1
+    return true
+
+
+def test_accumulator():
+    L = 160
+    length = torch.tensor([50, 150])
+    true = _hairpins(length, L, stem=10)
+    batches = [_batch(_hairpins(length, L, stem=stem), true, length) for stem in [5, 10, 20]]
+
+    metrics = MetricsAccumulator("test", data_type=["structure"])
+    for batch in batches:
+        metrics.update(batch)
+    scores = metrics.compute()["structure"]
+
+    expected = torch.cat([structure_scores(b.get("pred_structure"), true, length)["f1"][0] for b in batches])
+    assert math.isclose(scores["f1"], expected.mean().item(), rel_tol=1e-6)
+    # the first sample of each batch is in the first length bin, the second in the second one
+    assert math.isclose(scores["f1/len_0-99"], expected[0::2].mean().item(), rel_tol=1e-6)
+    assert math.isclose(scores["f1/len_100-199"], expected[1::2].mean().item(), rel_tol=1e-6)
+    assert math.isnan(scores["f1/len_800+"])
+    # same F1 as the per-sample metric of the evaluation scripts
+    pred = batches[0].get("pred_structure")
+    assert math.isclose(expected[0].item(), f1(pred[0, :50, :50], true[0, :50, :50]), rel_tol=1e-6)
+
+    metrics.reset()
+    assert math.isnan(metrics.compute()["structure"]["f1"])
+
+
+def test_f1_threshold():
+    true = torch.tensor([[0.0, 1.0], [1.0, 0.0]])
+    pred = torch.tensor([[0.0, 0.6], [0.6, 0.0]])
+    assert f1(pred, true) == 1.0
+    assert f1(pred, true, threshold=0.7) == 0.0
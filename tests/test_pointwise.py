@@ -0,0 +1,44 @@
+"""Dilated convolutions run as 1x1 convolutions on short sequences."""
+import pytest
+import torch
+import efold.models.evofold as evofold
+from efold.api.run import _encode
+
+
+@pytest.fixture
+def pointwise_calls(monkeypatch):
+    """Counts the convolutions that take the pointwise path."""
+    is_pointwise, calls = evofold._is_pointwise, []
+
+    def counting(conv, x):
+        calls.append(is_pointwise(conv, x))
+        return calls[-1]
+
+    monkeypatch.setattr(evofold, "_is_pointwise", counting)
+    return calls
+
+
+def _full_convs(monkeypatch):
+    monkeypatch.setattr(evofold, "_is_pointwise", lambda conv, x: False)
+
+
+@pytest.mark.parametrize("L", [5, 12, 30])
+def test_res_layer(monkeypatch, pointwise_calls, L):
+    torch.manual_seed(0)
+    layer = evofold.ResLayer(n_blocks=4, dim_in=8, dim_out=4, kernel_size=3).eval()
+    x = torch.randn(2, 8, L, L)
+    with torch.inference_mode():
+        pointwise = layer(x)
+        assert any(pointwise_calls)
+        _full_convs(monkeypatch)
+        assert torch.allclose(pointwise, layer(x), atol=1e-5)
+
+
+def test_efold(monkeypatch, pointwise_calls, model):
+    src = _encode(["GGGAAAUCC", "AUGCUAGCUAGCUGAUCGAU"])
+    with torch.inference_mode():
+        pointwise = model.forward_sequence(src)
+        assert any(pointwise_calls)
+        _full_convs(monkeypatch)
+        dense = model.forward_sequence(src)
+    assert torch.allclose(pointwise, dense, atol=1e-3 * dense.abs().max().item())
@@ -0,0 +1,32 @@
+"""Test predictions streamed to Feather files."""
+import numpy as np
+import pyarrow.feather as feather
+import torch
+from efold.core.predictions import PredictionWriter
+
+
+def _structures(length, L):
+    structure = torch.zeros(len(length), L, L)
+    for b, n in enumerate(length):
+        structure[b, 0, n - 1] = structure[b, n - 1, 0] = 1
+    return structure
+
+
+def test_prediction_writer(tmp_path):
+    path = str(tmp_path / "results" / "PDB.feather")
+    writer = PredictionWriter(path, probabilities=True, min_probability=0.1)
+    sequence = torch.tensor([[1, 2, 3, 4, 3], [4, 3, 2, 0, 0]])
+    probabilities = torch.full((2, 5, 5), 0.05)
+    probabilities[0, 1, 3] = 0.5
+    writer.write(["a", "b"], sequence, [5, 3], _structures([5, 3], 5), probabilities)
+    writer.write(["c"], sequence[:1, :4], [4], _structures([4], 4), torch.zeros(1, 4, 4))
+    writer.close()
+
+    table = feather.read_table(path).to_pydict()
+    assert table["reference"] == ["a", "b", "c"]
+    assert table["sequence"] == ["ACGUG", "UGC", "ACGU"]
+    assert table["length"] == [5, 3, 4]
+    assert table["pair_i"] == [[0], [0], [0]] and table["pair_j"] == [[4], [2], [3]]
+    # only the probabilities above min_probability, of the upper triangle, are stored
+    assert table["prob_i"] == [[1], [], []] and table["prob_j"] == [[3], [], []]
+    assert np.allclose(table["prob"][0], [0.5])
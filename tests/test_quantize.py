@@ -0,0 +1,25 @@
+"""Int8 quantization of eFold and its F1 comparison with fp32."""
+import json
+import pytest
+import torch
+from efold.api.quantize import quantize, compare
+from efold.api.run import _encode
+
+
+@pytest.mark.parametrize("mode", ["dynamic", "static"])
+def test_quantize(model, sequences, mode):
+    quantized = quantize(model, mode=mode, sequences=sequences)
+    src = _encode(sequences)
+    with torch.inference_mode():
+        logits, reference = quantized.forward_sequence(src), model.forward_sequence(src)
+    assert logits.shape == reference.shape and torch.isfinite(logits).all()
+    # int8 logits stay close to the fp32 ones
+    assert (logits - reference).abs().mean() < 0.1 * reference.abs().mean() + 1e-3
+
+
+def test_compare_empty_set(model, data_dir):
+    # the shortest lncRNA is longer than max_len
+    report = compare(quantize(model, mode="dynamic"), model, max_len=150, data_dir=data_dir)
+    assert report["lncRNA_nonFiltered"] == {"n": 0, "f1_fp32": None, "f1_int8": None, "f1_delta": None}
+    assert report["PDB"]["n"] == 1 and 0 <= report["PDB"]["f1_fp32"] <= 1
+    json.loads(json.dumps(report), parse_constant=lambda c: pytest.fail("invalid JSON constant " + c))
@@ -0,0 +1,45 @@
+"""Adaptive recycling through the trunk of eFold."""
+import pytest
+import torch
+from click.testing import CliRunner
+from efold.cli import fold
+from efold.api.run import run, _encode
+
+
+def test_max_recycles(model, sequences):
+    src = _encode(sequences)
+    with torch.inference_mode():
+        fixed = model.forward_sequence(src, max_recycles=2)
+        assert model.eFold.recycles.tolist() == [2] * len(sequences)
+        # a tolerance of 0 never converges, so it runs every recycle, as the fixed loop does
+        adaptive = model.forward_sequence(src, recycle_tol=0, max_recycles=2)
+        assert model.eFold.recycles.tolist() == [2] * len(sequences)
+        assert torch.allclose(adaptive, fixed, atol=1e-5)
+        model.forward_sequence(src, recycle_tol=float("inf"), max_recycles=2)
+        assert model.eFold.recycles.tolist() == [1] * len(sequences)
+
+
+def test_recycle_tol_without_recycles(model, sequences):
+    with pytest.warns(UserWarning, match="no_recycles=0"), torch.inference_mode():
+        model.forward_sequence(_encode(sequences), recycle_tol=0.01)
+
+
+def test_run_recycles(packaged, sequences):
+    recycles = []
+    structures = run(sequences, recycle_tol=float("inf"), max_recycles=3, recycles=recycles)
+    assert sorted(structures) == sorted(sequences)
+    assert sorted(r["sequence"] for r in recycles) == sorted(sequences)
+    assert all(r["recycles"] == 1 for r in recycles)
+    assert run(sequences, max_recycles=0) == run(sequences)
+
+
+@pytest.mark.parametrize("kwargs", [dict(max_recycles=-1), dict(max_recycles=1, backend="onnx"), dict(recycle_tol=0.1, workers=2)])
+def test_run_invalid(sequences, kwargs):
+    with pytest.raises(ValueError):
+        run(sequences, **kwargs)
+
+
+def test_cli_recycles(packaged, tmp_path):
+    result = CliRunner().invoke(fold, ["GGGAAAUCC", "--recycle-tol", "0.01", "--max-recycles", "2", "-o", str(tmp_path / "out.txt")])
+    assert result.exit_code == 0, result.output
+    assert "Recycles:" in result.output
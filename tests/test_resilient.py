@@ -0,0 +1,67 @@
+"""Recovery from out-of-memory errors while folding."""
+import pytest
+from efold.api.resilient import MIN_WINDOW, fold_resilient
+from efold.api.run import _fold_records
+
+
+class OutOfMemory:
+    """Predictor that runs out of memory on batches of more than max_batch sequences or max_length residues."""
+
+    def __init__(self, model, max_batch=None, max_length=None):
+        self.model, self.max_batch, self.max_length = model, max_batch, max_length
+        self.calls = []
+
+    def __call__(self, src):
+        self.calls.append(tuple(src.shape))
+        if (self.max_batch is not None and src.shape[0] > self.max_batch) or (self.max_length is not None and src.shape[1] > self.max_length):
+            raise RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB")
+        return self.model(src)
+
+
+def _records(length, n=1):
+    return [(i, ("GGGGAAAACCCCUUUU" * (length // 16 + 1))[i : i + length]) for i in range(n)]
+
+
+def test_split_batch(model):
+    records = _records(40, n=4)
+    predictor, degraded = OutOfMemory(model, max_batch=1), []
+    structures = fold_resilient(predictor, records, degraded=degraded)
+    # the batch is split down to single sequences, which gives the same structures and no degraded record
+    assert structures == fold_resilient(model, records)
+    assert degraded == [] and (1, 40) in predictor.calls
+
+
+def test_windowed(model):
+    (index, sequence), = records = _records(100)
+    predictor, degraded = OutOfMemory(model, max_length=MIN_WINDOW), []
+    structure, = fold_resilient(predictor, records, degraded=degraded)
+    assert structure is not None and len(structure) == len(sequence)
+    assert degraded == [{"index": index, "sequence": sequence, "path": "windowed", "window": MIN_WINDOW}]
+
+
+@pytest.mark.parametrize("length", [MIN_WINDOW // 2, MIN_WINDOW, 100])
+def test_failed(model, length):
+    (index, sequence), = records = _records(length)
+    predictor, degraded = OutOfMemory(model, max_length=8), []
+    assert fold_resilient(predictor, records, degraded=degraded) == [None]
+    assert [(r["index"], r["sequence"], r["path"]) for r in degraded] == [(index, sequence, "failed")]
+    assert "out of memory" in degraded[0]["error"]
+    if length <= MIN_WINDOW:
+        # no window is smaller than the sequence, so it fails without being folded in windows
+        assert predictor.calls == [(1, length)]
+
+
+def test_fold_records_degraded(model):
+    records = _records(40, n=2) + [(2, _records(100)[0][1])]
+    degraded = []
+    results = dict(_fold_records(OutOfMemory(model, max_batch=1, max_length=MIN_WINDOW), records, degraded=degraded))
+    assert sorted(results) == [0, 1, 2] and all(structure is not None for structure in results.values())
+    assert [(r["index"], r["path"]) for r in degraded] == [(2, "windowed")]
+
+
+def test_other_errors_raise(model):
+    def predictor(src):
+        raise RuntimeError("shape mismatch")
+
+    with pytest.raises(RuntimeError, match="shape mismatch"):
+        fold_resilient(predictor, _records(40))
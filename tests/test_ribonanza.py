@@ -0,0 +1,65 @@
+"""Preprocessing and relative position bias of the Ribonanza model."""
+import torch
+from types import SimpleNamespace
+from efold.config import END_TOKEN, PADDING_TOKEN, START_TOKEN
+from efold.models.ribonanza import DynamicPositionalEncoding, Preprocessing
+
+
+def _reference(encoding, seq_len):
+    # the MLP run on every position pair
+    offsets = encoding.positional_encoding[:seq_len, :seq_len].unsqueeze(-1)
+    return encoding._mlp(offsets).permute(2, 0, 1).unsqueeze(0)
+
+
+def test_bias_cache():
+    torch.manual_seed(0)
+    encoding = DynamicPositionalEncoding({"max_len": 16, "num_heads": 4}).eval()
+    sequence = torch.zeros(2, 10, dtype=torch.long)
+    with torch.no_grad():
+        bias = encoding(sequence)
+        assert torch.allclose(bias, _reference(encoding, 10), atol=1e-6)
+        assert encoding(sequence) is bias
+        assert encoding(sequence[:, :6]).shape == (1, 4, 6, 6)
+
+    # the cache is dropped when the weights change in place, by load_state_dict or an optimizer step
+    encoding.load_state_dict(DynamicPositionalEncoding({"max_len": 16, "num_heads": 4}).state_dict())
+    with torch.no_grad():
+        loaded = encoding(sequence)
+        assert torch.allclose(loaded, _reference(encoding, 10), atol=1e-6)
+        assert not torch.allclose(loaded, bias)
+
+    optimizer = torch.optim.SGD(encoding.parameters(), lr=0.1)
+    _reference(encoding, 10).sum().backward()
+    optimizer.step()
+    with torch.no_grad():
+        assert torch.allclose(encoding(sequence), _reference(encoding, 10), atol=1e-6)
+        assert not torch.allclose(encoding(sequence), loaded)
+
+    # training runs the MLP, with gradients
+    encoding.train()
+    assert encoding(sequence).requires_grad
+
+
+def test_sequence_batch():
+    # the padding of the dataset is replaced, whatever it holds
+    sequence = torch.tensor([[1, 2, 3, 4], [4, 3, 9, 9], [2, 0, 0, 0]])
+    batch = SimpleNamespace(get={"sequence": sequence, "length": [4, 2, 1]}.get)
+    S, E, X = START_TOKEN, END_TOKEN, PADDING_TOKEN
+    assert Preprocessing.sequence_batch(batch).tolist() == [
+        [S, 1, 2, 3, 4, E],
+        [S, 4, 3, E, X, X],
+        [S, 2, E, X, X, X],
+    ]
+
+
+def test_structure_batch():
+    structure = torch.rand(2, 5, 5)
+    batch = SimpleNamespace(get={"structure": structure}.get)
+    with torch.inference_mode():
+        validation = Preprocessing.structure_batch(batch)
+    # a batch of the same shape in training gets its own tensor, which it can write to
+    training = Preprocessing.structure_batch(batch)
+    training[:, 0, 0] = 1
+    assert training.shape == (2, 7, 7) and not training.is_inference()
+    assert torch.equal(training[:, 1:-1, 1:-1], structure) and training[:, 1:, 0].eq(0).all() and training[:, -1].eq(0).all()
+    assert validation[:, 0, 0].eq(0).all() and torch.equal(validation[:, 1:-1, 1:-1], structure)
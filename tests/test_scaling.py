@@ -0,0 +1,16 @@
+"""Scaling benchmark of the models of create_model, configured from their training scripts."""
+import pytest
+from efold.benchmark.scaling import TEMPLATES, model_config, benchmark_scaling
+
+
+@pytest.mark.parametrize("name", list(TEMPLATES))
+def test_model_config(name):
+    config = model_config(name)
+    assert config and "wandb" not in config and "model" not in config
+
+
+def test_ribonanza_lengths_capped():
+    report = benchmark_scaling(models=["ribonanza"], lengths=[32, 64, 512], repeats=1)
+    rows = report["results"]
+    assert [row["length"] for row in rows] == [32, 64, 208]
+    assert not any("skipped" in row or "error" in row for row in rows), rows
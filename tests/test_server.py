@@ -0,0 +1,64 @@
+"""Inference server and its client."""
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer
+import pytest
+from efold.api.run import run
+from efold.api.client import Client
+from efold.api.server import Handler, MicroBatcher, UnixHTTPServer
+
+
+@pytest.fixture(params=["http", "unix"])
+def url(request, model, tmp_path):
+    """URL of a server folding with the random eFoldNet, over TCP or a unix socket."""
+    batcher = MicroBatcher(model.forward_sequence, max_batch_size=4, max_latency=0.05)
+    handler = type("BoundHandler", (Handler,), {"batcher": batcher})
+    if request.param == "unix":
+        path = str(tmp_path / "efold.sock")
+        server, url = UnixHTTPServer(path, handler), "unix://" + path
+    else:
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        url = "http://127.0.0.1:{}".format(server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield url
+    server.shutdown()
+    server.server_close()
+    batcher.close()
+
+
+def test_server_structures(packaged, url, sequences):
+    client = Client(url, timeout=60)
+    expected = run(sequences)
+    assert client.fold(sequences) == [expected[seq] for seq in sequences]
+    assert run(sequences, fmt="bp", server=url) == run(sequences, fmt="bp")
+
+    # concurrent requests of the same length are folded in shared batches, with the same structures
+    with ThreadPoolExecutor(8) as pool:
+        structures = list(pool.map(lambda seq: client.fold([seq])[0], sequences[-1:] * 8))
+    assert structures == [expected[sequences[-1]]] * 8
+    stats = client.stats()
+    assert stats["errors"] == 0 and stats["sequences"] == stats["completed"] == 2 * len(sequences) + 8
+    assert stats["batches"] < stats["sequences"]
+
+
+def test_server_errors(url):
+    client = Client(url, timeout=60)
+    with pytest.raises(RuntimeError, match="efold server error"):
+        client.fold(["GGGAAZUCC"])
+    # an unknown format is refused before folding
+    with pytest.raises(RuntimeError, match="Invalid format"):
+        client.fold(["GGGAAAUCC"], fmt="ct")
+    assert client.stats()["sequences"] == 1
+
+
+def test_throughput_past_latency_window(model):
+    batcher = MicroBatcher(model.forward_sequence, max_latency=0.01)
+    # the latencies only keep the last ones, the throughput counts every completed sequence
+    batcher._latencies = deque(maxlen=2)
+    batcher.fold(["GGGAAAUCC"] * 5)
+    stats = batcher.stats()
+    batcher.close()
+    assert stats["completed"] == 5
+    assert stats["throughput_seq_per_s"] * stats["uptime_s"] == pytest.approx(5)
@@ -0,0 +1,71 @@
+"""Streaming inference."""
+import asyncio
+import time
+import efold.api.run
+from efold.api import predict_iter, apredict_iter
+from efold.api.run import run
+
+
+def test_predict_iter(packaged, sequences, tmp_path):
+    expected = run(sequences)
+    records = [(i, seq) for i, seq in enumerate(sequences + sequences[:1])]
+    # a window smaller than the stream, so batches are folded while records are read
+    results = list(predict_iter(records, batch_size=2, window=2))
+    assert sorted(results) == [(i, seq, expected[seq]) for i, seq in records]
+
+    fasta = tmp_path / "sequences.fasta"
+    fasta.write_text("".join(">seq{}\n{}\n".format(i, seq) for i, seq in enumerate(sequences)))
+    results = {rid: structure for rid, _, structure in predict_iter(str(fasta), memory_budget=2**30)}
+    assert results == {"seq{}".format(i): expected[seq] for i, seq in enumerate(sequences)}
+
+
+def test_apredict_iter(packaged, sequences):
+    expected = run(sequences)
+
+    async def records():
+        for seq in sequences:
+            await asyncio.sleep(0)
+            yield seq
+
+    async def consume():
+        return [result async for result in apredict_iter(records(), batch_size=2, window=2, max_pending=1)]
+
+    results = asyncio.run(consume())
+    assert sorted(results) == sorted((i, seq, expected[seq]) for i, seq in enumerate(sequences))
+
+
+def test_apredict_iter_max_pending(packaged, monkeypatch):
+    postprocess = efold.api.run._postprocess
+    submitted, consumed, in_flight = [0], [0], []
+
+    def counting(*args):
+        submitted[0] += 1
+        in_flight.append(submitted[0] - consumed[0])
+        time.sleep(0.001)
+        return postprocess(*args)
+
+    monkeypatch.setattr(efold.api.run, "_postprocess", counting)
+
+    async def consume():
+        # all the records are buffered and folded in one flush of the default window
+        async for _ in apredict_iter(["GGGAAAUCC"] * 40, postprocess_workers=16, max_pending=4):
+            consumed[0] += 1
+
+    asyncio.run(consume())
+    assert consumed[0] == 40 and max(in_flight) <= 4
+
+
+def test_predict_iter_slow_source(packaged):
+    read = []
+
+    def records():
+        for i in range(5):
+            time.sleep(0.05)
+            read.append(i)
+            yield "GGGAAAUCC"
+
+    # the first structure comes before the source is exhausted, although the window is not full
+    results = predict_iter(records(), max_wait=0.02)
+    next(results)
+    assert len(read) < 5
+    assert len(list(results)) == 4
@@ -0,0 +1,72 @@
+"""Timing spans, their exports and the profiler switch."""
+import csv
+import json
+import time
+import pytest
+from efold.util import timing
+
+
+@pytest.fixture(autouse=True)
+def clean():
+    timing.disable()
+    timing.reset()
+    yield
+    timing.disable()
+    timing.reset()
+
+
+def test_disabled_spans():
+    with timing.span("stage"):
+        pass
+    assert timing.span("stage") is timing.span("other")
+    assert timing.timed("call")(lambda x: x + 1)(1) == 2
+    assert timing.timings() == {}
+
+
+def test_nested_spans():
+    @timing.timed("inner")
+    def inner():
+        time.sleep(0.002)
+
+    with timing.collect():
+        for _ in range(3):
+            with timing.span("outer"):
+                inner()
+                with timing.span("inner"):
+                    pass
+    with timing.span("outer"):
+        pass  # collect() restores the disabled state
+
+    stats = timing.summary()
+    assert stats["outer"]["count"] == 3 and stats["inner"]["count"] == 6
+    assert stats["outer"]["total_s"] >= stats["inner"]["total_s"] >= 3 * 0.002
+    assert sum(stats["inner"]["histogram"].values()) == 6
+    assert stats["inner"]["max_s"] >= stats["inner"]["p50_s"]
+
+
+def test_export(tmp_path):
+    with timing.collect():
+        for name in ["encode", "encode", "predict"]:
+            with timing.span(name):
+                pass
+    timing.export(str(tmp_path / "timings.json"))
+    timing.export(str(tmp_path / "timings.csv"))
+
+    with open(tmp_path / "timings.json") as f:
+        stats = json.load(f)
+    assert {name: s["count"] for name, s in stats.items()} == {"encode": 2, "predict": 1}
+    with open(tmp_path / "timings.csv") as f:
+        rows = {row["span"]: row for row in csv.DictReader(f)}
+    assert {name: int(row["count"]) for name, row in rows.items()} == {"encode": 2, "predict": 1}
+    assert float(rows["encode"]["total_s"]) == pytest.approx(stats["encode"]["total_s"])
+    assert "histogram" not in rows["encode"]
+
+
+def test_profile(tmp_path):
+    path = tmp_path / "trace.json"
+    with timing.profile(str(path)):
+        with timing.span("stage"):
+            sum(range(1000))
+    assert timing.summary()["stage"]["count"] == 1
+    with open(path) as f:
+        assert any(event.get("name") == "stage" for event in json.load(f)["traceEvents"])
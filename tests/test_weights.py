@@ -0,0 +1,35 @@
+"""Round trip of eFoldNet weights through the safetensors writer and loader."""
+import json
+import torch
+from conftest import HPARAMS
+from efold.api.weights import save_weights, load_weights, load_efold, convert_weights
+from efold.api.run import _encode
+
+
+def test_state_dict_round_trip(model, tmp_path):
+    path = str(tmp_path / "efold.safetensors")
+    save_weights(model.state_dict(), path, {"model": "efold", "hparams": HPARAMS})
+    state_dict, manifest = load_weights(path)
+    assert manifest["hparams"] == HPARAMS
+    assert state_dict.keys() == model.state_dict().keys()
+    for name, tensor in model.state_dict().items():
+        assert state_dict[name].shape == tensor.shape and torch.equal(state_dict[name], tensor), name
+
+
+def test_load_efold_same_logits(model, sequences, tmp_path):
+    path = str(tmp_path / "efold.safetensors")
+    save_weights(model.state_dict(), path, {"model": "efold", "hparams": HPARAMS})
+    loaded = load_efold(path)
+    src = _encode(sequences)
+    with torch.inference_mode():
+        assert torch.equal(loaded.forward_sequence(src), model.forward_sequence(src))
+
+
+def test_convert_weights(model, tmp_path):
+    src, dst = str(tmp_path / "efold.pt"), str(tmp_path / "efold.safetensors")
+    torch.save(model.state_dict(), src)
+    (tmp_path / "efold.json").write_text(json.dumps({"model": "efold", "hparams": HPARAMS}))
+    convert_weights(src, dst)
+    # the 0-dim batch norm counters
+    name = "output_structure.0.res_blocks.0.bn1.num_batches_tracked"
+    assert load_weights(dst)[0][name].shape == () and torch.equal(load_weights(dst)[0][name], model.state_dict()[name])
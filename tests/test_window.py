@@ -0,0 +1,52 @@
+"""Windowed and banded folding of long sequences."""
+import pytest
+import torch
+from efold.api.run import _encode, _fold, _predict_logits
+from efold.api.window import fold_banded, fold_windowed, predict_windowed
+
+SEQUENCE = "GGGGAAAACCCCUUUUGGGGAAAACCCCAUGCUAGCUAGCUGAUCGAUGGGAAAUCCCAAGGGCUUU"
+
+
+def test_predict_windowed_band():
+    def predictor(src):
+        return torch.full(src.shape + src.shape[-1:], 2.0)
+
+    L, window, stride = len(SEQUENCE), 24, 8
+    rows, cols, probabilities = predict_windowed(predictor, SEQUENCE, window=window, stride=stride, consensus="mean")
+    # every pair within max_span = window - stride is seen by a window, and no other pair
+    span = window - stride
+    assert sorted(zip(rows.tolist(), cols.tolist())) == [(i, j) for i in range(L) for j in range(i + 1, min(i + span, L - 1) + 1)]
+    assert torch.allclose(probabilities, torch.sigmoid(torch.tensor(2.0)))
+    with pytest.raises(ValueError):
+        predict_windowed(predictor, SEQUENCE, window=window, stride=stride, max_span=span + 1)
+
+
+def test_predict_windowed_consensus(model):
+    L, window = len(SEQUENCE), 32
+    rows, cols, probabilities = predict_windowed(model.forward_sequence, SEQUENCE, window=window, stride=8)
+    # the pairs of the first window that no other window sees keep the probabilities of that window
+    first = torch.sigmoid(_predict_logits(model.forward_sequence, [SEQUENCE[:window]])[0])
+    only_first = (rows < 8) & (cols < window)
+    assert torch.allclose(probabilities[only_first], first[rows[only_first], cols[only_first]], atol=1e-5)
+    assert ((probabilities >= 0) & (probabilities <= 1)).all()
+    structure = fold_windowed(model.forward_sequence, SEQUENCE, "bp", window=window, stride=8)
+    assert all(0 < j - i <= window - 8 for i, j in structure)
+
+
+def test_banded(model):
+    L = len(SEQUENCE)
+    src = _encode([SEQUENCE, SEQUENCE[:40]])
+    with torch.inference_mode():
+        dense = model.forward_sequence(src)
+        # a band covering the whole sequence gives the dense logits, in the (L, 2 * band + 1) layout
+        band = L - 1
+        banded = model.forward_sequence(src, band=band)
+    assert banded.shape == (2, L, 2 * band + 1)
+    i, d = torch.meshgrid(torch.arange(L), torch.arange(2 * band + 1), indexing="ij")
+    j = i + d - band
+    inside = (j >= 0) & (j < L)
+    assert torch.allclose(banded[0][inside], dense[0][i[inside], j[inside]], atol=1e-3)
+    assert (banded[:, ~inside] == 0).all()
+
+    assert fold_banded(model.forward_sequence, SEQUENCE, band=L, fmt="bp") == _fold(model.forward_sequence, SEQUENCE, "bp")
+    assert all(j - i <= 8 for i, j in fold_banded(model.forward_sequence, SEQUENCE, band=8, fmt="bp"))
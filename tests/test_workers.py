@@ -0,0 +1,27 @@
+"""Multi-process CPU inference."""
+import pytest
+from efold.api.run import run
+from efold.api.workers import predict_sharded
+
+
+@pytest.mark.parametrize("workers", [0, -1, 1.5, "many"])
+def test_invalid_workers(sequences, workers):
+    with pytest.raises(ValueError):
+        run(sequences, workers=workers)
+    with pytest.raises(ValueError):
+        predict_sharded(sequences, workers=workers)
+
+
+def test_workers_same_structures(packaged, sequences):
+    structures = run(sequences, workers=2)
+    assert structures == run(sequences)
+    assert any("(" in structure for structure in structures.values())
+
+
+def test_workers_options(packaged, sequences):
+    # the options of run() apply in the workers too: the longest sequence is folded in windows
+    degraded = []
+    structures = run(sequences, workers=2, window=16, batch_size=1, degraded=degraded)
+    assert structures == run(sequences, window=16, batch_size=1)
+    assert structures != run(sequences)
+    assert degraded == []